@@ -22,6 +22,11 @@ import os
 
 import sympy
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.free_slip import RotationNullSpace, add_free_slip_bc
+
 
 
 
@@ -52,11 +57,12 @@ res = 0.075
 
 # +
 ### FS - free slip top, no slip base
+### FF - free slip top and base (rigid rotation null space)
 ### NS - no slip top and base
 boundaryConditions = 'FS'
 
 
-outputPath = f'./output/FAC-mantleConvection-{boundaryConditions}-res={res}-penaltyMethod/'
+outputPath = f'./output/FAC-mantleConvection-{boundaryConditions}-res={res}/'
 
 if uw.mpi.rank == 0:
     # checking if the directory demo_folder 
@@ -90,8 +96,7 @@ if uw.mpi.size == 1:
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, -5.0]
 
-    meshball.vtk(outputPath+"ignore_meshball.vtk")
-    pvmesh = pv.read(outputPath+"ignore_meshball.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     pl = pv.Plotter()
 
@@ -112,7 +117,6 @@ visc         = uw.discretisation.MeshVariable(r"\eta", meshball, 1, degree=1, co
 
 SR         = uw.discretisation.MeshVariable(r"\SR", meshball, 1, degree=1, continuous=True)
 
-meshr        = uw.discretisation.MeshVariable(r"r", meshball, 1, degree=1)
 # -
 
 
@@ -211,9 +215,7 @@ adv_diff.add_dirichlet_bc(T_surf, "Upper")
 with meshball.access(t_0, t_soln):
     t_0.data[...] = uw.function.evaluate(init_t, t_0.coords, meshball.N).reshape(-1, 1)
     t_soln.data[...] = t_0.data[...]
-    
-with meshball.access(meshr):
-    meshr.data[:, 0] = uw.function.evaluate(sympy.sqrt(x**2 + y**2), meshball.data, meshball.N)  # cf radius_fn which is 0->1
+
 # +
 import sympy
 
@@ -226,117 +228,6 @@ gravity_fn = radius_fn
 
 
 
-# +
-hw = 1e6 / meshball.get_min_radius()
-
-### mark the surface nodes
-surface_fn = sympy.exp(-(((meshr.sym[0] - rO) / rO) ** 2) * hw)
-
-### mark the base nodes
-base_fn = sympy.exp(-(((meshr.sym[0] - rI) / rO) ** 2) * hw)
-
-import matplotlib.pyplot as plt
-plt.scatter(meshball.data[:,0], meshball.data[:,1], c = uw.function.evalf(surface_fn, meshball.data))
-# -
-
-inner_boundary = sympy.sqrt(x**2 + y**2) <= rI+1e-14
-outer_boundary = sympy.sqrt(x**2 + y**2) >= rO-1e-14
-
-
-
-import matplotlib.pyplot as plt
-plt.scatter(meshball.data[:,0], meshball.data[:,1], c = uw.function.evalf(outer_boundary, meshball.data))
-
-# +
-### 2D boundary normal
-
-# Define symbolic variables for Cartesian coordinates and the radius
-x, y = sympy.symbols('x y')
-R1, R2 = rI+1e-6, rO-1e-6 #sympy.symbols('R1 R2', positive=True)
-
-# Define the inequalities for the annulus
-inner_inequality = R1 <= x**2 + y**2
-outer_inequality = x**2 + y**2 <= R2
-
-# Combine the inequalities into an equation for the annulus
-annulus_equation = inner_inequality # sympy.And(inner_inequality, outer_inequality)
-
-# Compute the gradient of the annulus equation to obtain the normal vector
-inner_normal_vector = sympy.simplify(sympy.Matrix([sympy.diff(inner_inequality, var) for var in (x, y)]))
-
-outer_normal_vector = sympy.simplify(sympy.Matrix([sympy.diff(outer_inequality, var) for var in (x, y)]))
-
-
-# Disympylay the simplified inner and outer boundary normals
-print("Simplified Inner Boundary Normal:")
-sympy.pprint(inner_normal_vector)
-
-print("\nSimplified Outer Boundary Normal:")
-sympy.pprint(outer_normal_vector)
-
-# +
-# Define symbolic variables for velocity components and the inner boundary normal
-Vx, Vy = sympy.symbols('Vx Vy')
-inner_normal = inner_normal  # Use the symbolic inner boundary normal from your code
-
-# Define the radial velocity vector as a combination of Vx and Vy
-V_radial = Vx * inner_normal[0] + Vy * inner_normal[1]
-
-# +
-import petsc4py
-petsc4py.init()
-from petsc4py import PETSc
-import numpy as np
-
-# Define the mesh parameters
-n = 50  # Number of grid points
-rI = 1.0  # Inner radius
-rO = 2.0  # Outer radius
-dx = (rO - rI) / n
-
-# Create a PETSc DMDA (Distributed Array) to represent the grid
-da = PETSc.DMDA().create([n, n], dof=2, stencil_width=1)
-da.setUniformCoordinates(rI, rO, rI, rO)
-
-# +
-# Create PETSc objects for the solution (velocity field) and right-hand side (RHS)
-x = da.createGlobalVec()
-rhs = da.createGlobalVec()
-
-# Define the Laplace equation coefficients and source term
-coeff = 1.0  # Coefficient for Laplace operator
-source = 1.0  # Constant source term
-
-# Create local vectors for applying free-slip boundary conditions
-localX = da.createLocalVec()
-localRHS = da.createLocalVec()
-
-# -
-
-da.getCoordinates().array.reshape(-1, 2).shape
-
-# +
-import sympy as sp
-
-# Define symbolic variables and parameters
-x, y = sp.symbols('x y')
-u, v, p = sp.symbols('u v p')
-mu = sp.symbols('mu', positive=True)
-sigma = sp.symbols('sigma', positive=True)
-
-# Define the boundary conditions (e.g., no-slip at all boundaries)
-u_bc = 0
-v_bc = 0
-
-# Define the test functions
-v_test = sp.TestFunction(u.function_space())
-p_test = sp.TestFunction(p.function_space())
-
-# Define the weak form of the Stokes equations
-weak_form_u = -sp.div(p_test) + mu * sp.div(sp.grad(u)) + sigma * (u - u_bc) * v_test
-weak_form_v = -sp.div(p_test) + mu * sp.div(sp.grad(v)) + sigma * (v - v_bc) * v_test
-weak_form_p = sp.div(u) * p_test
-
 # +
 ### set up bouyancy force
 buoyancy_force = Ra_number * T_density
@@ -344,32 +235,25 @@ stokes.bodyforce = buoyancy_force * -1 * unit_rvec
 
 # Add boundary conditions
 if boundaryConditions == 'FS':
-
-    hw = 1000.0 / meshball.get_min_radius()
-    
-    ### mark the surface nodes
-    surface_fn = sympy.exp(-(((meshr.sym[0] - rO) / rO) ** 2) * hw)
-    
-    ### mark the base nodes
-    base_fn = sympy.exp(-(((meshr.sym[0] - rI) / rO) ** 2) * hw)
-
-    free_slip_penalty_upper = v_soln.sym.dot(unit_rvec) * unit_rvec * surface_fn
-    free_slip_penalty_lower = v_soln.sym.dot(unit_rvec) * unit_rvec * base_fn
-    
-    ### Buoyancy force RHS plus free slip surface enforcement
-    ptf = 1e6
-    penalty_terms_upper = ptf * free_slip_penalty_upper
-    penalty_terms_lower = ptf * free_slip_penalty_lower
-    
-    ### Free slip upper
-    stokes.bodyforce -= penalty_terms_upper # - penalty_terms_lower
+    ### Free slip upper: penalty on the normal velocity on the boundary facets, scaled by viscosity / cell size
+    add_free_slip_bc(stokes, "Upper", viscosity=mu)
     
     ### No slip lower
     stokes.add_dirichlet_bc((0.0, 0.0), meshball.boundaries.Lower.name, (0, 1))
+elif boundaryConditions == 'FF':
+    add_free_slip_bc(stokes, "Upper", viscosity=mu)
+    add_free_slip_bc(stokes, "Lower", viscosity=mu)
 else:  
     stokes.add_dirichlet_bc((0.0, 0.0), "Upper", (0, 1))
     stokes.add_dirichlet_bc((0.0, 0.0), "Lower", (0, 1))
 
+### with free slip on both boundaries GAMG gets the rigid body modes and the net rotation is removed after each solve
+if boundaryConditions == 'FF':
+    stokes_nullspace = RotationNullSpace(stokes)
+    solve_stokes = stokes_nullspace.solve
+else:
+    solve_stokes = stokes.solve
+
 # +
 # ### set up linear viscosity
 # UM_visc = mu
@@ -391,7 +275,11 @@ stokes.tolerance                  = 1e-8
 
 
 # check the stokes solve converges
-stokes.solve(zero_init_guess=True)
+solve_stokes(zero_init_guess=True)
+
+### compare with the NS runs, the free slip constraint should not cost extra iterations
+if uw.mpi.rank == 0:
+    print(f"{boundaryConditions} initial solve: {stokes.snes.getLinearSolveIterations()} linear iterations", flush=True)
 
 # +
 # check the mesh if in a notebook / serial
@@ -410,7 +298,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    pvmesh = pv.read(outputPath+"ignore_meshball.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     with meshball.access():
         usol = stokes.u.data.copy()
@@ -511,7 +399,7 @@ while step < 101:
         
 
 
-    stokes.solve(zero_init_guess=False)
+    solve_stokes(zero_init_guess=False)
     delta_t = adv_diff.estimate_dt()
     adv_diff.solve(timestep=delta_t)
     
@@ -21,6 +21,11 @@ import numpy as np
 import sympy
 from copy import deepcopy 
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.topology import boundary_facets
+
 # %% [markdown]
 # ### Set parameters to use 
 
@@ -96,8 +101,7 @@ if uw.mpi.size == 1:
     pv.global_theme.show_edges = True
     pv.global_theme.axes.show = True
 
-    meshbox.vtk("tmp_box_mesh.vtk")
-    pvmesh = pv.read("tmp_box_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshbox)
     pl = pv.Plotter()
 
     # pl.add_mesh(pvmesh,'Black', 'wireframe', opacity=0.5)
@@ -322,8 +326,7 @@ def plotFig(meshbox, s_field, v_field, s_field_name, save_fname = None, with_arr
         #pv.global_theme.jupyter_backend = "panel"
         pv.global_theme.smooth_shading = True
 
-        meshbox.vtk("tmp_box_mesh.vtk")
-        pvmesh = pv.read("tmp_box_mesh.vtk")
+        pvmesh = mesh_to_pyvista(meshbox)
 
         velocity = np.zeros((meshbox.data.shape[0], 3))
         velocity[:, 0] = uw.function.evaluate(v_field.sym[0], meshbox.data)
@@ -723,13 +726,11 @@ def calculate_topography(coord): # only coord has local scope
 e1 = calculate_topography(np.array([[0, boxHeight]]))
 e2 = calculate_topography(np.array([[boxLength, boxHeight]]))
 
-# calculate the x-coordinate with zero stress
-with meshbox.access():
-    cond = meshbox.data[:, 1] == meshbox.data[:, 1].max()
-    up_surface_coords = meshbox.data[cond]
-    up_surface_coords[:, 1] = 0.999999*up_surface_coords[:, 1]
-
-abs_topo = abs(calculate_topography(up_surface_coords))
+# calculate the x-coordinate with zero stress, at the vertices of the "Top" boundary of all ranks
+# (evaluated just inside their cells, see benchmark_utils/topology.py)
+top_boundary = boundary_facets(meshbox, "Top")
+abs_topo = abs(calculate_topography(top_boundary.inside(at="vertices")))
+up_surface_coords, abs_topo = top_boundary.gather(abs_topo)
 
 min_abs_topo_coord = up_surface_coords[np.where(abs_topo == abs_topo.min())[0]].flatten()
 
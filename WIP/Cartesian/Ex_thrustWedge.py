@@ -55,6 +55,13 @@ from petsc4py import PETSc
 import underworld3 as uw
 from underworld3.systems import Stokes
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.lithostatic import LithostaticPressure
+from benchmark_utils.surface import SurfaceEvolution
+from benchmark_utils.materials import MaterialTable, linear_weakening
+
 options = PETSc.Options()
 
 options["snes_converged_reason"] = None
@@ -115,7 +122,6 @@ v       = uw.discretisation.MeshVariable("V", mesh, mesh.dim, degree=2)
 p       = uw.discretisation.MeshVariable("P", mesh, 1, degree=1)
 
 lithoP  = uw.discretisation.MeshVariable("P_l", mesh, 1, degree=2)
-vlithoP = uw.discretisation.MeshVariable("V_l", mesh, mesh.dim, degree=2)
 
 ### strain rate and velocity should have same degree for projection
 strain_rate_inv2 = uw.discretisation.MeshVariable("SR", mesh, 1, degree=v.degree)
@@ -133,28 +139,39 @@ stokes = uw.systems.Stokes(mesh, velocityField=v, pressureField=p,)
 stokes.constitutive_model = uw.systems.constitutive_models.ViscousFlowModel(v)
 
 # %% [markdown]
-# #### Solver for lithostatic pressure calc
+# ### Material properties
+# One value per material, in the order of the material index
 
 # %%
-lithoP_solver = uw.systems.SteadyStateDarcy(mesh, lithoP, vlithoP, solver_name='lithoP_solver')
-lithoP_solver.constitutive_model = uw.systems.constitutive_models.DiffusionModel(lithoP)
-lithoP_solver.constitutive_model.Parameters.diffusivity = 1e-6
-lithoP_solver.petsc_options.delValue("ksp_monitor")
+airIndex       = 0
+ridgidBase     = 1
+fritionalBase  = 2
+sediment0      = 3
+sediment1      = 4
+
+nd_air_density = nd(1. * u.kilogram / u.metre**3)
+
+nd_rock_density = nd(2700 * u.kilogram / u.metre**3)
+
+minVisc = nd(1e19*u.pascal*u.second)
+maxVisc = nd(1e23*u.pascal*u.second)
+
+airViscosity            = nd(1e19*u.pascal*u.second)
+rigidBaseViscosity      = nd(1e23*u.pascal*u.second)
+frictionalBaseVsicosity = nd(1e23*u.pascal*u.second)
+materialViscosity       = nd(1e23*u.pascal*u.second)
 
 
-def determine_lithostatic_pressure(bodyforce, solver=lithoP_solver): 
-    solver.f = 0.
-    solver.s = bodyforce
-    solver.add_dirichlet_bc(0.0, "Top")
-    solver.solve(zero_init_guess=True)
-    # with mesh.access(lithoP):
-    #     lithoP.data[lithoP.data <= nd(1*u.atmosphere)] = nd(1*u.atmosphere)
+sedCohesion = nd(20*u.megapascal)
+FBCohesion = nd(0.1*u.megapascal)
 
+sedCohesion_w = sedCohesion / 5 #nd(4*u.megapascal)
+FBCohesion_w = FBCohesion / 5
 
 # %% [markdown]
 # ### Create swarm and swarm vars
-# - 'swarm.add_variable' is a traditional swarm, can't be used to map material properties. Can be used for sympy operations, similar to mesh vars.
-# - 'uw.swarm.IndexSwarmVariable', creates a mask for each material and can be used to map material properties. Can't be used for sympy operations.
+# - 'swarm.add_variable' is a traditional swarm variable, can be used for sympy operations, similar to mesh vars.
+# - 'MaterialTable' looks up the property values of each particle's material index and evaluates the strain weakening and the yield-limited viscosity on the particles, with one proxy per property however many materials there are.
 #
 
 # %%
@@ -164,10 +181,39 @@ swarm  = uw.swarm.Swarm(mesh)
 ## # Add variable for material
 materialVariable      = swarm.add_variable(name="material", size=1, dtype=PETSc.IntType, proxy_degree=1)
 
-material              = uw.swarm.IndexSwarmVariable("M", swarm, indices=5, proxy_degree=1) 
-
 strain                = swarm.add_variable(name="strain", size=1, dtype=PETSc.RealType, proxy_degree=1)
 
+### viscosity of the particles, limited by the yield stress of the materials that yield
+def yield_viscosity(p):
+    viscosity = np.array(p["viscosity"])
+    yields = p["yields"] > 0
+
+    ### lithostatic pressure at the particles (zero until it is first solved)
+    P = np.asarray(uw.function.evalf(lithoP.sym[0], swarm.data)).reshape(-1)[yields]
+    tau = p["cohesion"][yields] * np.cos(p["friction"][yields]) + P * np.sin(p["friction"][yields])
+
+    viscosity[yields] = p["min_viscosity"][yields] + 1 / ((1 / viscosity[yields]) + (1 / tau))
+    return viscosity
+
+### airIndex, ridgidBase, fritionalBase, sediment0, sediment1
+materials = MaterialTable(swarm, materialVariable, {
+    "density":       [nd_air_density, nd_rock_density, nd_rock_density, nd_rock_density, nd_rock_density],
+    "viscosity":     [airViscosity, rigidBaseViscosity, frictionalBaseVsicosity, materialViscosity, materialViscosity],
+    ### air and the rigid base do not yield and keep their viscosity
+    "yields":        [0., 0., 1., 1., 1.],
+    "min_viscosity": [0., 0., minVisc, minVisc, minVisc],
+    "C0":            [0., 0., FBCohesion, sedCohesion, sedCohesion],
+    "C1":            [0., 0., FBCohesion_w, sedCohesion_w, sedCohesion_w],
+    "fc0":           [0., 0., np.tan(np.radians(12.0)), np.tan(np.radians(25.0)), np.tan(np.radians(25.0))],
+    "fc1":           [0., 0., np.tan(np.radians(6.0)), np.tan(np.radians(20.0)), np.tan(np.radians(20.0))],
+}, laws={
+    ### strain weakening, evaluated on the particles
+    "cohesion": lambda p: linear_weakening(strain.data[:,0], p["C0"], p["C1"], 0.01, 0.06),
+    "friction": lambda p: linear_weakening(strain.data[:,0], p["fc0"], p["fc1"], 0.01, 0.06),
+    ### the finished viscosity of each particle, so the proxy only blends viscosities across material boundaries
+    "yield_viscosity": yield_viscosity,
+}, proxies=["density", "yield_viscosity"])
+
 swarm.populate(4)
 
 # # Add some randomness to the particle distribution
@@ -181,23 +227,12 @@ swarm.populate(4)
 
 
 # %% [markdown]
-# ##### passive swarm to track the surface
+# ##### Surface tracking
+# The surface heights at 500 fixed x positions are held by a swarm, so each rank advects and diffuses the part of the surface in its own part of the mesh and only exchanges the ends with its neighbours
 
 # %%
-surfaceSwarm = uw.swarm.Swarm(mesh)
-
-# %%
-x = np.linspace(mesh.data[:,0].min(), mesh.data[:,0].max(), 500 )
-y = np.zeros_like(x)
-
-# %%
-surface_coords = np.ascontiguousarray(np.array([x,y]).T)
-
-# %%
-surfaceSwarm.add_particles_with_coordinates(surface_coords)
-
-# %%
-from scipy.interpolate import griddata, interp1d
+surface = SurfaceEvolution(mesh, n_nodes=500, height=0., 
+                           diffusivity=nd(1e-6*u.meter**2/u.second))
 
 # %% [markdown]
 # #### Project fields to mesh vars
@@ -278,13 +313,6 @@ def update_strain(dt, strain_var, healingRate=0.):
 # %% [markdown]
 # ### Update the material variable of the swarm
 
-# %%
-airIndex       = 0
-ridgidBase     = 1
-fritionalBase  = 2
-sediment0      = 3
-sediment1      = 4
-
 # %% [markdown]
 # ###### Create a layered material
 
@@ -301,7 +329,7 @@ sed0_list = np.arange(top_pile, bottom_pile-layer_thickness, -2*layer_thickness)
 sed_list = np.arange(top_pile, bottom_pile-layer_thickness, -layer_thickness)
 
 # %%
-with swarm.access(materialVariable, material):
+with swarm.access(materialVariable):
     materialVariable.data[:] = airIndex
     for i in sed_list:
         if np.isin(i, sed0_list):
@@ -313,8 +341,8 @@ with swarm.access(materialVariable, material):
     
     materialVariable.data[swarm.data[:,1] <= ymin+nd(1*u.kilometer)]   = fritionalBase
     materialVariable.data[swarm.data[:,1] <= ymin+nd(0.5*u.kilometer)] = ridgidBase
-    
-    material.data[:,0] = materialVariable.data[:,0]
+
+materials.update()
     
     
         
@@ -337,8 +365,7 @@ def plot_mat():
     pv.global_theme.smooth_shading = True
 
 
-    mesh.vtk("tempMsh.vtk")
-    pvmesh = pv.read("tempMsh.vtk") 
+    pvmesh = mesh_to_pyvista(mesh)
 
     with swarm.access():
         points = np.zeros((swarm.data.shape[0],3))
@@ -380,61 +407,30 @@ if render == True:
 # %%
 nd_gravity = nd(9.81*u.meter/u.second**2)
 
-nd_air_density = nd(1. * u.kilogram / u.metre**3)
-
-nd_rock_density = nd(2700 * u.kilogram / u.metre**3)
-
-density_fn = material.createMask([nd_air_density, nd_rock_density, nd_rock_density, nd_rock_density, nd_rock_density])
+density_fn = materials["density"]
 
 
 
 
 stokes.bodyforce =  sympy.Matrix([0, -1 * nd_gravity*density_fn])
 
-# %%
-stokes.bodyforce
-
+# %% [markdown]
+# #### Lithostatic pressure
+# The density is integrated down each column of lithoP nodes (the mesh is structured, so the columns are exact), with one allreduce of the column table instead of a global solve
 
 # %%
-def determine_lithostatic_pressure(dt):
-    update_density()
-    if uw.mpi.rank == 0:
-        print('calculating lithostatic pressure')
-
-    ### get original coords
-    with surfaceSwarm.access(surfaceSwarm.particle_coordinates):
-        x_old = uw.utilities.gather_data(surfaceSwarm.particle_coordinates.data[:,0], bcast=True)
-        y_old = uw.utilities.gather_data(surfaceSwarm.particle_coordinates.data[:,1], bcast=True)
-
-    ### advect surface
-    with surfaceSwarm.access():
-        v_x = uw.utilities.gather_data(uw.function.evalf(v.sym[0], surfaceSwarm.data), bcast=True)
-        v_y = uw.utilities.gather_data(uw.function.evalf(v.sym[1], surfaceSwarm.data), bcast=True)
-        
-    x_new = x_old + (v_x*dt)
-    y_new = y_old + (v_y*dt)
-
-    ### create an interpolated surface from the new coordinates
-    f = interp1d(x_new, y_new, kind='cubic', fill_value='extrapolate')
-    
-    ### update the y coords only of the passive tracers
-    with surfaceSwarm.access(surfaceSwarm.particle_coordinates):
-        surfaceSwarm.particle_coordinates.data[:,1] = f(surfaceSwarm.particle_coordinates.data[:,0])
+lithostatic = LithostaticPressure(lithoP, density_fn, nd_gravity, 
+                                  surface_pressure=nd(1*u.atmosphere), minimum=nd(1*u.atmosphere))
 
-    ### calculate the density based on rho*g*h
-    with mesh.access(lithoP, density_proj):
-        rho = density_proj.data[:,0]
-        g = nd_gravity
-        h = f(lithoP.coords[:,0]) - lithoP.coords[:,1] ### dh between point and surface
-        lithoP.data[:,0] = rho  * g * h ### rho * g * h
-        lithoP.data[lithoP.data < 0] = nd(1*u.atmosphere)
+# %%
+stokes.bodyforce
 
 
 # %%
-determine_lithostatic_pressure(dt=0)
+lithostatic.solve()
 
-# %%
-# determine_lithostatic_pressure(bodyforce=stokes.bodyforce, solver=lithoP_solver)
+### the yield-limited viscosity of the particles with the lithostatic pressure
+materials.update()
 
 # %%
 if uw.mpi.size == 1 and uw.is_notebook:
@@ -456,8 +452,7 @@ if uw.mpi.size == 1 and uw.is_notebook:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with mesh.access():
         usol = v.data.copy()
@@ -580,62 +575,8 @@ stokes.solve(zero_init_guess=True)
 # #### add in NL viscosity for solve loop
 
 # %%
-minVisc = nd(1e19*u.pascal*u.second)
-maxVisc = nd(1e23*u.pascal*u.second)
-
-# %%
-airViscosity            = nd(1e19*u.pascal*u.second)
-rigidBaseViscosity      = nd(1e23*u.pascal*u.second)
-frictionalBaseVsicosity = nd(1e23*u.pascal*u.second)
-materialViscosity       = nd(1e23*u.pascal*u.second)
-
-
-sedCohesion = nd(20*u.megapascal)
-FBCohesion = nd(0.1*u.megapascal)
-
-sedCohesion_w = sedCohesion / 5 #nd(4*u.megapascal)
-FBCohesion_w = FBCohesion / 5
-
-
-# %%
-def material_weakening_piecewise(strain_var, val1, val2, epsilon1, epsilon2):
-    val = sympy.Piecewise(  (val1, strain_var.sym[0] < epsilon1),
-                            (val2, strain_var.sym[0] > epsilon2),
-                            (val1 + ((val1 - val2) / (epsilon1 - epsilon2)) * (strain_var.sym[0] - epsilon1), True) )
-    
-    return val 
-
-
-# %%
-C_sed = material_weakening_piecewise(strain, sedCohesion, sedCohesion_w, 0.01, 0.06)
-C_FB  = material_weakening_piecewise(strain, FBCohesion, FBCohesion_w, 0.01, 0.06)
-
-fc_sed = material_weakening_piecewise(strain, np.tan(np.radians(25.0)), np.tan(np.radians(20.0)), 0.01, 0.06)
-fc_FB =  material_weakening_piecewise(strain, np.tan(np.radians(12.0)), np.tan(np.radians(6.0)), 0.01, 0.06)
-                                                     
-                                                     
-tau_sed = (C_sed * sympy.cos(fc_sed))  + (lithoP.sym[0] * sympy.sin(fc_sed))                                                     
-tau_FB  = (C_FB * sympy.cos(fc_FB))  + (lithoP.sym[0] * sympy.sin(fc_FB))                                                    
-                                                     
-
-                                                     
-
-# %%
-fb_visc_fn = minVisc + (1/ ((1/frictionalBaseVsicosity)  + (1/tau_FB)))
-
-materal_visc_fn = minVisc + (1/ ((1/materialViscosity)  + (1/tau_sed)))
-
-# %%
-# airIndex       = 0
-# ridgidBase     = 1
-# fritionalBase  = 2
-# sediment0      = 3
-# sediment1      = 4
-
-
-visc_fn = material.createMask([airViscosity, rigidBaseViscosity, 
-                               fb_visc_fn, materal_visc_fn, 
-                               materal_visc_fn])
+### the viscosity of each particle's material, limited by its yield stress (cohesion and friction weakened with its strain) at the lithostatic pressure
+visc_fn = materials["yield_viscosity"]
 
 
 
@@ -681,7 +622,7 @@ while step<max_steps:
         mesh.petsc_save_checkpoint(meshVars=[v, p, materialField, strain_rate_inv2, node_viscosity, density_proj, lithoP], index=step, outputPath=expt_name)
     
         swarm.petsc_save_checkpoint(swarmName='swarm', index=step, outputPath=expt_name) 
-        surfaceSwarm.petsc_save_checkpoint(swarmName='surfaceSwarm', index=step, outputPath=expt_name) 
+        surface.swarm.petsc_save_checkpoint(swarmName='surfaceSwarm', index=step, outputPath=expt_name) 
     
     if uw.mpi.rank == 0:
         print(f'\nStokes solve: ')  
@@ -691,10 +632,16 @@ while step<max_steps:
     ### get the timestep
     dt = stokes.estimate_dt()
         
-    # determine_lithostatic_pressure(bodyforce=stokes.bodyforce, solver=lithoP_solver)
-    determine_lithostatic_pressure(dt=dt)
+    ### advect and diffuse the surface
+    surface.advance(v.sym, dt)
+    
+    ### lithostatic pressure of the current material distribution
+    lithostatic.solve()
     
     update_strain(dt=dt, strain_var=strain, healingRate=nd(1e-18/u.second))
+
+    ### weakened material properties of the new strain, at the new lithostatic pressure
+    materials.update()
  
     ### advect the particles according to the timestep
     swarm.advection(V_fn=stokes.u.sym, delta_t=dt, corrector=False, evalf=True)
@@ -710,12 +657,13 @@ while step<max_steps:
 mesh.petsc_save_checkpoint(meshVars=[v, p, materialField, strain_rate_inv2, node_viscosity, density_proj, lithoP], index=step, outputPath=expt_name)
 
 swarm.petsc_save_checkpoint(swarmName='swarm', index=step, outputPath=expt_name) 
-surfaceSwarm.petsc_save_checkpoint(swarmName='surfaceSwarm', index=step, outputPath=expt_name) 
+surface.swarm.petsc_save_checkpoint(swarmName='surfaceSwarm', index=step, outputPath=expt_name) 
 
 # %%
-import matplotlib.pyplot as plt
-with surfaceSwarm.access():
-    plt.scatter(surfaceSwarm.data[:,0], surfaceSwarm.data[:,1])
-    print(surfaceSwarm.data.shape)
+surface_x, surface_h = surface.gather()
+
+if uw.mpi.rank == 0:
+    import matplotlib.pyplot as plt
+    plt.plot(surface_x, surface_h)
 
 # %%
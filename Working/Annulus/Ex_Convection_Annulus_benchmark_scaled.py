@@ -15,9 +15,20 @@ import numpy as np
 import sympy
 
 import os
+import sys
 
 from underworld3.utilities import generateXdmf
 
+sys.path.append('../../')
+from benchmark_utils.checkpoint import AsyncCheckpointWriter
+from benchmark_utils.free_slip import RotationNullSpace, add_free_slip_bc
+from benchmark_utils.rendering import BackgroundRenderer
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.radial import RadialProfile
+from benchmark_utils.steptimes import StepRecorder
+from benchmark_utils.timeseries import TimeSeriesWriter
+from benchmark_utils.visualisation import mesh_to_pyvista
+
 # options = PETSc.Options()
 # options["help"] = None
 # options["pc_type"]  = "svd"
@@ -53,16 +64,26 @@ else:
 ### number of steps of the model
 nsteps = 31
 
+### write checkpoints from a background thread while the next solve runs
+async_checkpoint = True
+
+### render each checkpoint to PNG offscreen in a separate process (also in parallel runs)
+offscreen_render = True
+
+### append the mesh variables to one time-series file instead of a file set per step
+timeseries_output = True
+
 # +
 ### FS - free slip top, no slip base
+### FF - free slip top and base
 ### NS - no slip top and base
 boundaryConditions = 'NS'
 
-if boundaryConditions == 'FS':
+if boundaryConditions in ('FS', 'FF'):
     if visc_UM == visc_LM:
-        outputPath = f'./output/mantleConvection-FS-Mvisc={visc_UM}/'
+        outputPath = f'./output/mantleConvection-{boundaryConditions}-Mvisc={visc_UM}/'
     else:
-        outputPath = f'./output/mantleConvection-FS-UMvisc={visc_UM}_LMvisc={visc_LM}/'
+        outputPath = f'./output/mantleConvection-{boundaryConditions}-UMvisc={visc_UM}_LMvisc={visc_LM}/'
 else:
     if visc_UM == visc_LM:
         outputPath = f'./output/mantleConvection-NS-Mvisc={visc_UM}/'
@@ -183,7 +204,6 @@ T_soln       = uw.discretisation.MeshVariable("T", meshball, 1, degree=3)
 T0           = uw.discretisation.MeshVariable("T0", meshball, 1, degree=3)
 timeField    = uw.discretisation.MeshVariable("time", meshball, 1, degree=1)
 density_proj = uw.discretisation.MeshVariable("rho", meshball, 1, degree=1)
-meshr        = uw.discretisation.MeshVariable(r"r", meshball, 1, degree=1)
 
 # +
 # check the mesh if in a notebook / serial
@@ -202,8 +222,7 @@ if uw.mpi.size == 1:
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, -5.0]
 
-    meshball.vtk(outputPath + "annulus_mesh.vtk")
-    pvmesh = pv.read(outputPath + "annulus_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     pl = pv.Plotter()
     
@@ -295,30 +314,20 @@ unit_rvec = meshball.X / (radius_fn)
 buoyancy_force = (T_density * -1*nd_gravity) *  unit_rvec
 
 if boundaryConditions == 'FS':
+    stokes.bodyforce = buoyancy_force
 
-    # Some useful coordinate stuff
-
-    x, y = meshball.CoordinateSystem.X
-    ra, th = meshball.CoordinateSystem.xR
-
-    hw = 1000.0 / res
+    ### free slip on the surface: penalty on the normal velocity on the boundary facets, scaled by viscosity / cell size
+    add_free_slip_bc(stokes, meshball.boundaries.Upper.name, viscosity=viscosityMat)
     
-    surface_fn = sympy.exp(-(((meshr.sym[0] - rO) / rO) ** 2) * hw)
+    stokes.add_dirichlet_bc((0.0, 0.0), meshball.boundaries.Lower.name, (0, 1))
     
-    base_fn = sympy.exp(-(((meshr.sym[0] - rI) / rO) ** 2) * hw)
+elif boundaryConditions == 'FF':
+    stokes.bodyforce = buoyancy_force
 
-    free_slip_penalty_upper = v_soln.sym.dot(unit_rvec) * unit_rvec * surface_fn
-    free_slip_penalty_lower = v_soln.sym.dot(unit_rvec) * unit_rvec * base_fn
-    
-    ### Buoyancy force RHS plus free slip surface enforcement
-    ptf = 1e7
-    penalty_terms_upper = ptf * free_slip_penalty_upper
-    penalty_terms_lower = ptf * free_slip_penalty_lower
+    ### free slip on both boundaries: the net rotation is left free, and removed after each solve
+    add_free_slip_bc(stokes, meshball.boundaries.Upper.name, viscosity=viscosityMat)
+    add_free_slip_bc(stokes, meshball.boundaries.Lower.name, viscosity=viscosityMat)
 
-    stokes.bodyforce = buoyancy_force  - penalty_terms_upper # - penalty_terms_lower
-    
-    stokes.add_dirichlet_bc((0.0, 0.0), meshball.boundaries.Lower.name, (0, 1))
-    
 else:
     stokes.bodyforce = buoyancy_force
     
@@ -326,6 +335,13 @@ else:
     stokes.add_dirichlet_bc((0.0, 0.0), meshball.boundaries.Upper.name, (0, 1))
     stokes.add_dirichlet_bc((0.0, 0.0), meshball.boundaries.Lower.name, (0, 1))
 
+### with free slip on both boundaries GAMG gets the rigid body modes and the net rotation is removed after each solve
+if boundaryConditions == 'FF':
+    stokes_nullspace = RotationNullSpace(stokes)
+    solve_stokes = stokes_nullspace.solve
+else:
+    solve_stokes = stokes.solve
+
 # +
 ### Visualise the swarm
 
@@ -342,7 +358,7 @@ if uw.mpi.size == 1:
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, -5.0]
 
-    pv.read(outputPath + "annulus_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     pl = pv.Plotter()
     
@@ -410,9 +426,6 @@ with meshball.access(T_soln):
     T0 = nd(uw.function.evaluate(initial_T, T_soln.coords, meshball.N) * u.kelvin)
     
 rho_0 = uw.function.evaluate(T_density, T_soln.coords, meshball.N) 
-
-with meshball.access(meshr):
-    meshr.data[:, 0] = uw.function.evalf(sympy.sqrt(x**2 + y**2), meshball.data, meshball.N)  # cf radius_fn which is 0->1
     
 
 
@@ -433,7 +446,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    pv.read(outputPath + "annulus_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     with meshball.access():
         usol = stokes.u.data.copy()
@@ -476,7 +489,7 @@ def plotFig(var='T',arrowSize=500):
     import pyvista as pv
     import vtk
 
-    pv.read(outputPath + "annulus_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshball)
 
     with meshball.access():
         usol = stokes.u.data.copy()
@@ -508,12 +521,39 @@ def plotFig(var='T',arrowSize=500):
 
 
 # +
+if timeseries_output:
+    timeseries = TimeSeriesWriter(outputPath, meshball,
+                                  meshVars=[v_soln, p_soln, T_soln, density_proj, timeField],
+                                  name='mantleConvection')
+
+if async_checkpoint:
+    checkpointer = AsyncCheckpointWriter(outputPath, meshball,
+                                         meshVars=[v_soln, p_soln, T_soln, density_proj, timeField],
+                                         swarms={'swarm': (swarm, [material])})
+
+if async_checkpoint and offscreen_render:
+    renderer = BackgroundRenderer(outputPath,
+                                  views=[{'name': 'temperature', 'field': 'T'},
+                                         {'name': 'velocity', 'arrows': 'U', 'field': 'T'},
+                                         {'name': 'density', 'field': 'rho'}],
+                                  rank=uw.mpi.rank)
+
 def saveData(step, outputPath, time):
     
     ### update projections first
     updateFields(time)
+
+    if timeseries_output:
+        timeseries.write(step, time)
+
+    if async_checkpoint:
+        ### snapshot the fields, the write happens during the next solve
+        checkpointer.save(step, time)
+        return
+
     ### save mesh variables
-    meshball.petsc_save_checkpoint(step, meshVars=[v_soln, p_soln, T_soln, density_proj, timeField], outputPath=outputPath)
+    if not timeseries_output:
+        meshball.petsc_save_checkpoint(step, meshVars=[v_soln, p_soln, T_soln, density_proj, timeField], outputPath=outputPath)
     ### save the swarm
     swarm.petsc_save_checkpoint('swarm', step, outputPath=outputPath)
     
@@ -533,6 +573,15 @@ step = 0
 time = 0.
 time_dim = 0.
 
+### wall time of each phase, and its cost per step (see benchmark_utils/steptimes.py)
+profiler = PhaseProfiler()
+step_times = StepRecorder(profiler, f'{outputPath}step_times.npz')
+
+### radial profiles of the mean temperature and rms velocity, the benchmark comparison
+radial_profile = RadialProfile(meshball, n_bins=50)
+speed_fn = sympy.sqrt(v_soln.sym.dot(v_soln.sym))
+profile_steps, T_profiles, v_rms_profiles = [], [], []
+
 # +
 # Convection model / update in time
 
@@ -544,22 +593,48 @@ while step < nsteps:
         print(f"\n\nTimestep: {step}, time: {time_dim}\n\n")
     
     if step % 5 == 0:
-        saveData(step=step, outputPath=outputPath, time = time)
+        with profiler.phase('io'):
+            saveData(step=step, outputPath=outputPath, time = time)
         
 
 
-    stokes.solve()
+    ### the first solve of each solver includes its setup
+    with profiler.phase('first_stokes' if step == 0 else 'stokes'):
+        solve_stokes()
     delta_t = adv_diff.estimate_dt()
-    adv_diff.solve(timestep=delta_t)
+    with profiler.phase('first_advection_diffusion' if step == 0 else 'advection_diffusion'):
+        adv_diff.solve(timestep=delta_t)
 
     # stats then loop
-    tstats = T_soln.stats()
+    with profiler.phase('diagnostics'):
+        tstats = T_soln.stats()
+
+        profile = radial_profile(T_soln.sym[0], speed_fn)
+        profile_steps.append(step)
+        T_profiles.append(profile["mean"][:, 0])
+        v_rms_profiles.append(profile["rms"][:, 1])
+
+    step_times.end_step(step, time)
         
     step += 1
     time += delta_t
-    
-    
-        
+
+### wait for any checkpoints still being written
+if async_checkpoint:
+    with profiler.phase('io'):
+        checkpointer.close()
+
+    if offscreen_render:
+        renderer.finish()
+
+step_times.save()
+
+if uw.mpi.rank == 0:
+    np.savez(f'{outputPath}radial_profiles.npz', r=radial_profile.centres, step=np.array(profile_steps),
+             T_mean=np.array(T_profiles), v_rms=np.array(v_rms_profiles))
+
+if uw.mpi.rank == 0:
+    print(profiler.table())
 
 
 # -
@@ -30,9 +30,16 @@
 import underworld3 as uw
 import numpy as np
 import sympy
-import math
 import os
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.reference import advection_diffusion_1D, hot_layer_1D
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.petsc_log import log_view_summary
+
 if uw.mpi.size == 1:
     import matplotlib.pyplot as plt
 
@@ -155,42 +162,6 @@ sample_points[:, 1] = sample_y
 T_orig = uw.function.evaluate(T.sym[0], sample_points)
 
 
-# ### 1D diffusion function
-# To compare UW results with a numerical results
-
-def diffusion_1D(sample_points, T0, diffusivity, vel, time_1D):
-    x = sample_points
-    T = T0
-    k = diffusivity
-    time = time_1D
-
-    dx = sample_points[1] - sample_points[0]
-
-    dt_dif = (dx**2 / k)
-    dt_adv = (dx/velocity)
-
-    dt = 0.5 * min(dt_dif, dt_adv)
-
-
-    if time > 0:
-
-        """ determine number of its """
-        nts = math.ceil(time / dt)
-    
-        """ get dt of 1D model """
-        final_dt = time / nts
-
-    
-        for i in range(nts):
-            qT = -k * np.diff(T) / dx
-            dTdt = -np.diff(qT) / dx
-            T[1:-1] += dTdt * final_dt
-
-    
-
-    return T
-
-
 # ### Function to visualise temp field
 
 # %%
@@ -208,9 +179,7 @@ def plot_fig():
         pv.global_theme.smooth_shading = True
 
         # pv.start_xvfb()
-        mesh.vtk(outputPath + "advDiff_mesh.vtk")
-        # mesh.vtk("ignore_periodic_mesh.vtk")
-        pvmesh = pv.read(outputPath + "advDiff_mesh.vtk")
+        pvmesh = mesh_to_pyvista(mesh)
 
         # pvmesh.point_data["S"]  = uw.function.evaluate(s_soln.fn, meshbox.data)
 
@@ -270,10 +239,10 @@ plot_fig()
 step = 0
 model_time = 0.0
 
-from time import time as track_time
+### wall time of each phase of the loop, recorded with the results. Each phase is also a PETSc log stage
+profiler = PhaseProfiler(log_stages=True)
 
 while step < nsteps:
-    start = track_time()
     ### print some stuff
     if uw.mpi.rank == 0:
         print(f"Step: {str(step).rjust(3)}, time: {model_time:6.5f}\n")
@@ -284,16 +253,22 @@ while step < nsteps:
 
     print(f'dt: {dt}\n')
     
-    ### diffuse through underworld
-    adv_diff.solve(timestep=dt)
+    ### diffuse through underworld, the first solve includes the solver setup
+    solve_phase = 'first_solve' if step == 0 else 'solve'
+    with profiler.phase(solve_phase):
+        adv_diff.solve(timestep=dt)
 
     step += 1
     model_time += dt
 
-    end = track_time()
+    print(f'solve time: {profiler.last[solve_phase]}\n')
 
-    solve_time = end - start
-    print(f'solve time: {solve_time}\n')
+    ### 1D reference at the same time, cheap enough to check every step
+    with profiler.phase('diagnostics'):
+        T_ref = advection_diffusion_1D(sample_points[:, 1], T_orig, diffusivity=kappa, velocity=velocity, time=model_time)
+        T_step = uw.function.evalf(T.sym[0], sample_points)
+    if uw.mpi.rank == 0:
+        print(f'max difference from 1D reference: {np.abs(T_step - T_ref).max()}\n')
 
 # ### Check the results
 
@@ -308,25 +283,30 @@ with mesh.access(T):
 T_UW = uw.function.evalf(T.sym[0], sample_points)
 
 
-T_1D_model = diffusion_1D(
-    sample_points=sample_points[:, 1], T0=T_orig.copy(), diffusivity=kappa, vel=velocity, time_1D=model_time
-)
+### 1D advection-diffusion at the same sample points
+T_1D_model = advection_diffusion_1D(sample_points[:, 1], T_orig, diffusivity=kappa, velocity=velocity, time=model_time)
 
-#### 1D numerical advection
-new_y = sample_points[:,1] + (velocity*model_time)
+### closed-form solution (infinite domain)
+T_analytic = hot_layer_1D(sample_points[:, 1], ymin + pipePosition, ymax - pipePosition,
+                          tmin, tmax, diffusivity=kappa, time=model_time, velocity=velocity)
 
 ### profile from UW
 plt.plot(T_UW, sample_points[:, 1], ls="-", c="red", label="UW numerical solution")
 ### numerical solution
-plt.plot(T_1D_model, new_y, ls="-.", c="k", label="1D numerical solution")
+plt.plot(T_1D_model, sample_points[:, 1], ls="-.", c="k", label="1D numerical solution")
+### analytical solution
+plt.plot(T_analytic, sample_points[:, 1], ls=":", c="b", label="1D analytical solution")
 plt.title(f'time: {round(model_time, 5)}', fontsize=8)
 plt.legend(fontsize=8)
 # -
 # ### Check that the values are close
-# Some issues due to the interp on the UW profile
+# Some issues due to the interp on the UW profile.
+# The run is added to the regression database (see `benchmark_utils/regression.py`); raises if the profile is outside its tolerance.
 
-if not np.allclose(T_UW, T_1D_model, rtol=1e-1):
-    raise RuntimeError('Analytical and numerical solution not close')
+check_results('AdvDiff_hot_pipe',
+              metrics={'T_max_rel_error': np.max(np.abs(T_UW - T_1D_model) / np.abs(T_1D_model)),
+                       'T_max_error_analytic': np.abs(T_UW - T_analytic).max()},
+              timings=profiler.timings, petsc_log=log_view_summary(f'{outputPath}petsc_log_view.txt'), res=res, nsteps=nsteps, velocity=velocity)
 
 
 
@@ -54,6 +54,10 @@ from mpi4py import MPI
 
 import math
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+
 if uw.mpi.size == 1:
     import matplotlib.pyplot as plt
 
@@ -153,9 +157,7 @@ def plot_fig():
         pv.global_theme.smooth_shading = True
 
         # pv.start_xvfb()
-        mesh.vtk(outputPath + "advDiff-rotatingCone-Mesh.vtk")
-        # mesh.vtk("ignore_periodic_mesh.vtk")
-        pvmesh = pv.read(outputPath + "advDiff-rotatingCone-Mesh.vtk")
+        pvmesh = mesh_to_pyvista(mesh)
 
         # pvmesh.point_data["S"]  = uw.function.evaluate(s_soln.fn, meshbox.data)
 
@@ -255,7 +257,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    pvmesh = pv.read(outputPath + "advDiff-rotatingCone-Mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # pvmesh.point_data["S"]  = uw.function.evaluate(s_soln.fn, meshbox.data)
 
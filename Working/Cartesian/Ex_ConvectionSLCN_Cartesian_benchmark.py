@@ -21,6 +21,11 @@ import numpy as np
 import sympy
 from copy import deepcopy 
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.boundary_flux import BoundaryFluxRecovery
+
 # %% [markdown]
 # ### Set parameters to use 
 
@@ -87,8 +92,7 @@ if uw.mpi.size == 1:
     pv.global_theme.show_edges = True
     pv.global_theme.axes.show = True
 
-    meshbox.vtk(outDir+"Convection_mesh.vtk")
-    pvmesh = pv.read(outDir+"Convection_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshbox)
     pl = pv.Plotter()
 
     # pl.add_mesh(pvmesh,'Black', 'wireframe', opacity=0.5)
@@ -102,24 +106,16 @@ p_soln = uw.discretisation.MeshVariable("P", meshbox, 1, degree=1) # degree = 1
 t_soln = uw.discretisation.MeshVariable("T", meshbox, 1, degree=3) # degree = 3
 t_0 = uw.discretisation.MeshVariable("T0", meshbox, 1, degree=3) # degree = 3
 
-# additional variable for the gradient
-dTdZ = uw.discretisation.MeshVariable(r"\partial T/ \partial \Z", # FIXME: Z should not be a function of x, y, z 
-                                      meshbox, 
-                                      1, 
-                                      degree = 3) # degree = 3
-
-# variable containing stress in the z direction
-sigma_zz = uw.discretisation.MeshVariable(r"\sigma_{zz}",  
-                                        meshbox, 
-                                        1, degree=2) # degree = 3 
+# rate of change of T over the last time step, part of the heat flux balance during the transient
+dTdt = uw.discretisation.MeshVariable(r"\partial T/ \partial t", meshbox, 1, degree=3)
 
 x, z = meshbox.X
 
-# projection object to calculate the gradient along Z
-dTdZ_calc = uw.systems.Projection(meshbox, dTdZ)
-dTdZ_calc.uw_function = t_soln.sym.diff(z)[0]
-dTdZ_calc.smoothing = 1.0e-3
-dTdZ_calc.petsc_options.delValue("ksp_monitor")
+# heat flux through the top and bottom and normal stress on the top, recovered from the residual
+# of the equations (see benchmark_utils/boundary_flux.py) instead of projections of dT/dz and sigma_zz
+top_flux = BoundaryFluxRecovery.box(meshbox, "Top", n_modes=2*res, degree=3)
+bottom_flux = BoundaryFluxRecovery.box(meshbox, "Bottom", n_modes=2*res, degree=3)
+top_stress = BoundaryFluxRecovery.box(meshbox, "Top", n_modes=2*res, degree=2)
 
 
 # %% [markdown]
@@ -283,7 +279,7 @@ def plotFig(meshbox, s_field, v_field, s_field_name, save_fname = None, with_arr
         #pv.global_theme.jupyter_backend = "panel"
         pv.global_theme.smooth_shading = True
 
-        pvmesh = pv.read(outDir+"Convection_mesh.vtk")
+        pvmesh = mesh_to_pyvista(meshbox)
 
         velocity = np.zeros((meshbox.data.shape[0], 3))
         velocity[:, 0] = uw.function.evaluate(v_field.sym[0], meshbox.data)
@@ -384,7 +380,7 @@ def plot_T_mesh(filename):
         pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
         pv.global_theme.camera["position"] = [0.0, 0.0, 5.0]
 
-        pvmesh = pv.read(outDir+"Convection_mesh.vtk")
+        pvmesh = mesh_to_pyvista(meshbox)
 
         velocity = np.zeros((meshbox.data.shape[0], 3))
         velocity[:, 0] = uw.function.evaluate(v_soln.sym[0], meshbox.data)
@@ -508,7 +504,6 @@ def surface_integral(mesh, uw_function, mask_fn):
 # the full width at half maximum is set to 1/res
 sdev = 0.5*(1/math.sqrt(2*math.log(2)))*(1/res) 
 
-up_surface_defn_fn = sympy.exp(-((z - 1)**2)/(2*sdev**2)) # at z = 1
 lw_surface_defn_fn = sympy.exp(-(z**2)/(2*sdev**2)) # at z = 0
 
 # %% [markdown]
@@ -533,13 +528,18 @@ while t_step < nsteps:
     vrmsVal[t_step] = v_rms()
     timeVal[t_step] = time
 
+    with meshbox.access():
+        t_prev = t_soln.data[:, 0].copy()
+
     stokes.solve(zero_init_guess=True) # originally True
     delta_t = 0.5 * stokes.estimate_dt() # originally 0.5
     adv_diff.solve(timestep=delta_t, zero_init_guess=False) # originally False
 
-    # calculate Nusselt number
-    dTdZ_calc.solve()
-    up_int = surface_integral(meshbox, dTdZ.sym[0], up_surface_defn_fn)
+    with meshbox.access(dTdt):
+        dTdt.data[:, 0] = (t_soln.data[:, 0] - t_prev) / delta_t
+
+    # calculate Nusselt number, only the mean heat flux through the top is needed
+    up_int = top_flux.heat_flux(t_soln, diffusivity=k, velocity=v_soln.sym, dTdt=dTdt.sym[0], n_modes=1).mean / k
     lw_int = surface_integral(meshbox, t_soln.sym[0], lw_surface_defn_fn)
 
     Nu = -up_int/lw_int
@@ -557,7 +557,7 @@ while t_step < nsteps:
         ''' save mesh variables together with mesh '''
         if t_step % save_every == 0:
             print("Saving checkpoint for time step: ", t_step)
-            meshbox.petsc_save_checkpoint(outputPath=outDir, meshVars=[v_soln, p_soln, t_soln, dTdZ, sigma_zz], index=0)
+            meshbox.petsc_save_checkpoint(outputPath=outDir, meshVars=[v_soln, p_soln, t_soln], index=0)
 
 
     # early stopping criterion
@@ -568,7 +568,7 @@ while t_step < nsteps:
     time   += delta_t
 
 # save final mesh variables in the run 
-meshbox.petsc_save_checkpoint(outputPath=outDir, meshVars=[v_soln, p_soln, t_soln, dTdZ, sigma_zz], index=0)
+meshbox.petsc_save_checkpoint(outputPath=outDir, meshVars=[v_soln, p_soln, t_soln], index=0)
 
 # %%
 if uw.mpi.rank == 0:
@@ -607,10 +607,9 @@ if uw.mpi.rank == 0:
 # | 10$^6$ | 833.990 | 21.972 | 45.964 | 0.877 |
 
 # %%
-# set-up variables to use in calculating the benchmark values 
-sigma_zz_fn = stokes.stress[1, 1]
-
-dTdZ_calc.solve() # recalculate gradient of T along Z
+# heat flux (k dT/dn, outward) through the top and bottom, as cosine series along the boundary
+top_q = top_flux.heat_flux(t_soln, diffusivity=k, velocity=v_soln.sym, dTdt=dTdt.sym[0])
+bottom_q = bottom_flux.heat_flux(t_soln, diffusivity=k, velocity=v_soln.sym, dTdt=dTdt.sym[0])
 
 # %% [markdown]
 # ### Calculate the $Nu$ value
@@ -621,7 +620,7 @@ dTdZ_calc.solve() # recalculate gradient of T along Z
 # \end{aligned}
 
 # %%
-up_int = surface_integral(meshbox, dTdZ.sym[0], up_surface_defn_fn)
+up_int = top_q.mean / k
 lw_int = surface_integral(meshbox, t_soln.sym[0], lw_surface_defn_fn)
 
 Nu = -up_int/lw_int
@@ -644,12 +643,12 @@ if uw.mpi.rank == 0:
 # $q_3$ at $x=l$, $z=0$; $q_4$ at $x=0$, $z=0$.   
 
 # %%
-# calculate q values which depend on the temperature gradient fields
+# calculate q values from the recovered heat flux; the outward normal is +z on the top and -z on the bottom
 
-q1 = -(boxHeight/(tempMax - tempMin))*uw.function.evaluate(dTdZ.sym[0], np.array([[0., 0.999999*boxHeight]]))[0]
-q2 = -(boxHeight/(tempMax - tempMin))*uw.function.evaluate(dTdZ.sym[0], np.array([[0.999999*boxLength, 0.999999*boxHeight]]))[0]
-q3 = -(boxHeight/(tempMax - tempMin))*uw.function.evaluate(dTdZ.sym[0], np.array([[0.999999*boxLength, 0.]]))[0]
-q4 = -(boxHeight/(tempMax - tempMin))*uw.function.evaluate(dTdZ.sym[0], np.array([[0., 0.]]))[0]
+q1 = -(boxHeight/(tempMax - tempMin))*top_q(np.array([[0., boxHeight]]))[0]/k
+q2 = -(boxHeight/(tempMax - tempMin))*top_q(np.array([[boxLength, boxHeight]]))[0]/k
+q3 = (boxHeight/(tempMax - tempMin))*bottom_q(np.array([[boxLength, 0.]]))[0]/k
+q4 = (boxHeight/(tempMax - tempMin))*bottom_q(np.array([[0., 0.]]))[0]/k
 
 if uw.mpi.rank == 0:
     print('Rayleigh number = {0:.1e}'.format(Ra))
@@ -670,14 +669,8 @@ if uw.mpi.rank == 0:
 # This is calculated below.
 
 # %%
-# projection for the stress in the zz direction
-x, y = meshbox.X
-
-stress_calc = uw.systems.Projection(meshbox, sigma_zz)
-stress_calc.uw_function = sigma_zz_fn
-stress_calc.smoothing = 1.0e-3
-stress_calc.petsc_options.delValue("ksp_monitor")
-stress_calc.solve()
+# normal stress (sigma n).n = sigma_zz on the top, recovered from the residual of the Stokes equations
+sigma_zz_top_fn = top_stress.normal_stress(stokes.stress, stokes.bodyforce)
 
 # %% [markdown]
 # The vertical normal stress is dimensionalised as: 
@@ -699,9 +692,7 @@ stress_calc.solve()
 # %%
 # subtract the average value for the benchmark since the mean is set to zero 
 
-mean_sigma_zz_top = -surface_integral(meshbox, 
-                                     sigma_zz.sym[0], 
-                                     up_surface_defn_fn)/boxLength
+mean_sigma_zz_top = -sigma_zz_top_fn.mean
 
 
 # %%
@@ -716,7 +707,7 @@ eta0=1.e23
 
 def calculate_topography(coord): # only coord has local scope
 
-    sigma_zz_top = -uw.function.evaluate(sigma_zz.sym[0], coord) - mean_sigma_zz_top
+    sigma_zz_top = -sigma_zz_top_fn(coord) - mean_sigma_zz_top
     
     # dimensionalise 
     dim_sigma_zz_top  = ((eta0 * kappa) / (height**2)) * sigma_zz_top
@@ -728,14 +719,12 @@ def calculate_topography(coord): # only coord has local scope
 
 # %%
 # topography at the top corners 
-e1 = calculate_topography(np.array([[0, 0.999999*boxHeight]]))
-e2 = calculate_topography(np.array([[0.999999*boxLength, 0.999999*boxHeight]]))
-
-# calculate the x-coordinate with zero stress
-with meshbox.access():
-    cond = meshbox.data[:, 1] == meshbox.data[:, 1].max()
-    up_surface_coords = meshbox.data[cond]
-    up_surface_coords[:, 1] = 0.999999*up_surface_coords[:, 1]
+e1 = calculate_topography(np.array([[0, boxHeight]]))
+e2 = calculate_topography(np.array([[boxLength, boxHeight]]))
+
+# calculate the x-coordinate with zero stress, the recovered stress can be evaluated anywhere along the top
+x_top = np.linspace(0., boxLength, 2001)
+up_surface_coords = np.column_stack([x_top, np.full_like(x_top, boxHeight)])
 
 abs_topo = abs(calculate_topography(up_surface_coords))
 
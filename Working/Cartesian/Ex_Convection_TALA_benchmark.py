@@ -22,6 +22,16 @@ import sympy
 from sympy.vector import gradient, divergence, dot
 from copy import deepcopy 
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.memory import memory_report, memory_table
+from benchmark_utils.petsc_log import log_view_summary, stage_table
+from benchmark_utils.steptimes import StepRecorder
+from benchmark_utils.boundary_flux import BoundaryFluxRecovery
+
 # %% [markdown]
 # ### Set parameters to use 
 
@@ -76,13 +86,17 @@ if not use_checkpoint:
 # ### Create mesh and variables
 
 # %%
-meshbox = uw.meshing.UnstructuredSimplexBox(
-                                                minCoords=(0.0, 0.0), 
-                                                maxCoords=(boxLength, boxHeight), 
-                                                cellSize=1.0 /res, 
-                                                regular=False, 
-                                                qdegree = 3
-                                        )
+### wall time and memory of each phase of the run, recorded with the results. Each phase is also a PETSc log stage
+profiler = PhaseProfiler(memory=True, log_stages=True)
+
+with profiler.phase('mesh'):
+    meshbox = uw.meshing.UnstructuredSimplexBox(
+                                                    minCoords=(0.0, 0.0), 
+                                                    maxCoords=(boxLength, boxHeight), 
+                                                    cellSize=1.0 /res, 
+                                                    regular=False, 
+                                                    qdegree = 3
+                                            )
 
 #meshbox = uw.meshing.StructuredQuadBox(minCoords=(0.0, 0.0), maxCoords=(boxLength, boxHeight),  elementRes=(res,res))
 
@@ -126,8 +140,7 @@ if uw.mpi.size == 1:
     pv.global_theme.show_edges = True
     pv.global_theme.axes.show = True
 
-    meshbox.vtk("tmp_box_mesh.vtk")
-    pvmesh = pv.read("tmp_box_mesh.vtk")
+    pvmesh = mesh_to_pyvista(meshbox)
     pl = pv.Plotter()
 
     # pl.add_mesh(pvmesh,'Black', 'wireframe', opacity=0.5)
@@ -136,21 +149,17 @@ if uw.mpi.size == 1:
     pl.show(cpos="xy")
 
 # %%
-v_soln = uw.discretisation.MeshVariable("U", meshbox, meshbox.dim, degree=2)
-p_soln = uw.discretisation.MeshVariable("P", meshbox, 1, degree=1)
-t_soln = uw.discretisation.MeshVariable("T", meshbox, 1, degree=3)
-
-# additional variable for the gradient
-dTdZ = uw.discretisation.MeshVariable(r"\partial T/ \partial \Z", 
-                                      meshbox, 
-                                      1, 
-                                      degree = 3) 
-
-# projection object to calculate the gradient along Z
-dTdZ_calc = uw.systems.Projection(meshbox, dTdZ)
-dTdZ_calc.uw_function = t_soln.sym.diff(z)[0]
-dTdZ_calc.smoothing = 1.0e-3
-dTdZ_calc.petsc_options.delValue("ksp_monitor")
+with profiler.phase('variables'):
+    v_soln = uw.discretisation.MeshVariable("U", meshbox, meshbox.dim, degree=2)
+    p_soln = uw.discretisation.MeshVariable("P", meshbox, 1, degree=1)
+    t_soln = uw.discretisation.MeshVariable("T", meshbox, 1, degree=3)
+
+    # rate of change of T over the last time step, part of the heat flux balance during the transient
+    dTdt = uw.discretisation.MeshVariable(r"\partial T/ \partial t", meshbox, 1, degree=3)
+
+    # heat flux through the top (z = 1) recovered from the residual of the energy equation
+    # (see benchmark_utils/boundary_flux.py) instead of a projection of dT/dz
+    top_flux = BoundaryFluxRecovery.box(meshbox, "Top", n_modes=1, degree=3)
 
 # %% [markdown]
 # ### System set-up (Stokes)
@@ -341,8 +350,7 @@ def plotFig(meshbox, s_field, v_field, s_field_name, save_fname = None, with_arr
         #pv.global_theme.jupyter_backend = "panel"
         pv.global_theme.smooth_shading = True
 
-        meshbox.vtk("tmp_box_mesh.vtk")
-        pvmesh = pv.read("tmp_box_mesh.vtk")
+        pvmesh = mesh_to_pyvista(meshbox)
 
         velocity = np.zeros((meshbox.data.shape[0], 3))
         velocity[:, 0] = uw.function.evaluate(v_field.sym[0], meshbox.data)
@@ -484,9 +492,11 @@ def surface_integral(mesh, uw_function, mask_fn):
 ''' set-up surface expressions for calculating Nu number '''
 sdev = 0.5*(1/math.sqrt(2*math.log(2)))*(1/res) 
 
-up_surface_defn_fn = sympy.exp(-((z - 1)**2)/(2*sdev**2)) # at z = 1
 lw_surface_defn_fn = sympy.exp(-(z**2)/(2*sdev**2)) # at z = 0
 
+# diffusivity on the top, to turn the recovered heat flux into dT/dz
+diffusivity_top = float((k/(rhoBar*cp)).subs(z, boxHeight))
+
 # %%
 # functions for calculating the viscous dissipation and adiabatic heating integrals 
 # used for checking since they should be equal
@@ -506,30 +516,45 @@ NuVal =  np.zeros(nsteps)*np.nan
 viscDissVal = np.zeros(nsteps)*np.nan
 adiabHeatVal = np.zeros(nsteps)*np.nan
 
+### cost of each phase per step (see benchmark_utils/steptimes.py)
+step_times = StepRecorder(profiler, f'{outdir}/step_times.npz')
+
 # %%
 #### Convection model / update in time
 # NOTE: There is a strange interaction here between the solvers if the zero_guess is set to False
 while t_step < nsteps:
-    vrmsVal[t_step] = v_rms()
+    with profiler.phase('diagnostics'):
+        vrmsVal[t_step] = v_rms()
     timeVal[t_step] = time
 
-    stokes.solve(zero_init_guess=True) # originally True
+    with meshbox.access():
+        t_prev = t_soln.data[:, 0].copy()
+
+    ### the first solve of each solver includes its setup
+    with profiler.phase('first_stokes' if t_step == 0 else 'stokes'):
+        stokes.solve(zero_init_guess=True) # originally True
     delta_t = stokes.estimate_dt()
-    adv_diff.solve(timestep=delta_t, zero_init_guess=False) # originally False
+    with profiler.phase('first_advection_diffusion' if t_step == 0 else 'advection_diffusion'):
+        adv_diff.solve(timestep=delta_t, zero_init_guess=False) # originally False
+
+    with profiler.phase('diagnostics'):
+        with meshbox.access(dTdt):
+            dTdt.data[:, 0] = (t_soln.data[:, 0] - t_prev) / delta_t
 
-    # calculate Nusselt number
-    # for this case, top surface is set to 1, while bottom is set to 0
-    dTdZ_calc.solve()
-    up_int = surface_integral(meshbox, dTdZ.sym[0], up_surface_defn_fn)
-    lw_int = surface_integral(meshbox, t_soln.sym[0], lw_surface_defn_fn)
+        # calculate Nusselt number
+        # for this case, top surface is set to 1, while bottom is set to 0
+        # the recovered flux is diffusivity * dT/dz, the diffusivity on the top is k / (rho0 cp)
+        up_int = top_flux.heat_flux(t_soln, diffusivity=k/(rhoBar*cp), velocity=v_soln.sym,
+                                    source=adv_diff.f, dTdt=dTdt.sym[0]).mean / diffusivity_top
+        lw_int = surface_integral(meshbox, t_soln.sym[0], lw_surface_defn_fn)
 
-    Nu = -up_int/lw_int
+        Nu = -up_int/lw_int
 
-    NuVal[t_step] = -up_int/lw_int
+        NuVal[t_step] = -up_int/lw_int
 
-    # calculate the integrals of viscous dissipation and adiabatic heating
-    viscDissVal[t_step] = visc_diss_int_calc.evaluate()
-    adiabHeatVal[t_step] = adiab_heat_int_calc.evaluate()
+        # calculate the integrals of viscous dissipation and adiabatic heating
+        viscDissVal[t_step] = visc_diss_int_calc.evaluate()
+        adiabHeatVal[t_step] = adiab_heat_int_calc.evaluate()
 
     # stats then loop
     tstats = t_soln.stats()
@@ -543,6 +568,8 @@ while t_step < nsteps:
         #     print("Saving checkpoint for time step: ", t_step)
         #     meshbox.write_timestep_xdmf(filename = outfile, meshVars=[v_soln, p_soln, t_soln, dTdZ], index=0)
 
+    step_times.end_step(t_step, time)
+
     # early stopping criterion
     if t_step > 1 and abs((NuVal[t_step] - NuVal[t_step - 1])/NuVal[t_step]) < epsilon_lr:
         break
@@ -559,10 +586,24 @@ while t_step < nsteps:
 #     meshbox.write_timestep_xdmf(filename = outfile, meshVars=[v_soln, p_soln, t_soln, dTdZ, sigma_zz], index=0)
 
 # %%
+step_times.save()
+
 # Calculate some benchmark values
+final_v_rms = v_rms()
+memory = memory_report(profiler, meshbox)
+petsc_log = log_view_summary(f'{outdir}/petsc_log_view.txt')
+
 if uw.mpi.rank == 0:
-    print("RMS velocity at the final time step is {}.".format(v_rms()))
+    print("RMS velocity at the final time step is {}.".format(final_v_rms))
     print("Nusselt number at the final time step is {}.".format(Nu))
+    print(profiler.table())
+    print(memory_table(memory))
+    print(stage_table(petsc_log))
+
+### regression database (see benchmark_utils/regression.py)
+check_results('TALA', metrics={'Nu': Nu, 'v_rms': final_v_rms, 'steps': t_step},
+              timings=profiler.timings, memory=memory, petsc_log=petsc_log,
+              res=res, Ra=Ra, Di=Di, nsteps=nsteps, use_checkpoint=use_checkpoint)
 
 
 
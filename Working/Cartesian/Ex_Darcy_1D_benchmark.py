@@ -24,6 +24,14 @@ import underworld3 as uw
 import numpy as np
 import sympy
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.convergence import error_norms, global_dofs, record_run
+from benchmark_utils.regression import check_results
+
+from benchmark_utils.profiling import PhaseProfiler
+
 options = PETSc.Options()
 # -
 
@@ -41,14 +49,18 @@ benchmark_version = 0
 minX, maxX = -1.0, 0.0
 minY, maxY = -1.0, 0.0
 
-mesh = uw.meshing.UnstructuredSimplexBox(minCoords=(minX, minY), maxCoords=(maxX, maxY), cellSize=0.05, qdegree=2, regular=False)
+### elements per unit length, can be set from the command line (e.g. -res 40) for convergence studies
+res = uw.options.getInt('res', default=20)
+pdegree = uw.options.getInt('pdegree', default=2)
+
+mesh = uw.meshing.UnstructuredSimplexBox(minCoords=(minX, minY), maxCoords=(maxX, maxY), cellSize=1/res, qdegree=pdegree, regular=False)
 
 # mesh = uw.meshing.StructuredQuadBox(elementRes=(20,20),
 #                                       minCoords=(minX,minY),
 #                                       maxCoords=(maxX,maxY),)
 
 
-p_soln = uw.discretisation.MeshVariable("P", mesh, 1, degree=2)
+p_soln = uw.discretisation.MeshVariable("P", mesh, 1, degree=pdegree)
 v_soln = uw.discretisation.MeshVariable("U", mesh, mesh.dim, degree=1)
 
 # x and y coordinates
@@ -70,8 +82,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     pl = pv.Plotter()
 
@@ -162,8 +173,11 @@ darcy._v_projector.add_dirichlet_bc(0.0, "Right", [0])
 
 # ### Solve
 
-# Solve times
-darcy.solve()
+# Solve time, recorded with the results
+profiler = PhaseProfiler()
+
+with profiler.phase('first_solve'):
+    darcy.solve()
 
 # +
 ### Visualise the result
@@ -180,8 +194,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with mesh.access():
         usol = v_soln.data.copy()
@@ -280,8 +293,28 @@ ax1.plot(pressure_analytic_noG, ycoords, linewidth=3, linestyle="--", label="Ana
 ax1.grid("on")
 ax1.legend()
 # -
-if not np.allclose(pressure_analytic_noG, pressure_interp, atol=1e-2):
-    raise RuntimeError('Analytical and numerical solution not close')
+
+# ### Error norms over the whole domain
+# Recorded for convergence studies when run with `-convergence_file` (see `benchmark_utils/convergence.py`)
+
+# +
+pressure_exact = sympy.Piecewise((-Pa * y / La, y >= -La), (Pa + (dP - Pa) * (-y - La) / Lb, True))
+p_norms = error_norms(mesh, p_soln, pressure_exact)
+
+if uw.mpi.rank == 0:
+    print(f"Pressure: L2 = {p_norms['L2']:.4e}, H1 = {p_norms['H1']:.4e}")
+
+record_run('Darcy_1D', res, h=1/res, dofs=global_dofs(darcy), wall_time=profiler.total('first_solve'),
+           errors={'L2_P': p_norms['L2'], 'H1_P': p_norms['H1']},
+           pdegree=pdegree, benchmark_version=benchmark_version)
+# -
+
+# ### Compare with the golden values
+# The run is added to the regression database (see `benchmark_utils/regression.py`); raises if the pressure profile is outside its tolerance.
+
+check_results('Darcy_1D', metrics={'pressure_max_error': np.abs(pressure_analytic_noG - pressure_interp).max(),
+                                   'L2_P': p_norms['L2']},
+              timings=profiler.timings, res=res, pdegree=pdegree, benchmark_version=benchmark_version)
 
 np.allclose(pressure_analytic_noG, pressure_interp, atol=1e-2)
 
@@ -18,7 +18,15 @@
 # +
 import underworld3 as uw
 import numpy as np
-import math
+import sympy
+
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.reference import diffusion_1D
+from benchmark_utils.convergence import error_norms, global_dofs, record_run
+
+from benchmark_utils.profiling import PhaseProfiler
 
 if uw.mpi.size == 1:
     import matplotlib.pyplot as plt
@@ -26,10 +34,10 @@ if uw.mpi.size == 1:
 # #### Setup the mesh params
 
 # +
-# Set the resolution.
-res = 64
+# Set the resolution, can be set from the command line (e.g. -res 32 -Tdegree 2) for convergence studies
+res = uw.options.getInt('res', default=64)
 
-Tdegree = 4
+Tdegree = uw.options.getInt('Tdegree', default=4)
 
 ### diffusivity constant
 k = 1
@@ -93,9 +101,7 @@ def plot_fig():
         pv.global_theme.smooth_shading = True
 
         # pv.start_xvfb()
-        mesh.vtk("tmpMsh.vtk")
-        # mesh.vtk("ignore_periodic_mesh.vtk")
-        pvmesh = pv.read("tmpMsh.vtk")
+        pvmesh = mesh_to_pyvista(mesh)
 
         # pvmesh.point_data["S"]  = uw.function.evaluate(s_soln.fn, meshbox.data)
 
@@ -139,37 +145,6 @@ diffusion.petsc_options["snes_converged_reason"] = None
 
 # -
 
-def diffusion_1D(sample_points, T0, diffusivity, time_1D):
-    x = sample_points
-    T = T0
-    k = diffusivity
-    time = time_1D
-
-    dx = sample_points[1] - sample_points[0]
-
-    dt_dif = (dx**2 / k)
-
-    dt = 0.5 * dt_dif
-
-
-    if time > 0:
-
-        """ determine number of its """
-        nts = math.ceil(time / dt)
-    
-        """ get dt of 1D model """
-        final_dt = time / nts
-
-    
-        for i in range(nts):
-            qT = -k * np.diff(T) / dx
-            dTdt = -np.diff(qT) / dx
-            T[1:-1] += dTdt * final_dt
-
-    
-
-    return T
-
 # +
 ### y coords to sample
 sample_y = np.arange(
@@ -189,7 +164,10 @@ T_orig = uw.function.evalf(T.sym[0], sample_points)
 # +
 ## SNES scalar equation - works
 ### Set up the F0 and F1 terms
-dt = mesh.get_min_radius()**2 / k
+### 11 steps of min_radius^2 / k unless a fixed end time is given (-end_time, used for convergence studies)
+end_time = uw.options.getReal('end_time', default=11 * mesh.get_min_radius()**2 / k)
+nsteps = int(np.ceil(end_time / (mesh.get_min_radius()**2 / k) - 1e-6))
+dt = end_time / nsteps
 
 diffusion.F0 += (T.sym - T_star.sym) / dt
 flux_star = diffusion.constitutive_model.flux
@@ -203,10 +181,10 @@ model_time = 0.
 
 if uw.mpi.size == 1:
     plt.plot(sample_points[:,1], T_orig)
-while step < 11:
+### wall time of the solves (the first includes the solver setup)
+profiler = PhaseProfiler()
 
-    ### update terms before solve
-    dt = mesh.get_min_radius()**2 / k
+while step < nsteps:
 
     if uw.mpi.rank == 0:
         print(f'step: {step}, time: {model_time}\n\n')
@@ -214,12 +192,18 @@ while step < 11:
         
 
     
-    diffusion.solve()
+    with profiler.phase('first_solve' if step == 0 else 'solve'):
+        diffusion.solve()
     ### get the updated temp profile
     T_new = uw.function.evalf(T.sym[0], sample_points)
     
     if uw.mpi.size == 1:
         plt.plot(sample_points[:,1], T_new)
+
+    ### 1D reference at the same time, cheap enough to check every step
+    T_ref = diffusion_1D(sample_points[:,1], T_orig, k, model_time + dt)
+    if uw.mpi.rank == 0:
+        print(f'max difference from 1D reference: {np.abs(T_new - T_ref).max()}\n')
     
     ### update the flux history in case it's non-linear
     flux_star = diffusion.constitutive_model.flux
@@ -235,7 +219,7 @@ while step < 11:
 
 # #### Numerical 1D solution to compare against
 
-T_1D = diffusion_1D(sample_points=sample_points[:,1], T0=T_orig.copy(), diffusivity=k, time_1D=model_time)
+T_1D = diffusion_1D(sample_points[:,1], T_orig, diffusivity=k, time=model_time)
 T_UW = uw.function.evalf(T.sym[0], sample_points)
 if uw.mpi.size == 1:
     plt.plot(sample_points[:,1], T_1D, label='1D')
@@ -246,4 +230,21 @@ if uw.mpi.size == 1:
     ### Check the result is close
     np.allclose(T_1D, T_UW, rtol=0.01)
 
+# #### Error norms over the whole domain
+# Against the closed-form solution for the hot layer (the walls are far enough away for the times used).
+# Recorded for convergence studies when run with `-convergence_file` (see `benchmark_utils/convergence.py`)
 
+# +
+y = mesh.CoordinateSystem.X[1]
+width = 2 * sympy.sqrt(k * model_time)
+T_exact = tmin + (tmax - tmin) * (sympy.erf((y - 0.4) / width) - sympy.erf((y - 0.6) / width)) / 2
+
+T_norms = error_norms(mesh, T, T_exact)
+
+if uw.mpi.rank == 0:
+    print(f"Temperature: L2 = {T_norms['L2']:.4e}, H1 = {T_norms['H1']:.4e}")
+
+record_run('Diffusion', res, h=1/res, dofs=global_dofs(diffusion), wall_time=profiler.total('first_solve', 'solve'),
+           errors={'L2_T': T_norms['L2'], 'H1_T': T_norms['H1']},
+           Tdegree=Tdegree, end_time=end_time)
+# -
@@ -52,6 +52,10 @@ import underworld3 as uw
 import numpy as np
 import sympy
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+
 options = PETSc.Options()
 # -
 
@@ -91,8 +95,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     pl = pv.Plotter()
 
@@ -188,8 +191,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with mesh.access():
         usol = v_soln.data.copy()
@@ -304,8 +306,7 @@ if uw.mpi.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with mesh.access():
         usol = v_soln.data.copy()
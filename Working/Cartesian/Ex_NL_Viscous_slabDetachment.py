@@ -12,8 +12,22 @@ import sympy
 import petsc4py
 import pyvista as pv
 
-import glob
 import os
+import sys
+
+sys.path.append('../../')
+from benchmark_utils.checkpoint import AsyncCheckpointWriter
+from benchmark_utils.rendering import BackgroundRenderer
+from benchmark_utils.restart import RestartManager
+from benchmark_utils.timeseries import TimeSeriesWriter
+from benchmark_utils.visualisation import mesh_to_pyvista, swarm_to_pyvista
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.memory import memory_report, memory_table
+from benchmark_utils.petsc_log import log_view_summary, stage_table
+from benchmark_utils.steptimes import StepRecorder
+from benchmark_utils.lazy_index import LazyIndexSwarmVariable
+from benchmark_utils.population import PopulationControl
 
 # %%
 options = PETSc.Options()
@@ -44,6 +58,9 @@ nsteps = 10
 ## swarm gauss point count (particle distribution)
 swarmGPC = 2
 
+### particles drawn by plot_mat, above this a stratified subsample is plotted
+max_plot_points = 200000
+
 
 ### distance between elements, in km
 res = 20
@@ -51,30 +68,39 @@ res = 20
 ### Recycle rate of particles
 recycle_rate = 0
 
+### particles per cell are kept between these (split where fewer, merged where more), every population_interval steps
+min_particles_per_cell = 4
+max_particles_per_cell = 16
+population_interval    = 1
+
+### append the mesh variables to one time-series file instead of a file set per step
+timeseries_output = True
+
+### also write the petsc swarm files (for viewing the particles in paraview)
+swarm_xdmf_output = False
+
+### render each checkpoint to PNG offscreen in a separate process (also in parallel runs)
+offscreen_render = True
+
 # %%
 outputPath = f'./output/slabDetachment_res={res}km_recycleRate={recycle_rate}/'
 
 # %%
-reload = False
-
 if uw.mpi.rank == 0:
-    # checking if the directory
-    # exist or not.
-    if os.path.exists(outputPath):
-        reload = True
-        restart_step = os.path.basename(max(glob.iglob(outputPath + 'swarm*xmf'), key=os.path.getctime))[-9:-4]
-        pv_mesh_data = pv.XdmfReader(outputPath + f'step_{restart_step}.xdmf').read()
-        time_d =  pv_mesh_data['time_time'][0]
-    
-    else:
+    os.makedirs(outputPath, exist_ok=True)
 
-        # if the demo_folder directory is not present 
-        # then create it.
-        os.makedirs(outputPath)
+### restart from the newest complete checkpoint listed in the manifest, if there is one
+### older checkpoints are deleted, unless the background renderer may still need them
+restart = RestartManager(outputPath, keep_checkpoints=None if offscreen_render else 3)
 
-        step = 0
-        time = 0.
-        restart_step = -1
+reload = restart.latest is not None
+
+if reload:
+    restart_step = restart.latest['step']
+else:
+    step = 0
+    time = 0.
+    restart_step = -1
 
 
 
@@ -147,12 +173,16 @@ if uw.mpi.rank == 0:
 # ### Create mesh
 
 # %%
+### wall time and memory of each phase of the run, recorded with the results. Each phase is also a PETSc log stage
+profiler = PhaseProfiler(memory=True, log_stages=True)
+
 # mesh = uw.meshing.UnstructuredSimplexBox(minCoords=(xmin, ymin), maxCoords=(xmax, ymax), cellSize=1.0 / resy, regular=False)
 
 
-mesh = uw.meshing.StructuredQuadBox(elementRes =(int(resx),int(resy)),
-                                    minCoords=(xmin,ymin), 
-                                    maxCoords=(xmax,ymax))
+with profiler.phase('mesh'):
+    mesh = uw.meshing.StructuredQuadBox(elementRes =(int(resx),int(resy)),
+                                        minCoords=(xmin,ymin), 
+                                        maxCoords=(xmax,ymax))
 
 # check the mesh if in a notebook / serial
 
@@ -170,8 +200,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    mesh.vtk(outputPath + "SD_mesh.vtk")
-    pvmesh = pv.read(outputPath + "SD_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # with mesh1.access():
         # usol = stokes.u.data.copy()
@@ -189,17 +218,18 @@ if uw.mpi.size == 1:
 # ### Create Stokes object
 
 # %%
-v = uw.discretisation.MeshVariable('U',    mesh,  mesh.dim, degree=2 )
-# p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1 )
-p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1,  continuous=True)
+with profiler.phase('variables'):
+    v = uw.discretisation.MeshVariable('U',    mesh,  mesh.dim, degree=2 )
+    # p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1 )
+    p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1,  continuous=True)
 
-### Create mesh variables to project stuff onto
-strain_rate_inv2 = uw.discretisation.MeshVariable("SR", mesh, 1, degree=2)
-dev_stress_inv2 = uw.discretisation.MeshVariable("stress", mesh, 1, degree=1)
-node_viscosity = uw.discretisation.MeshVariable("viscosity", mesh, 1, degree=1)
+    ### Create mesh variables to project stuff onto
+    strain_rate_inv2 = uw.discretisation.MeshVariable("SR", mesh, 1, degree=2)
+    dev_stress_inv2 = uw.discretisation.MeshVariable("stress", mesh, 1, degree=1)
+    node_viscosity = uw.discretisation.MeshVariable("viscosity", mesh, 1, degree=1)
 
-timeField      = uw.discretisation.MeshVariable("time", mesh, 1, degree=1)
-materialField  = uw.discretisation.MeshVariable("material", mesh, 1, degree=1)
+    timeField      = uw.discretisation.MeshVariable("time", mesh, 1, degree=1)
+    materialField  = uw.discretisation.MeshVariable("material", mesh, 1, degree=1)
 
 
 # %%
@@ -213,33 +243,35 @@ stokes.constitutive_model = uw.constitutive_models.ViscousFlowModel
 # %%
 swarm     = uw.swarm.Swarm(mesh=mesh, recycle_rate=recycle_rate)
 
-### Material index swarm with 2 indicies (crust and mantle)
-material  = uw.swarm.IndexSwarmVariable("M", swarm, indices=2)
+### Material index swarm with 2 indicies (crust and mantle), the masks are rebuilt by material.refresh(), before the solves and projections, if the particles moved
+material  = LazyIndexSwarmVariable("M", swarm, indices=2)
 
 
 
 # %%
 if reload == False: 
-    swarm.populate_petsc(swarmGPC)
-    for i in [material]:
-            with swarm.access(i):
-                i.data[:] = BGIndex
-                i.data[(swarm.data[:,1] >= ndim((660-80) * u.kilometer))] = SlabIndex
-    
-                i.data[(swarm.data[:,1] >= ndim((660-(250+80)) * u.kilometer)) & 
-                       (swarm.data[:,0] >= ndim((500-40)*u.kilometer)) &
-                       (swarm.data[:,0] <= ndim((500+40)*u.kilometer))] = SlabIndex
+    with profiler.phase('swarm'):
+        swarm.populate_petsc(swarmGPC)
+        for i in [material]:
+                with swarm.access(i):
+                    i.data[:] = BGIndex
+                    i.data[(swarm.data[:,1] >= ndim((660-80) * u.kilometer))] = SlabIndex
+        
+                    i.data[(swarm.data[:,1] >= ndim((660-(250+80)) * u.kilometer)) & 
+                           (swarm.data[:,0] >= ndim((500-40)*u.kilometer)) &
+                           (swarm.data[:,0] <= ndim((500+40)*u.kilometer))] = SlabIndex
 
 else:
-    pv_swarm_data = pv.XdmfReader(outputPath + f'swarm_{restart_step}.xmf').read()
-
-    swarm.add_particles_with_coordinates(np.ascontiguousarray( pv_swarm_data.points[:,0:2] ))
+    ### each rank reads its own particles back from the checkpoint
+    with profiler.phase('swarm'):
+        restart.restore_swarm(swarm, [material], 'swarm')
 
-    with swarm.access(material):
-        material.data[:,0] = pv_swarm_data['material']
+    time = restart.latest['time']
+    step = restart_step
 
-    time = nd(time_d*u.megayear)
-    step = int(restart_step)
+### new particles take the material of their nearest neighbour, merged particles keep a neighbour of the same material
+population = PopulationControl(swarm, min_per_cell=min_particles_per_cell, max_per_cell=max_particles_per_cell,
+                               preserve=[material])
     
 
 
@@ -259,7 +291,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    pvmesh = pv.read(outputPath + "SD_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # with mesh1.access():
         # usol = stokes.u.data.copy()
@@ -322,6 +354,9 @@ def updateFields(time):
     with mesh.access(timeField):
         timeField.data[:,0] = dim(time, u.megayear).m
 
+    ### rebuild the material masks if the particles moved (collective, so on every rank)
+    material.refresh()
+
     nodal_strain_rate_inv2.solve()
 
     
@@ -353,15 +388,10 @@ def plot_mat():
     pv.global_theme.smooth_shading = True
 
 
-    pvmesh = pv.read(outputPath + "SD_mesh.vtk")
-
-    with swarm.access():
-        points = np.zeros((swarm.data.shape[0],3))
-        points[:,0] = swarm.data[:,0]
-        points[:,1] = swarm.data[:,1]
-        points[:,2] = 0.0
+    pvmesh = mesh_to_pyvista(mesh)
 
-    point_cloud = pv.PolyData(points)
+    ### stratified subsample of the particles, cached on the swarm
+    point_cloud = swarm_to_pyvista(swarm, [material], max_points=max_plot_points)
     
     ### create point cloud for passive tracers
     with passiveSwarm_L.access():
@@ -371,9 +401,6 @@ def plot_mat():
         passiveCloud_R = pv.PolyData(np.vstack((passiveSwarm_R.data[:,0],passiveSwarm_R.data[:,1], np.zeros(len(passiveSwarm_R.data)))).T)
 
 
-    with swarm.access():
-        point_cloud.point_data["M"] = material.data.copy()
-        
 
 
 
@@ -440,13 +467,9 @@ if reload == False:
     passiveSwarm_R.add_particles_with_coordinates(np.ascontiguousarray(tracers_R))
 
 else:
-    pv_swarm_L = pv.XdmfReader(outputPath + f'PT_L_{restart_step}.xmf').read()
-
-    passiveSwarm_L.add_particles_with_coordinates(np.ascontiguousarray( pv_swarm_L.points[:,0:2] ))
-
-    pv_swarm_R = pv.XdmfReader(outputPath + f'PT_R_{restart_step}.xmf').read()
+    restart.restore_swarm(passiveSwarm_L, [], 'PT_L')
 
-    passiveSwarm_R.add_particles_with_coordinates(np.ascontiguousarray( pv_swarm_R.points[:,0:2] ))
+    restart.restore_swarm(passiveSwarm_R, [], 'PT_R')
 
 
 
@@ -505,7 +528,10 @@ stokes.saddle_preconditioner = 1.0 / viscosity_L_fn
 
 
 # %%
-stokes.solve(zero_init_guess=False)
+### linear solve, includes the solver setup
+with profiler.phase('first_solve'):
+    material.refresh()
+    stokes.solve(zero_init_guess=False)
 
 # %% [markdown]
 # #### Introduce NL viscosity
@@ -556,19 +582,47 @@ stokes.saddle_preconditioner = 1.0 / viscosity_mat_fn
 # Function to put in solver loop
 
 # %%
+if timeseries_output:
+    timeseries = TimeSeriesWriter(outputPath, mesh,
+                                  meshVars=[v, p, strain_rate_inv2, node_viscosity, timeField],
+                                  ### a restarted run starts a new file rather than overwriting the first
+                                  name='slabDetachment' if not reload else f'slabDetachment_restart{restart_step:05d}')
+
+### restart data, written in the background while the next solve runs
+checkpointer = AsyncCheckpointWriter(outputPath, mesh,
+                                     meshVars=[v, p, node_viscosity],
+                                     swarms={'swarm': (swarm, [material]),
+                                             'PT_L': (passiveSwarm_L, []),
+                                             'PT_R': (passiveSwarm_R, [])})
+
+if offscreen_render:
+    renderer = BackgroundRenderer(outputPath,
+                                  views=[{'name': 'material', 'swarm': 'swarm', 'variable': 'M'},
+                                         {'name': 'velocity', 'arrows': 'U'},
+                                         {'name': 'viscosity', 'field': 'viscosity', 'log': True}],
+                                  rank=uw.mpi.rank)
+
 def saveData(step, outputPath, time):
 
-    ### add mesh vars to viewer to save as one h5/xdmf file. Has to be a PETSc object (?)
-    mesh.petsc_save_checkpoint(index=step, 
-                               meshVars=[v, p, strain_rate_inv2,node_viscosity, timeField], 
-                                outputPath=outputPath)
+    ### snapshot the restart data, the manifest is updated once every rank has finished writing
+    checkpointer.save(step, time, arrays={'NeckWidth': NeckWidth, 'time': time_array})
+    restart.update(checkpointer)
+
+    if timeseries_output:
+        timeseries.write(step, time)
+    else:
+        ### add mesh vars to viewer to save as one h5/xdmf file. Has to be a PETSc object (?)
+        mesh.petsc_save_checkpoint(index=step, 
+                                   meshVars=[v, p, strain_rate_inv2,node_viscosity, timeField], 
+                                    outputPath=outputPath)
     
     
     #### save the swarm and selected variables
-    swarm.petsc_save_checkpoint('swarm', step, outputPath)
+    if swarm_xdmf_output:
+        swarm.petsc_save_checkpoint('swarm', step, outputPath)
     
-    passiveSwarm_L.petsc_save_checkpoint('PT_L', step, outputPath)
-    passiveSwarm_R.petsc_save_checkpoint('PT_R', step, outputPath)
+        passiveSwarm_L.petsc_save_checkpoint('PT_L', step, outputPath)
+        passiveSwarm_R.petsc_save_checkpoint('PT_R', step, outputPath)
     
 
 
@@ -578,11 +632,13 @@ NeckWidth  = np.zeros(nsteps)*np.nan
 
 # %%
 if reload == True:
-    time_load = np.load(outputPath + f'modelTime-{res}km.npz')['arr_0']
-    time_array[:time_load.shape[0]] = nd(time_load* u.megayear)
+    ### restore the solution (initial guess for the next solve) and the time series
+    restart.restore_mesh_variables([v, p])
 
-    width_load = np.load(outputPath + f'NeckWidth-{res}km.npz')['arr_0']
-    NeckWidth[:time_load.shape[0]] = nd(width_load*u.kilometer)
+    arrays = restart.restore_arrays()
+    n_load = min(nsteps, arrays['time'].shape[0])
+    time_array[:n_load] = arrays['time'][:n_load]
+    NeckWidth[:n_load] = arrays['NeckWidth'][:n_load]
 
     if uw.mpi.rank==0:
         print('starting from:')
@@ -591,6 +647,10 @@ if reload == True:
 
 
 
+# %%
+### cost of each phase per step (see benchmark_utils/steptimes.py), a restarted run starts a new file
+step_times = StepRecorder(profiler, f'{outputPath}step_times.npz' if not reload else f'{outputPath}step_times_restart{restart_step:05d}.npz')
+
 # %% [markdown]
 # ### Solver loop for multiple iterations
 
@@ -598,11 +658,12 @@ if reload == True:
 while step < nsteps:
     
     ### Get the x coordinates of the passive tracers
-    with passiveSwarm_L.access():
-        PS_L =  uw.utilities.gather_data(passiveSwarm_L.data[:,0], bcast=True)
-    
-    with passiveSwarm_R.access():
-        PS_R =  uw.utilities.gather_data(passiveSwarm_R.data[:,0], bcast=True)
+    with profiler.phase('diagnostics'):
+        with passiveSwarm_L.access():
+            PS_L =  uw.utilities.gather_data(passiveSwarm_L.data[:,0], bcast=True)
+        
+        with passiveSwarm_R.access():
+            PS_R =  uw.utilities.gather_data(passiveSwarm_R.data[:,0], bcast=True)
         
     L_xmax = PS_L.max()
     R_xmin = PS_R.min()
@@ -616,16 +677,18 @@ while step < nsteps:
         if uw.mpi.rank==0:
             print(f'\n\nSave data: \n\n')
         ### update fields first
-        updateFields(time = time)
-        ### save mesh variables
-        saveData(step=step, outputPath=outputPath, time = time)
-
-        ### remove nan values, if any. Convert to km and Myr
-        NeckWidth_d = dim(NeckWidth[~np.isnan(NeckWidth)], u.kilometer)
-        time_array_d   = dim(time_array[~np.isnan(time_array)], u.megayear)
-        if uw.mpi.rank == 0:
-            np.savez_compressed(f'{outputPath}/NeckWidth-{res}km', NeckWidth_d.m)
-            np.savez_compressed(f'{outputPath}/modelTime-{res}km', time_array_d.m)
+        with profiler.phase('projections'):
+            updateFields(time = time)
+        with profiler.phase('io'):
+            ### save mesh variables
+            saveData(step=step, outputPath=outputPath, time = time)
+
+            ### remove nan values, if any. Convert to km and Myr
+            NeckWidth_d = dim(NeckWidth[~np.isnan(NeckWidth)], u.kilometer)
+            time_array_d   = dim(time_array[~np.isnan(time_array)], u.megayear)
+            if uw.mpi.rank == 0:
+                np.savez_compressed(f'{outputPath}/NeckWidth-{res}km', NeckWidth_d.m)
+                np.savez_compressed(f'{outputPath}/modelTime-{res}km', time_array_d.m)
         
     ### print some stuff    
     if uw.mpi.rank==0:
@@ -633,22 +696,41 @@ while step < nsteps:
         
     
     ### solve stokes 
-    stokes.solve(zero_init_guess=False)
+    with profiler.phase('solve'):
+        material.refresh()
+        stokes.solve(zero_init_guess=False)
     ### estimate dt
     dt = 0.5 * stokes.estimate_dt()
 
 
     ### advect the swarm
-    swarm.advection(stokes.u.sym, dt, corrector=False, evalf=True)
-    
-    passiveSwarm_L.advection(stokes.u.sym, dt, corrector=False, evalf=True)
-    
-    passiveSwarm_R.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+    with profiler.phase('advection'):
+        swarm.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+        
+        passiveSwarm_L.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+        
+        passiveSwarm_R.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+
+    ### bound the particles per cell
+    if step % population_interval == 0:
+        with profiler.phase('population'):
+            population.apply()
     
+    step_times.end_step(step, time)
         
     step+=1
     time+=dt
 
+### wait for any checkpoints still being written
+with profiler.phase('io'):
+    checkpointer.close()
+    restart.update(checkpointer)
+
+step_times.save()
+
+if offscreen_render:
+    renderer.finish()
+
 # %% [markdown]
 # #### Check the results against the benchmark 
 
@@ -673,6 +755,25 @@ if uw.mpi.rank==0:
     print('Initial: t = {0:.3f}, w = {1:.3f}'.format(time_array_d[0], NeckWidth_d[0]))
     print('Final:   t = {0:.3f}, w = {1:.3f}'.format(time_array_d[-1], NeckWidth_d[-1]))
 
+### regression database (see benchmark_utils/regression.py), timings are for the steps run since the last restart
+memory = memory_report(profiler, mesh, [swarm, passiveSwarm_L, passiveSwarm_R])
+cell_min, cell_mean, cell_max = population.cell_counts()
+petsc_log = log_view_summary(f'{outputPath}petsc_log_view.txt')
+
+if uw.mpi.rank == 0:
+    print(profiler.table())
+    print(memory_table(memory))
+    print(stage_table(petsc_log))
+    print(f'particles per cell: {cell_min} - {cell_max} (mean {cell_mean:.1f}), '
+          f'{population.counters["added"]} added, {population.counters["removed"]} removed')
+    print('material masks: {changes} swarm changes, {rebuilds} rebuilds ({rebuild_time:.2f} s), {unchanged} skipped unchanged'.format(**material.counters))
+
+check_results('slabDetachment',
+              metrics={'NeckWidth_initial_km': NeckWidth_d[0].m, 'NeckWidth_final_km': NeckWidth_d[-1].m,
+                       'time_final_Myr': time_array_d[-1].m},
+              timings=profiler.timings, memory=memory, petsc_log=petsc_log,
+              res=res, nsteps=nsteps, linear=linear, swarmGPC=swarmGPC)
+
     
 if uw.mpi.rank==0:
         
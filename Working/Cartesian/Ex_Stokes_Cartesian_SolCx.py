@@ -29,24 +29,37 @@ import numpy as np
 
 import sympy
 from sympy import Piecewise
+
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.analytic import SolCx
+from benchmark_utils.convergence import error_norms, global_dofs, record_run
+from benchmark_utils.regression import check_results
+
+from benchmark_utils.profiling import PhaseProfiler
 # -
 
 # #### Create the mesh
 
 # +
-res = 64
+### resolution and discretisation, can be set from the command line (e.g. -res 32 -vdegree 3) for convergence studies
+res = uw.options.getInt('res', default=64)
+vdegree = uw.options.getInt('vdegree', default=2)
+qdegree = uw.options.getInt('qdegree', default=3)
+
 # mesh = uw.meshing.UnstructuredSimplexBox(
 #     minCoords=(0.0, 0.0), maxCoords=(1.0, 1.0), cellSize=1 / 50, qdegree=2
 # )
 
-mesh  = uw.meshing.StructuredQuadBox(minCoords=(0.0, 0.0), maxCoords=(1.0, 1.0), elementRes=(res, res), qdegree=3)
+mesh  = uw.meshing.StructuredQuadBox(minCoords=(0.0, 0.0), maxCoords=(1.0, 1.0), elementRes=(res, res), qdegree=qdegree)
 # -
 
 
 # #### Add some mesh vars
 
-v = uw.discretisation.MeshVariable("U", mesh, mesh.dim, degree=2)
-p = uw.discretisation.MeshVariable("P", mesh, 1, degree=1)
+v = uw.discretisation.MeshVariable("U", mesh, mesh.dim, degree=vdegree)
+p = uw.discretisation.MeshVariable("P", mesh, 1, degree=vdegree-1)
 
 # #### Create Stokes solver
 
@@ -147,50 +160,65 @@ stokes.petsc_options["snes_max_it"] = 100
 
 stokes.petsc_options["snes_monitor_short"] = None
 
-# Solve time
-stokes.solve()
+# Solve time, recorded with the results
+profiler = PhaseProfiler()
 
-# ### Get the velocity from uw3 solution and uw2 analytical solution
+with profiler.phase('first_solve'):
+    stokes.solve()
 
-# +
-### placeholder for uw2 analytical solution
-vel_soln_analytic = None
+# ### Get the velocity from uw3 solution and the analytical solution
 
-### get uw3 velocity
+# +
+### get uw3 velocity and pressure
 vel_soln_uw3 = uw.function.evaluate(v.fn, mesh._centroids )
+p_soln_uw3 = uw.function.evaluate(p.sym[0], mesh._centroids)
 
 # -
 
-# ##### Attempt to get analytical solution from uw2
+# ##### Analytical solution
+# Evaluated in numpy (no underworld2 needed), same parameters as the model
 
 # +
-try:
-    import underworld as uw2
+solCx = SolCx(eta_A=eta_0, eta_B=eta_1, x_c=x_c, n_z=n_z)
+vel_soln_analytic = solCx.velocity(mesh._centroids)
+p_soln_analytic = solCx.pressure(mesh._centroids)
 
-    solCx = uw2.function.analytic.SolCx(n_z=n_z, eta_A=eta_0, eta_B=eta_1, x_c=x_c)
-    vel_soln_analytic = solCx.fn_velocity.evaluate(mesh._centroids)
+from numpy import linalg as LA
 
+### pressure is only defined up to a constant with free-slip walls
+p_diff = (p_soln_uw3 - p_soln_uw3.mean()) - (p_soln_analytic - p_soln_analytic.mean())
 
-    
+if uw.mpi.rank == 0:
+    print("Diff norm = {}".format(LA.norm(vel_soln_uw3 - vel_soln_analytic)))
+    print("Relative velocity error = {}".format(LA.norm(vel_soln_uw3 - vel_soln_analytic) / LA.norm(vel_soln_analytic)))
+    print("Relative pressure error = {}".format(LA.norm(p_diff) / LA.norm(p_soln_analytic)))
 
-    from numpy import linalg as LA
-    if uw.mpi.rank == 0:
-        # print("Diff norm a. = {}".format(LA.norm(v.data - vel_soln_analytic)))
-        print("Diff norm = {}".format(LA.norm(vel_soln_uw3 - vel_soln_analytic)))
+# -
 
-        
+# ##### Error norms over the whole domain
+# Recorded for convergence studies when run with `-convergence_file` (see `benchmark_utils/convergence.py`)
 
-        if not np.allclose(vel_soln_uw3, vel_soln_analytic):
-            raise RuntimeError("Solve did not produce expected result.")
+# +
+v_norms = error_norms(mesh, v, solCx.velocity)
+p_norms = error_norms(mesh, p, solCx.pressure, remove_mean=True)
 
-    
+if uw.mpi.rank == 0:
+    print(f"Velocity: L2 = {v_norms['L2']:.4e}, H1 = {v_norms['H1']:.4e}; Pressure: L2 = {p_norms['L2']:.4e}")
 
-except ImportError:
-    import warnings
+record_run('SolCx', res, h=1/res, dofs=global_dofs(stokes), wall_time=profiler.total('first_solve'),
+           errors={'L2_U': v_norms['L2'], 'H1_U': v_norms['H1'], 'L2_P': p_norms['L2']},
+           vdegree=vdegree, qdegree=qdegree, eta_1=eta_1)
 
-    warnings.warn("Unable to test SolC results as UW2 not available.")
+### regression database (see `benchmark_utils/regression.py`)
+check_results('SolCx', metrics={'L2_U': v_norms['L2'], 'H1_U': v_norms['H1'], 'L2_P': p_norms['L2'],
+                                'velocity_rel_error': LA.norm(vel_soln_uw3 - vel_soln_analytic) / LA.norm(vel_soln_analytic),
+                                'pressure_rel_error': LA.norm(p_diff) / LA.norm(p_soln_analytic)},
+              timings=profiler.timings, res=res, vdegree=vdegree, qdegree=qdegree, eta_1=eta_1)
 # -
 
+if not np.allclose(vel_soln_uw3, vel_soln_analytic):
+    raise RuntimeError("Solve did not produce expected result.")
+
 # ### Visualise it !
 
 # +
@@ -210,8 +238,7 @@ if mpi4py.MPI.COMM_WORLD.size == 1:
     pv.global_theme.jupyter_backend = "panel"
     pv.global_theme.smooth_shading = True
 
-    mesh.vtk("tmp_mesh.vtk")
-    pvmesh = pv.read("tmp_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
 
     pvmesh.point_data["P"] = uw.function.evaluate(p.sym[0], mesh.data)
@@ -247,8 +274,7 @@ if mpi4py.MPI.COMM_WORLD.size == 1:
     uw3_loc, uw3_len = gen_arrows(vel_soln_uw3, mesh)
     pl.add_arrows(uw3_loc, uw3_len, mag=15, color='k',opacity=0.8)
     
-    if vel_soln_analytic is not None:
-        uw2_loc, uw2_len = gen_arrows(vel_soln_analytic, mesh)
-        pl.add_arrows(uw2_loc, uw2_len, mag=15, color='green', opacity=0.8)
+    analytic_loc, analytic_len = gen_arrows(vel_soln_analytic, mesh)
+    pl.add_arrows(analytic_loc, analytic_len, mag=15, color='green', opacity=0.8)
 
     pl.show(cpos="xy", screenshot='SolCx_sol.png')
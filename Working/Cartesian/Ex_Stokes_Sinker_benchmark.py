@@ -20,6 +20,19 @@ import petsc4py
 import pyvista as pv
 
 import os
+import sys
+
+sys.path.append('../../')
+from benchmark_utils.checkpoint import AsyncCheckpointWriter
+from benchmark_utils.rendering import BackgroundRenderer
+from benchmark_utils.convergence import global_dofs, record_run
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.memory import memory_report, memory_table
+from benchmark_utils.petsc_log import log_view_summary, stage_table
+from benchmark_utils.steptimes import StepRecorder
+from benchmark_utils.lazy_index import LazyIndexSwarmVariable
+from benchmark_utils.visualisation import mesh_to_pyvista, swarm_to_pyvista
 
 # %%
 petsc4py.__version__
@@ -43,9 +56,12 @@ nsteps = 1
 ## swarm gauss point count (particle distribution)
 swarmGPC = 2
 
+### particles drawn by plot_mat, above this a stratified subsample is plotted
+max_plot_points = 200000
+
 
-### resolution of model
-res = 128
+### resolution of model, can be set from the command line (e.g. -res 64) for convergence studies
+res = uw.options.getInt('res', default=128)
 
 ### Recycle rate of particles
 recycle_rate = 0
@@ -54,6 +70,12 @@ recycle_rate = 0
 ### stokes tolerance
 stokes_tol = 1e-8
 
+### write checkpoints from a background thread while the next solve runs
+async_checkpoint = True
+
+### render each checkpoint to PNG offscreen in a separate process (also in parallel runs)
+offscreen_render = True
+
 # %%
 # Set constants for the viscosity of each material
 viscBG     =  1
@@ -87,11 +109,14 @@ if uw.mpi.rank==0:
 # ### Create mesh
 
 # %%
+### wall time and memory of each phase of the run, recorded with the results. Each phase is also a PETSc log stage
+profiler = PhaseProfiler(memory=True, log_stages=True)
 
 # mesh = uw.meshing.UnstructuredSimplexBox(minCoords=(xmin, ymin), maxCoords=(xmax, ymax), cellSize=1.0 / resy, regular=False)
 
 
-mesh = uw.meshing.StructuredQuadBox(minCoords=(-1.0, 0.0), maxCoords=(1.0, 1.0),  elementRes=(res,res))
+with profiler.phase('mesh'):
+    mesh = uw.meshing.StructuredQuadBox(minCoords=(-1.0, 0.0), maxCoords=(1.0, 1.0),  elementRes=(res,res))
 
 
 # check the mesh if in a notebook / serial
@@ -110,8 +135,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    mesh.vtk(outputPath + "Stokes_sinker_mesh.vtk")
-    pvmesh = pv.read(outputPath + "Stokes_sinker_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # with mesh1.access():
         # usol = stokes.u.data.copy()
@@ -147,13 +171,14 @@ if uw.mpi.size == 1:
 # ### Create Stokes object
 
 # %%
-v = uw.discretisation.MeshVariable('U',    mesh,  mesh.dim, degree=2 )
-# p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1 )
-p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1,  continuous=True)
+with profiler.phase('variables'):
+    v = uw.discretisation.MeshVariable('U',    mesh,  mesh.dim, degree=2 )
+    # p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1 )
+    p = uw.discretisation.MeshVariable('P',    mesh, 1, degree=1,  continuous=True)
 
-strain_rate_inv2 = uw.discretisation.MeshVariable("SR", mesh, 1, degree=2)
-dev_stress_inv2 = uw.discretisation.MeshVariable("stress", mesh, 1, degree=1)
-node_viscosity = uw.discretisation.MeshVariable("viscosity", mesh, 1, degree=1)
+    strain_rate_inv2 = uw.discretisation.MeshVariable("SR", mesh, 1, degree=2)
+    dev_stress_inv2 = uw.discretisation.MeshVariable("stress", mesh, 1, degree=1)
+    node_viscosity = uw.discretisation.MeshVariable("viscosity", mesh, 1, degree=1)
 
 # timeField      = uw.discretisation.MeshVariable("time", mesh, 1, degree=1)
 # materialField  = uw.discretisation.MeshVariable("material", mesh, 1, degree=1)
@@ -169,16 +194,18 @@ stokes.constitutive_model = uw.constitutive_models.ViscousFlowModel
 # #### Setup swarm
 
 # %%
-swarm = uw.swarm.Swarm(mesh=mesh)
-material = uw.swarm.IndexSwarmVariable("M", swarm, indices=2)
-swarm.populate_petsc(2)
+with profiler.phase('swarm'):
+    swarm = uw.swarm.Swarm(mesh=mesh)
+    ### the material masks are only rebuilt by material.refresh(), before the solves and projections, if the particles moved
+    material = LazyIndexSwarmVariable("M", swarm, indices=2)
+    swarm.populate_petsc(2)
 
-with swarm.access(material):
-    material.data[...] = materialLightIndex
+    with swarm.access(material):
+        material.data[...] = materialLightIndex
 
-    cx, cy, r, m = sphereCentre[0], sphereCentre[1], sphereRadius, materialHeavyIndex
-    inside = (swarm.data[:, 0] - cx) ** 2 + (swarm.data[:, 1] - cy) ** 2 < r**2
-    material.data[inside] = m
+        cx, cy, r, m = sphereCentre[0], sphereCentre[1], sphereRadius, materialHeavyIndex
+        inside = (swarm.data[:, 0] - cx) ** 2 + (swarm.data[:, 1] - cy) ** 2 < r**2
+        material.data[inside] = m
 
 
 
@@ -211,7 +238,7 @@ if uw.mpi.size == 1:
     pv.global_theme.smooth_shading = True
 
 
-    pvmesh = pv.read(outputPath + "Stokes_sinker_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # with mesh1.access():
         # usol = stokes.u.data.copy()
@@ -275,6 +302,9 @@ def updateFields(time):
     # with mesh.access(timeField):
     #     timeField.data[:,0] = dim(time, u.megayear).m
 
+    ### rebuild the material masks if the particles moved (collective, so on every rank)
+    material.refresh()
+
     nodal_strain_rate_inv2.solve()
 
     
@@ -306,20 +336,12 @@ def plot_mat():
     pv.global_theme.smooth_shading = True
 
 
-    pvmesh = pv.read(outputPath + "Stokes_sinker_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
-    with swarm.access():
-        points = np.zeros((swarm.data.shape[0],3))
-        points[:,0] = swarm.data[:,0]
-        points[:,1] = swarm.data[:,1]
-        points[:,2] = 0.0
-
-    point_cloud = pv.PolyData(points)
+    ### stratified subsample of the particles, cached on the swarm
+    point_cloud = swarm_to_pyvista(swarm, [material], max_points=max_plot_points)
     
 
-    with swarm.access():
-        point_cloud.point_data["M"] = material.data.copy()
-        
 
 
 
@@ -400,8 +422,25 @@ stokes.tolerance = stokes_tol
 # Function to put in solver loop
 
 # %%
+if async_checkpoint:
+    checkpointer = AsyncCheckpointWriter(outputPath, mesh,
+                                         meshVars=[v, p, strain_rate_inv2, node_viscosity],
+                                         swarms={'swarm': (swarm, [material])})
+
+if async_checkpoint and offscreen_render:
+    renderer = BackgroundRenderer(outputPath,
+                                  views=[{'name': 'material', 'swarm': 'swarm', 'variable': 'M'},
+                                         {'name': 'velocity', 'arrows': 'U', 'field': 'SR'},
+                                         {'name': 'viscosity', 'field': 'viscosity', 'log': True}],
+                                  rank=uw.mpi.rank)
+
 def saveData(step, outputPath, time):
 
+    if async_checkpoint:
+        ### snapshot the fields, the write happens during the next solve
+        checkpointer.save(step, time)
+        return
+
     ### add mesh vars to viewer to save as one h5/xdmf file. Has to be a PETSc object (?)
     mesh.petsc_save_checkpoint(index=step, 
                                meshVars=[v, p, strain_rate_inv2,node_viscosity], 
@@ -433,17 +472,21 @@ vrms    = np.zeros(nsteps)*np.nan
 step = 0
 time = 0.
 
+### cost of each phase per step (see benchmark_utils/steptimes.py)
+step_times = StepRecorder(profiler, f'{outputPath}step_times.npz')
+
 # %% [markdown]
 # ### Solver loop for multiple iterations
 
 # %%
 while step < nsteps:
 
-    with tracer.access():
-        ySinker[step] = tracer.data[:,1][0]
-    
-    tSinker[step] = time
-    vrms[step]    = v_rms(mesh, v)
+    with profiler.phase('diagnostics'):
+        with tracer.access():
+            ySinker[step] = tracer.data[:,1][0]
+        
+        tSinker[step] = time
+        vrms[step]    = v_rms(mesh, v)
 
     if uw.mpi.rank == 0:
         print('\n\nstep = {0:6d}; time = {1:.3e}; v_rms = {2:.3e}; height = {3:.3e}\n\n'
@@ -454,26 +497,42 @@ while step < nsteps:
         if uw.mpi.rank==0:
             print(f'\n\nSave data: \n\n')
         ### update fields first
-        updateFields(time = time)
+        with profiler.phase('projections'):
+            updateFields(time = time)
         ### save mesh variables
-        saveData(step=step, outputPath=outputPath, time = time)
+        with profiler.phase('io'):
+            saveData(step=step, outputPath=outputPath, time = time)
 
     
-    ### solve stokes 
-    stokes.solve()
+    ### solve stokes, the first solve includes the solver setup
+    with profiler.phase('first_solve' if step == 0 else 'solve'):
+        material.refresh()
+        stokes.solve()
     ### estimate dt
     dt = stokes.estimate_dt()
 
 
     ### advect the swarm
-    swarm.advection(stokes.u.sym, dt, corrector=False, evalf=True)
-    
-    tracer.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+    with profiler.phase('advection'):
+        swarm.advection(stokes.u.sym, dt, corrector=False, evalf=True)
+        
+        tracer.advection(stokes.u.sym, dt, corrector=False, evalf=True)
     
+    step_times.end_step(step, time)
         
     step+=1
     time+=dt
 
+### wait for any checkpoints still being written
+if async_checkpoint:
+    with profiler.phase('io'):
+        checkpointer.close()
+
+    if offscreen_render:
+        renderer.finish()
+
+step_times.save()
+
 # %% [markdown]
 # #### Check the results against the benchmark 
 
@@ -508,7 +567,34 @@ if uw.mpi.rank==0:
 if uw.mpi.size==1 and render == True:
     plot_mat()
 
+# %% [markdown]
+# #### Record the sinking velocity error
+# For convergence studies when run with `-convergence_file` (see `benchmark_utils/convergence.py`).
+# The Stokes velocity is for an unbounded domain, so the error levels off at the wall effect of the box.
+
+# %%
+record_run('Sinker', res, h=1/res, dofs=global_dofs(stokes), wall_time=profiler.total('first_solve', 'solve'),
+           errors={'sink_velocity_rel': abs(-1*vel - stokesSink_vel) / stokesSink_vel},
+           swarmGPC=swarmGPC, viscSphere=viscSphere)
+
+# %% [markdown]
+# The run is added to the regression database (see `benchmark_utils/regression.py`); raises if the relative difference from the Stokes sinking velocity leaves its tolerance (once a trusted run has been promoted to the golden value).
+
+# %%
+memory = memory_report(profiler, mesh, [swarm, tracer])
+petsc_log = log_view_summary(f'{outputPath}petsc_log_view.txt')
+
+if uw.mpi.rank == 0:
+    print(profiler.table())
+    print(memory_table(memory))
+    print(stage_table(petsc_log))
+    print('material masks: {changes} swarm changes, {rebuilds} rebuilds ({rebuild_time:.2f} s), {unchanged} skipped unchanged'.format(**material.counters))
+
+check_results('Sinker', metrics={'sink_velocity_rel_error': abs(-1*vel - stokesSink_vel) / stokesSink_vel}, timings=profiler.timings, memory=memory, petsc_log=petsc_log,
+              res=res, swarmGPC=swarmGPC, viscSphere=viscSphere, nsteps=nsteps)
+
 # %%
+### until the golden band has a promoted value, the sinking velocity is checked against the Stokes estimate directly
 if not np.isclose(-1*vel, stokesSink_vel, atol=1e-2):
     raise RuntimeError('Analytical and numerical solution not close')
 
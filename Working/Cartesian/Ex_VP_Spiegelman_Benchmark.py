@@ -32,6 +32,15 @@ import sympy
 import gmsh
 import os
 
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.petsc_log import log_view_summary, stage_table
+
+from mpi4py import MPI
+
 os.makedirs("meshes", exist_ok=True)
 
 if uw.mpi.size == 1:
@@ -228,17 +237,22 @@ from underworld3 import timing
 timing.reset()
 timing.start()
 
+### wall time of each phase, recorded with the results (uw.timing gives the per-routine breakdown).
+### Each phase is also a PETSc log stage
+profiler = PhaseProfiler(log_stages=True)
+
 # ### Import mesh into UW and visualise
 # - Also
 
-mesh1 = uw.discretisation.Mesh(
-    f"./output/SpiegelmanBenchmark/notch_mesh{problem_size}.msh",
-    simplex=True,
-    qdegree=3,
-    markVertices=False,
-    useRegions=True,
-    useMultipleTags=True,
-)
+with profiler.phase('mesh'):
+    mesh1 = uw.discretisation.Mesh(
+        f"./output/SpiegelmanBenchmark/notch_mesh{problem_size}.msh",
+        simplex=True,
+        qdegree=3,
+        markVertices=False,
+        useRegions=True,
+        useMultipleTags=True,
+    )
 
 # +
 ### stokes mesh vars
@@ -267,8 +281,7 @@ if uw.mpi.size == 1:
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, 1.0]
 
-    mesh1.vtk('./output/SpiegelmanBenchmark/SpiegelmanMesh.vtk')
-    pvmesh = pv.read('./output/SpiegelmanBenchmark/SpiegelmanMesh.vtk')
+    pvmesh = mesh_to_pyvista(mesh1)
 
     pl = pv.Plotter()
 
@@ -340,7 +353,8 @@ material = uw.swarm.IndexSwarmVariable(
     'M', swarm, indices=2, proxy_degree=1)
 
 ### This produces particles at the centre of cells
-swarm.populate(fill_param=0)
+with profiler.phase('swarm'):
+    swarm.populate(fill_param=0)
 
 # + [markdown] magic_args="[markdown]"
 # This is how we extract cell data from the mesh. We can map it to the swarm data structure and use this to
@@ -378,7 +392,7 @@ if uw.mpi.size == 1:
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, 1.0]
 
-    pvmesh = pv.read('./output/SpiegelmanBenchmark/SpiegelmanMesh.vtk')
+    pvmesh = mesh_to_pyvista(mesh1)
 
     pl = pv.Plotter()
 
@@ -490,9 +504,10 @@ def plotFig():
 
     viscosity_calc.uw_function = stokes.constitutive_model.Parameters.shear_viscosity_0
     
-    viscosity_calc.solve()
-    strain_rate_calc.solve()
-    stress_calc.solve()
+    with profiler.phase('projections'):
+        viscosity_calc.solve()
+        strain_rate_calc.solve()
+        stress_calc.solve()
 
     pv.global_theme.background = "white"
     pv.global_theme.window_size = [1050, 500]
@@ -502,7 +517,7 @@ def plotFig():
     pv.global_theme.camera["viewup"] = [0.0, 1.0, 0.0]
     pv.global_theme.camera["position"] = [0.0, 0.0, 1.0]
 
-    pvmesh = pv.read('./output/SpiegelmanBenchmark/SpiegelmanMesh.vtk')
+    pvmesh = mesh_to_pyvista(mesh1)
 
     points = np.zeros((mesh1._centroids.shape[0], 3))
     points[:, 0] = mesh1._centroids[:, 0]
@@ -605,7 +620,8 @@ stokes.constitutive_model.Parameters.shear_viscosity_0 = visc_fn
 
 
 
-stokes.solve(zero_init_guess=True, picard=0)
+with profiler.phase('linear_solve'):
+    stokes.solve(zero_init_guess=True, picard=0)
 
 if uw.mpi.rank == 0:
     print("Linear solve complete", flush=True)
@@ -643,7 +659,8 @@ stokes.constitutive_model.Parameters.shear_viscosity_0 = visc_fn
 
 
 
-stokes.solve(zero_init_guess=False)
+with profiler.phase('von_mises_solve'):
+    stokes.solve(zero_init_guess=False)
 
 
 if uw.mpi.size ==1:
@@ -690,7 +707,8 @@ model_max_lithoP = (dim(uw.function.evaluate(nd_lithoP, mesh1.data, mesh1.N), u.
 np.isclose(max_lithoP, model_max_lithoP)
 # -
 
-stokes.solve(zero_init_guess=False, picard=0)
+with profiler.phase('depth_dependent_solve'):
+    stokes.solve(zero_init_guess=False, picard=0)
 
 if uw.mpi.size ==1:
     plotFig()
@@ -735,7 +753,36 @@ stokes.constitutive_model.Parameters.shear_viscosity_0 = visc_fn
 # stokes.saddle_preconditioner = 1 / stokes.constitutive_model.Parameters.viscosity
 
 
-stokes.solve(picard=0, zero_init_guess=False)
+with profiler.phase('drucker_prager_solve'):
+    stokes.solve(picard=0, zero_init_guess=False)
+# -
+
+# ### Compare with the golden values
+# The run is added to the regression database (see `benchmark_utils/regression.py`), with the strain rate and pressure of the Drucker-Prager solution and the time of each solve.
+
+# +
+max_strain_rate = uw.mpi.comm.allreduce(uw.function.evaluate(stokes.Unknowns.Einv2, mesh1.data, mesh1.N).max(), op=MPI.MAX)
+
+with mesh1.access():
+    max_pressure = uw.mpi.comm.allreduce(p_soln.data[:, 0].max(), op=MPI.MAX)
+
+petsc_log = log_view_summary('./output/SpiegelmanBenchmark/petsc_log_view.txt')
+
+check_results('Spiegelman',
+              metrics={'max_lithostatic_pressure': uw.mpi.comm.allreduce(model_max_lithoP, op=MPI.MAX),
+                       'max_strain_rate': dim(max_strain_rate, 1/u.second).m,
+                       'max_pressure': dim(max_pressure, u.pascal).m},
+              timings=profiler.timings, petsc_log=petsc_log, problem_size=problem_size, phi=phi)
+# -
+
+# +
+timing.stop()
+
+if uw.mpi.rank == 0:
+    print(profiler.table())
+    print(stage_table(petsc_log))
+
+timing.print_table(display_fraction=0.99)
 # -
 
 
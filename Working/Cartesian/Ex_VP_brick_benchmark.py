@@ -11,6 +11,14 @@ import numpy as np
 import sympy
 
 import os
+import sys
+
+sys.path.append('../../')
+from benchmark_utils.timeseries import TimeSeriesWriter
+from benchmark_utils.visualisation import mesh_to_pyvista
+from benchmark_utils.regression import check_results
+from benchmark_utils.profiling import PhaseProfiler
+from benchmark_utils.petsc_log import log_view_summary
 
 # %%
 ### plot figs
@@ -23,6 +31,9 @@ else:
 # %%
 outputPath = f'./output/brickBenchmark/'
 
+### append the mesh variables to one time-series file instead of a file set per step
+timeseries_output = True
+
 
 if uw.mpi.rank == 0:
     # checking if the directory demo_folder 
@@ -172,8 +183,7 @@ if uw.mpi.size == 1:
 
     # pv.start_xvfb()
 
-    mesh.vtk(outputPath + "stokes_brick_VP_mesh.vtk")
-    pvmesh = pv.read(outputPath + "stokes_brick_VP_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     # with mesh1.access():
         # usol = stokes.u.data.copy()
@@ -262,7 +272,7 @@ def plot_mat():
     pv.global_theme.smooth_shading = True
 
 
-    pvmesh = pv.read(outputPath + "stokes_brick_VP_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with swarm.access():
         points = np.zeros((swarm.data.shape[0],3))
@@ -314,7 +324,7 @@ def plot_field(field):
     pv.global_theme.smooth_shading = True
 
 
-    pvmesh = pv.read(outputPath + "stokes_brick_VP_mesh.vtk")
+    pvmesh = mesh_to_pyvista(mesh)
 
     with mesh.access(node_viscosity, strain_rate_inv2):
         pvmesh.point_data["edot"] = strain_rate_inv2.rbf_interpolate(mesh.data, nnn=1)
@@ -417,9 +427,22 @@ stokes.constitutive_model.Parameters.shear_viscosity_0 = viscosity_L_fn
 # stokes.saddle_preconditioner = 1.0 / viscosity_L_fn
 stokes.solve()
 
+# %%
+if timeseries_output:
+    timeseries = TimeSeriesWriter(outputPath, mesh, meshVars=[strain_rate_inv2, node_viscosity, p, v],
+                                  name='brick')
+
+def saveData(step):
+    if timeseries_output:
+        ### the friction angle case takes the place of time
+        timeseries.write(step, time=step)
+    else:
+        mesh.petsc_save_checkpoint(index=step, meshVars=[strain_rate_inv2, node_viscosity, p, v], outputPath=outputPath)
+
+
 # %%
 updateFields()
-mesh.petsc_save_checkpoint(index=0, meshVars=[strain_rate_inv2, node_viscosity, p, v], outputPath=outputPath)
+saveData(step=0)
 
 # %% [markdown]
 # #### Introduce NL viscosity
@@ -430,6 +453,9 @@ nd_lithoP = nd_density * nd_gravity * (ymax-mesh.X[1])
 
 step = 1
 
+### wall time of each phase of the friction angle loop, recorded with the results. Each phase is also a PETSc log stage
+profiler = PhaseProfiler(log_stages=True)
+
 for phi in [0, 5, 10, 15, 20, 25, 30]:
 
     ### initial linear solve
@@ -440,7 +466,8 @@ for phi in [0, 5, 10, 15, 20, 25, 30]:
     
     
     stokes.constitutive_model.Parameters.shear_viscosity_0 = viscosity_L_fn
-    stokes.solve(zero_init_guess=True)
+    with profiler.phase('linear_solve'):
+        stokes.solve(zero_init_guess=True)
 
     
 
@@ -473,11 +500,14 @@ for phi in [0, 5, 10, 15, 20, 25, 30]:
     
 
         
-    stokes.solve(zero_init_guess=False)
+    with profiler.phase('nonlinear_solve'):
+        stokes.solve(zero_init_guess=False)
 
 
-    updateFields()
-    mesh.petsc_save_checkpoint(index=step, meshVars=[strain_rate_inv2, node_viscosity, p, v], outputPath=outputPath)
+    with profiler.phase('projections'):
+        updateFields()
+    with profiler.phase('io'):
+        saveData(step=step)
 
 
     step += 1
@@ -524,6 +554,11 @@ shear_angle1 = np.rad2deg( np.arctan(dx1/dy) )
 print(f'shear angle 0: {shear_angle0} degrees')
 print(f'shear angle 1: {shear_angle1} degrees')
 
+# %%
+### regression database (see benchmark_utils/regression.py), shear angles of the last friction angle
+check_results('brick', metrics={'shear_angle0': shear_angle0, 'shear_angle1': shear_angle1},
+              timings=profiler.timings, petsc_log=log_view_summary(f'{outputPath}petsc_log_view.txt'), resx=int(resx), resy=int(resy), phi=phi)
+
 # %%
 import matplotlib.pyplot as plt
 plt.plot(x, SR_profile0, c='blue')
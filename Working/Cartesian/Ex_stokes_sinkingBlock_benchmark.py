@@ -18,6 +18,11 @@ from underworld3.systems import Stokes
 import numpy as np
 import sympy
 from mpi4py import MPI
+
+import sys
+sys.path.append('../../')
+from benchmark_utils.visualisation import swarm_to_pyvista
+
 options = PETSc.Options()
 
 
@@ -35,6 +40,9 @@ else:
 ## swarm gauss point count (particle distribution)
 swarmGPC = 3
 
+### particles drawn by plot_mat, above this a stratified subsample is plotted
+max_plot_points = 200000
+
 # %% [markdown]
 # #### Value to change:
 
@@ -217,22 +225,14 @@ def plot_mat():
     # mesh.vtk("tempMsh.vtk")
     # pvmesh = pv.read("tempMsh.vtk") 
 
-    with swarm.access():
-        points = np.zeros((swarm.data.shape[0],3))
-        points[:,0] = swarm.data[:,0]
-        points[:,1] = swarm.data[:,1]
-        points[:,2] = 0.0
-
-    point_cloud = pv.PolyData(points)
+    ### stratified subsample of the particles, cached on the swarm
+    point_cloud = swarm_to_pyvista(swarm, [material], max_points=max_plot_points)
     
     ### create point cloud for passive tracers
     with passiveSwarm.access():
         passiveCloud = pv.PolyData(np.vstack((passiveSwarm.data[:,0],passiveSwarm.data[:,1], np.zeros(len(passiveSwarm.data)))).T)
 
 
-    with swarm.access():
-        point_cloud.point_data["M"] = material.data.copy()
-        
 
 
 
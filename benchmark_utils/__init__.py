@@ -0,0 +1,12 @@
+"""
+Shared helpers for the UW3 benchmark scripts.
+
+The benchmarks live as jupytext notebooks under `Working/` and `WIP/` and
+are run from their own directory, so they pick this package up with
+
+    import sys
+    sys.path.append('../../')
+
+Each module is imported directly, e.g.
+`from benchmark_utils.checkpoint import AsyncCheckpointWriter`.
+"""
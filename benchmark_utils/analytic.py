@@ -0,0 +1,300 @@
+"""
+Analytic Stokes solutions (SolCx, SolKx, SolKz) in vectorised numpy.
+
+These are the classic free-slip box solutions (Zhong 1996) that underworld2
+exposes as `uw2.function.analytic`. They are evaluated here without
+underworld2, at any array of points, so the benchmarks can always compute
+error norms.
+
+All three have a single Fourier mode in one coordinate, call it t, and a
+viscosity that depends only on the other coordinate, s (piecewise constant
+for SolCx, exponential for SolKx and SolKz). Writing the stream function as
+phi(s) sin(k t) reduces the Stokes equations to a fourth-order ODE in s with
+constant coefficients on each viscosity layer,
+
+    phi'''' + 4B phi''' + (4B^2 - 2k^2) phi'' - 4B k^2 phi' + k^2 (k^2 + 4B^2) phi = R(s) / eta(s)
+
+for eta = A exp(2 B s). Each layer's solution is a particular solution plus
+a matrix exponential of the companion matrix; free-slip walls and continuity
+of velocity and traction between layers give one small linear system. The
+result is exact to round-off, like the closed forms in underworld2.
+
+The problem solved is
+
+    div(2 eta eps(u)) - grad(p) + f = 0,    div(u) = 0,    f = (0, rho)
+
+on the unit square with free-slip walls, i.e. the sign convention of
+`stokes.bodyforce = rho * g` with g = (0, 1) in the benchmark scripts.
+Coordinates are (x, z) with z up; `stress` returns the total stress
+(xx, zz, xz).
+"""
+
+import numpy as np
+
+
+def _cos_terms(c, a):
+    """c cos(a s) as a list of (coefficient, exponent) pairs."""
+    return [(0.5 * c, 1j * a), (0.5 * c, -1j * a)]
+
+
+def _sin_terms(c, a):
+    """c sin(a s) as a list of (coefficient, exponent) pairs."""
+    return [(-0.5j * c, 1j * a), (0.5j * c, -1j * a)]
+
+
+class _LayeredModeSolution:
+    """
+    Free-slip unit-square Stokes solution for a body force of the form
+
+        f_s = G(s) cos(k t),    f_t = F(s) sin(k t)
+
+    and a viscosity A_j exp(2 B_j s) on layers s_j <= s < s_{j+1}.
+
+    F, G   - lists of (c, mu) terms, sum of c exp(mu s)
+    layers - list of (s_end, A, B), ordered, the last ending at s = 1
+    s_axis - 0 if s is x (t is z), 1 if s is z (t is x)
+    """
+
+    def __init__(self, k, F, G, layers, s_axis):
+        self.k = k
+        self.F = list(F)
+        self.G = list(G)
+        self.s_axis = s_axis
+
+        self.bounds = np.array([0.0] + [s_end for s_end, _, _ in layers])
+        self.A = np.array([A for _, A, _ in layers], dtype=float)
+        self.B = np.array([B for _, _, B in layers], dtype=float)
+
+        ### R(s) = F' + k G
+        self.R = [(c * mu, mu) for c, mu in self.F] + [(k * c, mu) for c, mu in self.G]
+
+        self._solve()
+
+    def _companion(self, j):
+        k, B = self.k, self.B[j]
+        C = np.zeros((4, 4))
+        C[0, 1] = C[1, 2] = C[2, 3] = 1.0
+        C[3] = [-(k**2) * (k**2 + 4 * B**2), 4 * B * k**2, -(4 * B**2 - 2 * k**2), -4 * B]
+        return C
+
+    def _characteristic(self, lam, j):
+        k, B = self.k, self.B[j]
+        return lam**4 + 4 * B * lam**3 + (4 * B**2 - 2 * k**2) * lam**2 - 4 * B * k**2 * lam + k**2 * (k**2 + 4 * B**2)
+
+    def _particular(self, s, j):
+        """(phi, phi', phi'', phi''') of the particular solution on layer j, shape (n, 4)."""
+        s = np.asarray(s, dtype=float)
+        Y = np.zeros(s.shape + (4,), dtype=complex)
+
+        for c, mu in self.R:
+            lam = mu - 2 * self.B[j]
+            p = self._characteristic(lam, j)
+            if abs(p) < 1.0e-12 * max(1.0, abs(lam) ** 4):
+                raise ValueError("Forcing is resonant with the homogeneous solution")
+            a = c / (self.A[j] * p) * np.exp(lam * s)
+            for m in range(4):
+                Y[..., m] += a * lam**m
+
+        return Y
+
+    def _propagator(self, j, ds):
+        """exp(C_j ds) for an array of offsets, shape (n, 4, 4)."""
+        from scipy.linalg import expm
+
+        ds = np.atleast_1d(ds)
+        return expm(self._companion(j)[None, :, :] * ds[:, None, None])
+
+    def _eta(self, s, j):
+        return self.A[j] * np.exp(2 * self.B[j] * s)
+
+    def _traction_rows(self, s, j):
+        """Rows giving phi, phi', eta (phi'' + k^2 phi) and the normal traction term from Y."""
+        k, B = self.k, self.B[j]
+        eta = self._eta(s, j)
+        return np.array(
+            [
+                [1.0, 0.0, 0.0, 0.0],
+                [0.0, 1.0, 0.0, 0.0],
+                [eta * k**2, 0.0, eta, 0.0],
+                [2 * B * eta * k**2, -3 * k**2 * eta, 2 * B * eta, eta],
+            ]
+        )
+
+    def _solve(self):
+        """Homogeneous state (phi..phi''') at the start of each layer."""
+        n = self.A.shape[0]
+        M = np.zeros((4 * n, 4 * n), dtype=complex)
+        rhs = np.zeros(4 * n, dtype=complex)
+
+        free_slip = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]])
+
+        ### phi = phi'' = 0 on s = 0
+        M[0:2, 0:4] = free_slip
+        rhs[0:2] = -free_slip @ self._particular(0.0, 0)
+
+        row = 2
+        for j in range(n):
+            s_end = self.bounds[j + 1]
+            E = self._propagator(j, s_end - self.bounds[j])[0]
+            Yp = self._particular(s_end, j)
+
+            if j == n - 1:
+                ### phi = phi'' = 0 on s = 1
+                M[row : row + 2, 4 * j : 4 * j + 4] = free_slip @ E
+                rhs[row : row + 2] = -free_slip @ Yp
+                row += 2
+                continue
+
+            ### velocity and traction continuous across the layer boundary
+            left = self._traction_rows(s_end, j)
+            right = self._traction_rows(s_end, j + 1)
+
+            M[row : row + 4, 4 * j : 4 * j + 4] = left @ E
+            M[row : row + 4, 4 * (j + 1) : 4 * (j + 1) + 4] = -right
+            rhs[row : row + 4] = right @ self._particular(s_end, j + 1) - left @ Yp
+            row += 4
+
+        self.H = np.linalg.solve(M, rhs).reshape(n, 4)
+
+    def _state(self, s):
+        """phi and its first three derivatives, eta and eta' at s."""
+        layer = np.clip(np.searchsorted(self.bounds, s, side="right") - 1, 0, self.A.shape[0] - 1)
+
+        Y = np.zeros(s.shape + (4,))
+        eta = np.zeros(s.shape)
+        deta = np.zeros(s.shape)
+
+        for j in np.unique(layer):
+            inside = layer == j
+            sj = s[inside]
+            Yj = np.einsum("nab,b->na", self._propagator(j, sj - self.bounds[j]), self.H[j]) + self._particular(sj, j)
+            Y[inside] = Yj.real
+            eta[inside] = self._eta(sj, j)
+            deta[inside] = 2 * self.B[j] * eta[inside]
+
+        return Y, eta, deta
+
+    @staticmethod
+    def _sum(terms, s):
+        return sum(c * np.exp(mu * s) for c, mu in terms).real if terms else np.zeros_like(s)
+
+    def _fields(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        s = coords[:, self.s_axis]
+        t = coords[:, 1 - self.s_axis]
+        k = self.k
+
+        Y, eta, deta = self._state(s)
+        phi, dphi, d2phi, d3phi = Y.T
+
+        sin, cos = np.sin(k * t), np.cos(k * t)
+        w = d2phi + k**2 * phi
+
+        u_s = k * phi * cos
+        u_t = -dphi * sin
+
+        pressure = (deta * w + eta * (d3phi + k**2 * dphi) - 2 * k**2 * eta * dphi - self._sum(self.F, s)) / k * cos
+
+        tau_ss = 2 * eta * k * dphi * cos
+        tau_st = -eta * w * sin
+
+        if self.s_axis == 0:
+            velocity = np.stack([u_s, u_t], axis=1)
+            tau = np.stack([tau_ss, -tau_ss, tau_st], axis=1)
+        else:
+            velocity = np.stack([u_t, u_s], axis=1)
+            tau = np.stack([-tau_ss, tau_ss, tau_st], axis=1)
+
+        return velocity, pressure, tau, eta
+
+    def velocity(self, coords):
+        """Velocity (u_x, u_z) at `coords` (n, 2)."""
+        return self._fields(coords)[0]
+
+    def pressure(self, coords):
+        return self._fields(coords)[1]
+
+    def deviatoric_stress(self, coords):
+        """2 eta eps(u) as (xx, zz, xz)."""
+        return self._fields(coords)[2]
+
+    def stress(self, coords):
+        """Total stress 2 eta eps(u) - p I as (xx, zz, xz)."""
+        _, pressure, tau, _ = self._fields(coords)
+        sigma = tau.copy()
+        sigma[:, 0:2] -= pressure[:, None]
+        return sigma
+
+    def strain_rate(self, coords):
+        """eps(u) as (xx, zz, xz)."""
+        _, _, tau, eta = self._fields(coords)
+        return tau / (2 * eta[:, None])
+
+    def viscosity(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        return self._state(coords[:, self.s_axis])[1]
+
+
+class SolCx(_LayeredModeSolution):
+    """
+    Viscosity eta_A for x < x_c and eta_B for x > x_c,
+    density rho = sin(n_z pi z) cos(pi x).
+    """
+
+    def __init__(self, eta_A=1.0, eta_B=1.0e6, x_c=0.5, n_z=1):
+        self.eta_A, self.eta_B, self.x_c, self.n_z = eta_A, eta_B, x_c, n_z
+
+        super().__init__(
+            k=n_z * np.pi,
+            F=_cos_terms(1.0, np.pi),
+            G=[],
+            layers=[(x_c, eta_A, 0.0), (1.0, eta_B, 0.0)],
+            s_axis=0,
+        )
+
+    def density(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        return np.sin(self.n_z * np.pi * coords[:, 1]) * np.cos(np.pi * coords[:, 0])
+
+
+class SolKx(_LayeredModeSolution):
+    """
+    Viscosity exp(2 B x), density rho = -sigma sin(m pi z) cos(n pi x).
+    """
+
+    def __init__(self, sigma=1.0, m=1, n=1, B=1.1):
+        self.sigma, self.m, self.n, self.B_x = sigma, m, n, B
+
+        super().__init__(
+            k=m * np.pi,
+            F=_cos_terms(-sigma, n * np.pi),
+            G=[],
+            layers=[(1.0, 1.0, B)],
+            s_axis=0,
+        )
+
+    def density(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        return -self.sigma * np.sin(self.m * np.pi * coords[:, 1]) * np.cos(self.n * np.pi * coords[:, 0])
+
+
+class SolKz(_LayeredModeSolution):
+    """
+    Viscosity exp(2 B z), density rho = -sigma sin(m pi z) cos(n pi x).
+    """
+
+    def __init__(self, sigma=1.0, m=1, n=1, B=1.5):
+        self.sigma, self.m, self.n, self.B_z = sigma, m, n, B
+
+        ### s is z here: the force (0, rho) is along s with the cos(n pi x) mode
+        super().__init__(
+            k=n * np.pi,
+            F=[],
+            G=_sin_terms(-sigma, m * np.pi),
+            layers=[(1.0, 1.0, B)],
+            s_axis=1,
+        )
+
+    def density(self, coords):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        return -self.sigma * np.sin(self.m * np.pi * coords[:, 1]) * np.cos(self.n * np.pi * coords[:, 0])
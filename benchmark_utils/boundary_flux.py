@@ -0,0 +1,227 @@
+"""
+Boundary heat flux and normal stress recovered from the weak-form residual.
+
+The convection scripts used to get the surface heat flux from a smoothed
+projection of dT/dz evaluated just inside the boundary, and the dynamic
+topography from a projection of sigma_zz, each an extra global solve whose
+accuracy depends on the smoothing and the resolution. The flux through a
+boundary is already determined by the discrete equations: for a test
+function W that is non-zero on the boundary,
+
+    int_Gamma (k grad T . n) W dS = int_Omega k grad T . grad W + (dT/dt + u . grad T - f) W dV
+    int_Gamma (sigma n) . (W e) dS = int_Omega sigma : grad (W e) - b . (W e) dV
+
+(the consistent boundary flux). The volume integrals converge at the rate
+of the solution, not of its gradient, and need no extra solve.
+`BoundaryFluxRecovery` takes W = w(x) phi_j(s), where w ramps from 1 on the
+boundary to 0 on the opposite one (so the flux through the other Dirichlet
+boundaries drops out) and phi_j are cosine modes along a box side or
+Fourier modes around an annulus, and returns the flux as a series in those
+modes that can be evaluated anywhere on the boundary:
+
+    top = BoundaryFluxRecovery.box(meshbox, "Top", n_modes=32, degree=3)
+
+    q = top.heat_flux(t_soln, diffusivity=k, velocity=v_soln.sym)
+    Nu = -q.mean / bottom_temperature
+    q1 = -q(np.array([[0.0, boxHeight]]))[0]
+
+    sigma = top.normal_stress(stokes.stress, stokes.bodyforce)
+    topography = -(sigma(coords) - sigma.mean) / (rho * g)
+
+W is a MeshVariable (degree should match the temperature or velocity), so
+the integral is compiled once and each mode only costs an assembly; pass
+`n_modes=1` when only the mean is needed. The boundaries between the two
+ramp ends must be natural for the tested component (insulating side walls,
+free slip). During a transient the time derivative belongs in the residual
+(`dTdt`), at steady state it vanishes.
+"""
+
+import math
+
+import numpy as np
+import sympy
+from mpi4py import MPI
+
+import underworld3 as uw
+
+### boundary label: (normal axis, outward direction)
+BOX_BOUNDARIES = {"Left": (0, -1), "Right": (0, 1), "Bottom": (1, -1), "Top": (1, 1)}
+ANNULUS_BOUNDARIES = {"Lower": -1, "Upper": 1}
+
+
+class BoundaryProfile:
+    """A boundary flux as a series sum_k c_k phi_k along the boundary."""
+
+    def __init__(self, coefficients, modes, length):
+        self.coefficients = np.asarray(coefficients)
+        self.modes = modes[: self.coefficients.shape[0]]
+        self.length = length
+
+    @property
+    def mean(self):
+        """Average of the flux over the boundary."""
+        return self.coefficients[0]
+
+    @property
+    def total(self):
+        """Integral of the flux over the boundary."""
+        return self.coefficients[0] * self.length
+
+    def __call__(self, coords):
+        """The flux at points (n, dim) on the boundary."""
+        coords = np.atleast_2d(coords)
+        return sum(c * phi(coords) for c, phi in zip(self.coefficients, self.modes))
+
+
+class BoundaryFluxRecovery:
+    """
+    Heat flux and normal stress through one boundary of `mesh`, by the
+    consistent boundary flux.
+
+    weight - numpy function of the (n, dim) coordinates, 1 on the boundary
+             and 0 on the opposite one
+    modes  - numpy functions phi_k of the coordinates along the boundary,
+             orthogonal on it, with gram[k] = int phi_k^2 dS
+    normal - outward unit normal, sympy vector in mesh.X
+    length - measure of the boundary
+
+    `box` and `annulus` set these up from a boundary label.
+    """
+
+    _count = 0
+
+    def __init__(self, mesh, weight, modes, gram, normal, length, degree=2):
+        self.mesh = mesh
+        self.modes = list(modes)
+        self.gram = np.asarray(gram, dtype=float)
+        self.normal = sympy.Matrix(normal)
+        self.length = length
+
+        BoundaryFluxRecovery._count += 1
+        self.W = uw.discretisation.MeshVariable(f"W_flux{BoundaryFluxRecovery._count}", mesh, 1, degree=degree)
+        self._coords = np.array(self.W.coords)
+        self._weight = weight(self._coords)
+
+    @classmethod
+    def box(cls, mesh, boundary, n_modes=32, degree=2):
+        """Recovery on side `boundary` ("Left", "Right", "Bottom", "Top") of a 2D box mesh."""
+        if boundary not in BOX_BOUNDARIES:
+            raise ValueError(f"Unknown box boundary {boundary}, expected one of {', '.join(BOX_BOUNDARIES)}")
+        axis, direction = BOX_BOUNDARIES[boundary]
+        along = 1 - axis
+
+        with mesh.access():
+            local_min = mesh.data.min(axis=0)
+            local_max = mesh.data.max(axis=0)
+        lower = [uw.mpi.comm.allreduce(value, op=MPI.MIN) for value in local_min]
+        upper = [uw.mpi.comm.allreduce(value, op=MPI.MAX) for value in local_max]
+
+        height = upper[axis] - lower[axis]
+        length = upper[along] - lower[along]
+        if direction > 0:
+            weight = lambda coords: (coords[:, axis] - lower[axis]) / height
+        else:
+            weight = lambda coords: (upper[axis] - coords[:, axis]) / height
+
+        modes = [
+            (lambda coords, k=k: np.cos(k * math.pi * (coords[:, along] - lower[along]) / length))
+            for k in range(n_modes)
+        ]
+        gram = [length] + [length / 2] * (n_modes - 1)
+
+        normal = [0] * mesh.dim
+        normal[axis] = direction
+
+        return cls(mesh, weight, modes, gram, normal, length, degree)
+
+    @classmethod
+    def annulus(cls, mesh, boundary, n_modes=32, degree=2):
+        """Recovery on the "Upper" or "Lower" boundary of an annulus mesh (Fourier modes in the angle)."""
+        if boundary not in ANNULUS_BOUNDARIES:
+            raise ValueError(f"Unknown annulus boundary {boundary}, expected one of {', '.join(ANNULUS_BOUNDARIES)}")
+        direction = ANNULUS_BOUNDARIES[boundary]
+
+        with mesh.access():
+            radius = np.hypot(mesh.data[:, 0], mesh.data[:, 1])
+        r_inner = uw.mpi.comm.allreduce(radius.min(), op=MPI.MIN)
+        r_outer = uw.mpi.comm.allreduce(radius.max(), op=MPI.MAX)
+
+        if direction > 0:
+            weight = lambda coords: (np.hypot(coords[:, 0], coords[:, 1]) - r_inner) / (r_outer - r_inner)
+            r_boundary = r_outer
+        else:
+            weight = lambda coords: (r_outer - np.hypot(coords[:, 0], coords[:, 1])) / (r_outer - r_inner)
+            r_boundary = r_inner
+
+        theta = lambda coords: np.arctan2(coords[:, 1], coords[:, 0])
+        modes = [lambda coords: np.ones(coords.shape[0])]
+        for k in range(1, n_modes):
+            modes.append(lambda coords, k=k: np.cos(k * theta(coords)))
+            modes.append(lambda coords, k=k: np.sin(k * theta(coords)))
+        modes = modes[:n_modes]
+        gram = [2 * math.pi * r_boundary] + [math.pi * r_boundary] * (n_modes - 1)
+
+        x, y = mesh.X[0], mesh.X[1]
+        r = sympy.sqrt(x**2 + y**2)
+        normal = [direction * x / r, direction * y / r]
+
+        return cls(mesh, weight, modes, gram, normal, 2 * math.pi * r_boundary, degree)
+
+    def _residuals(self, integrand, n_modes=None):
+        """int_Omega integrand dV with W set to w phi_k, for each mode k. Collective."""
+        n_modes = len(self.modes) if n_modes is None else min(n_modes, len(self.modes))
+        calculator = uw.maths.Integral(self.mesh, integrand)
+
+        residuals = np.zeros(n_modes)
+        for k in range(n_modes):
+            with self.mesh.access(self.W):
+                self.W.data[:, 0] = self._weight * self.modes[k](self._coords)
+            residuals[k] = calculator.evaluate()
+
+        return residuals
+
+    def _profile(self, residuals):
+        return BoundaryProfile(residuals / self.gram[: residuals.shape[0]], self.modes, self.length)
+
+    def _gradient(self, fn):
+        return [fn.diff(xi) for xi in self.mesh.X]
+
+    def heat_flux(self, T, diffusivity=1, velocity=None, source=0, dTdt=0, n_modes=None):
+        """
+        Outward diffusive flux k grad T . n of the solution `T` (MeshVariable)
+        of dT/dt + u . grad T = div (k grad T) + f, as a BoundaryProfile.
+        """
+        diffusivity, source, dTdt = (_scalar(value) for value in (diffusivity, source, dTdt))
+
+        W = self.W.sym[0]
+        grad_T = self._gradient(T.sym[0])
+        grad_W = self._gradient(W)
+
+        integrand = diffusivity * sum(a * b for a, b in zip(grad_T, grad_W)) + (dTdt - source) * W
+        if velocity is not None:
+            integrand += sum(velocity[i] * grad_T[i] for i in range(self.mesh.dim)) * W
+
+        return self._profile(self._residuals(integrand, n_modes))
+
+    def normal_stress(self, stress, bodyforce=None, n_modes=None):
+        """
+        Normal traction (sigma n) . n on the boundary, for the full stress
+        `stress` (e.g. stokes.stress, pressure included) in equilibrium with
+        `bodyforce`, as a BoundaryProfile.
+        """
+        test = self.normal * self.W.sym[0]
+        integrand = sum(
+            stress[i, j] * test[i].diff(self.mesh.X[j]) for i in range(self.mesh.dim) for j in range(self.mesh.dim)
+        )
+        if bodyforce is not None:
+            integrand -= sum(bodyforce[i] * test[i] for i in range(self.mesh.dim))
+
+        return self._profile(self._residuals(integrand, n_modes))
+
+
+def _scalar(value):
+    """A scalar sympy expression, also from the 1x1 matrices the solvers hold (e.g. adv_diff.f)."""
+    value = sympy.sympify(value)
+    if isinstance(value, sympy.MatrixBase):
+        value = value[0]
+    return value
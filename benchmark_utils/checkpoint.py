@@ -0,0 +1,184 @@
+"""
+Asynchronous checkpointing for the benchmark time loops.
+
+`mesh.petsc_save_checkpoint` and `swarm.petsc_save_checkpoint` are collective
+and block the time loop while the HDF5/XDMF files are written. The writer
+below copies the variable arrays into staging buffers on the calling thread
+(a memory copy) and hands them to a background thread which writes them to
+disk while the next solve proceeds.
+
+Each rank writes its own file, so nothing collective happens off the main
+thread and MPI does not need to be initialised with thread support. The
+local vertices and cells are saved with the variables so a checkpoint can
+be rendered without underworld (see `benchmark_utils.rendering`).
+
+These files are not the PETSc HDF5/XDMF checkpoints of the synchronous
+path: ParaView cannot open them directly and `mesh.read_timestep` cannot
+restore from them. Render them with `benchmark_utils.rendering`, restore
+with `benchmark_utils.restart`, or call `petsc_save_checkpoint` alongside
+when the XDMF output is needed.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+
+import numpy as np
+import h5py
+
+import underworld3 as uw
+
+from .topology import local_cells, local_vertices, vtk_cell_type
+
+
+def checkpoint_filename(outputPath, prefix, step, rank):
+    return os.path.join(outputPath, f"{prefix}_{step:05d}.{rank:04d}.h5")
+
+
+def file_checksum(filename, blocksize=1 << 20):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class AsyncCheckpointWriter:
+    """
+    Write mesh and swarm variables in a background thread.
+
+    mesh     - mesh the variables live on
+    meshVars - list of MeshVariables to save
+    swarms   - dict of {name: (swarm, [SwarmVariables])}
+    prefix   - file prefix, files are `{prefix}_{step:05d}.{rank:04d}.h5`
+    max_pending - number of snapshots allowed in flight before `save` blocks,
+                  which bounds the memory used by the staging buffers
+
+    Call `flush()` to wait for all pending writes (collective) and `close()`
+    at the end of the run. A failed write is raised by the next `flush` (or
+    `close`), on every rank.
+
+    `completed` maps each step written by this rank to (time, filename,
+    checksum); `benchmark_utils.restart.RestartManager` uses it to record
+    only checkpoints that are complete on every rank.
+    """
+
+    def __init__(self, outputPath, mesh, meshVars, swarms=None, prefix="checkpoint", max_pending=2):
+        self.outputPath = outputPath
+        self.mesh = mesh
+        self.meshVars = list(meshVars)
+        self.swarms = dict(swarms) if swarms is not None else {}
+        self.prefix = prefix
+
+        self.completed = {}
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._worker, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, step, time, arrays=None):
+        """
+        Snapshot the variables and queue them for writing.
+
+        arrays - optional dict of small numpy arrays (e.g. time series of a
+                 diagnostic) saved alongside, only written by rank 0
+        """
+        snapshot = self._snapshot()
+
+        if arrays is not None and uw.mpi.rank == 0:
+            snapshot["arrays"] = {name: np.array(value, copy=True) for name, value in arrays.items()}
+
+        self._queue.put((step, time, snapshot))
+
+    def flush(self):
+        """Wait for all queued writes on every rank to complete. Collective; raises on every rank if any write failed."""
+        from mpi4py import MPI
+
+        self._queue.join()
+
+        ### agree on failure first, so no rank is left waiting for one that raised
+        failed = uw.mpi.comm.allreduce(int(self._error is not None), op=MPI.MAX)
+        if failed:
+            self._check_error()
+            raise RuntimeError("Asynchronous checkpoint write failed on another rank")
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _snapshot(self):
+        snapshot = {
+            "mesh": {},
+            "swarms": {},
+            "geometry": local_vertices(self.mesh),
+            "cells": local_cells(self.mesh),
+        }
+
+        with self.mesh.access():
+            for var in self.meshVars:
+                snapshot["mesh"][var.clean_name] = {
+                    "coords": np.array(var.coords, copy=True),
+                    "data": np.array(var.data, copy=True),
+                }
+
+        for name, (swarm, swarmVars) in self.swarms.items():
+            with swarm.access():
+                fields = {"coords": np.array(swarm.data, copy=True)}
+                for var in swarmVars:
+                    fields[var.clean_name] = np.array(var.data, copy=True)
+            snapshot["swarms"][name] = fields
+
+        return snapshot
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(*job)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, step, time, snapshot):
+        filename = checkpoint_filename(self.outputPath, self.prefix, step, uw.mpi.rank)
+        tmp_filename = filename + ".tmp"
+
+        with h5py.File(tmp_filename, "w") as h5:
+            h5.attrs["step"] = step
+            h5.attrs["time"] = time
+            h5.attrs["nprocs"] = uw.mpi.size
+            h5.attrs["rank"] = uw.mpi.rank
+            h5.attrs["vtk_cell_type"] = vtk_cell_type(self.mesh)
+
+            h5.create_dataset("geometry/vertices", data=snapshot["geometry"])
+            h5.create_dataset("topology/cells", data=snapshot["cells"])
+
+            for name, fields in snapshot["mesh"].items():
+                group = h5.create_group(f"mesh/{name}")
+                for key, value in fields.items():
+                    group.create_dataset(key, data=value)
+
+            for name, fields in snapshot["swarms"].items():
+                group = h5.create_group(f"swarms/{name}")
+                for key, value in fields.items():
+                    group.create_dataset(key, data=value)
+
+            for name, value in snapshot.get("arrays", {}).items():
+                h5.create_dataset(f"arrays/{name}", data=value)
+
+        ### only a complete file ever carries the final name
+        os.replace(tmp_filename, filename)
+
+        self.completed[step] = (time, filename, file_checksum(filename))
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Asynchronous checkpoint write failed") from error
@@ -0,0 +1,295 @@
+"""
+Mesh-convergence studies for the benchmarks with an analytic answer.
+
+Each benchmark script reads its resolution (and discretisation options) from
+the PETSc options, e.g. `-res 32 -vdegree 2`, and at the end calls
+`record_run` which appends one JSON line per run (resolution, mesh size,
+degrees of freedom, solve time and error norms) to a results file. The
+driver below runs a script over a resolution ladder and reports observed
+convergence orders and the cost of each accuracy level:
+
+    cd Working/Cartesian
+    python -m benchmark_utils.convergence Ex_Stokes_Cartesian_SolCx.py --res 16 32 64 128
+    python -m benchmark_utils.convergence Ex_Stokes_Cartesian_SolCx.py --res 16 32 64 --options "-vdegree 3"
+    python -m benchmark_utils.convergence --report convergence.jsonl --target L2_U=1e-6
+
+(with the repository root on PYTHONPATH). Runs with different options are
+kept as separate series in the same file, so element degree and quadrature
+choices can be compared by error against wall time and DOFs.
+
+`error_norms` computes L2 and H1-seminorm errors by quadrature with
+`uw.maths.Integral`. An exact solution given as a numpy function (e.g.
+`benchmark_utils.analytic.SolCx.velocity`) is first interpolated onto a
+mesh variable two degrees higher than the numerical one.
+"""
+
+import argparse
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def _exact_variable(mesh, var, exact, degree):
+    """MeshVariable holding the numpy function `exact` interpolated at its nodes."""
+    import underworld3 as uw
+
+    cache = getattr(mesh, "_benchmark_exact_vars", None)
+    if cache is None:
+        cache = {}
+        mesh._benchmark_exact_vars = cache
+
+    key = (var.clean_name, degree)
+
+    if key not in cache:
+        cache[key] = uw.discretisation.MeshVariable(f"{var.clean_name}_exact", mesh, var.num_components, degree=degree)
+
+    exact_var = cache[key]
+    with mesh.access(exact_var):
+        exact_var.data[...] = np.asarray(exact(exact_var.coords)).reshape(exact_var.data.shape)
+
+    return exact_var
+
+
+def error_norms(mesh, var, exact, remove_mean=False, degree=None):
+    """
+    Absolute and relative L2 and H1-seminorm errors of MeshVariable `var`.
+
+    exact       - sympy expression in the mesh coordinates (scalar, or a row
+                  matrix like `var.sym`), or a numpy function of an (n, dim)
+                  coordinate array
+    remove_mean - compare after removing the mean (pressure with only
+                  Dirichlet velocity conditions is defined up to a constant)
+    degree      - degree of the interpolated exact solution (numpy case),
+                  default var.degree + 2
+
+    Returns a dict with L2, H1 (seminorm), L2_rel and H1_rel.
+    """
+    import sympy
+    import underworld3 as uw
+
+    X = mesh.CoordinateSystem.X
+
+    if callable(exact):
+        exact = _exact_variable(mesh, var, exact, degree or var.degree + 2).sym
+    exact = sympy.Matrix([exact]) if not isinstance(exact, sympy.MatrixBase) else exact
+    exact = exact.reshape(1, var.num_components)
+
+    error = var.sym - exact
+
+    if remove_mean:
+        area = uw.maths.Integral(mesh, 1.0).evaluate()
+        error_mean = [uw.maths.Integral(mesh, e).evaluate() / area for e in error]
+        exact_mean = [uw.maths.Integral(mesh, e).evaluate() / area for e in exact]
+        error = error - sympy.Matrix([error_mean])
+        exact = exact - sympy.Matrix([exact_mean])
+
+    def l2(f):
+        return math.sqrt(max(uw.maths.Integral(mesh, sum(c**2 for c in f)).evaluate(), 0.0))
+
+    def h1(f):
+        return math.sqrt(max(uw.maths.Integral(mesh, sum(g**2 for g in f.jacobian(X))).evaluate(), 0.0))
+
+    norms = {"L2": l2(error), "H1": h1(error)}
+    exact_l2, exact_h1 = l2(exact), h1(exact)
+    norms["L2_rel"] = norms["L2"] / exact_l2 if exact_l2 > 0 else float("nan")
+    norms["H1_rel"] = norms["H1"] / exact_h1 if exact_h1 > 0 else float("nan")
+
+    return norms
+
+
+def global_dofs(solver):
+    """Global number of unknowns of a solver."""
+    return solver.snes.getSolution().getSize()
+
+
+def record_run(benchmark, resolution, h, dofs, wall_time, errors, filename=None, **parameters):
+    """
+    Append one run to the results file (rank 0 only).
+
+    errors     - {name: value}, e.g. {"L2_U": ..., "H1_U": ..., "L2_P": ...}
+    parameters - the discretisation choices of this run (degrees, qdegree,
+                 ...); runs with the same benchmark and parameters form one
+                 convergence series
+
+    The file is taken from the `-convergence_file` option if not given and
+    nothing is written if neither is set, so the scripts behave as before
+    when run on their own.
+    """
+    import underworld3 as uw
+
+    if filename is None:
+        filename = uw.options.getString("convergence_file", default="")
+    if not filename or uw.mpi.rank != 0:
+        return
+
+    run = {
+        "benchmark": benchmark,
+        "parameters": parameters,
+        "resolution": resolution,
+        "h": float(h),
+        "dofs": int(dofs),
+        "wall_time": float(wall_time),
+        "nprocs": uw.mpi.size,
+        "errors": {name: float(value) for name, value in errors.items()},
+    }
+
+    with open(filename, "a") as f:
+        f.write(json.dumps(run) + "\n")
+
+
+class ConvergenceStudy:
+    """Results of `record_run`, grouped into series of the same benchmark and parameters."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename) as f:
+            self.runs = [json.loads(line) for line in f if line.strip()]
+
+    def series(self):
+        """{(benchmark, parameters as json): [runs, coarse to fine]}"""
+        groups = {}
+        for run in self.runs:
+            key = (run["benchmark"], json.dumps(run["parameters"], sort_keys=True))
+            groups.setdefault(key, {})[run["resolution"]] = run
+
+        return {key: sorted(runs.values(), key=lambda run: -run["h"]) for key, runs in groups.items()}
+
+    @staticmethod
+    def rates(runs, norm):
+        """Observed order between successive runs, log(e0/e1) / log(h0/h1)."""
+        rates = [float("nan")]
+        for coarse, fine in zip(runs[:-1], runs[1:]):
+            e0, e1 = coarse["errors"].get(norm), fine["errors"].get(norm)
+            if e0 and e1 and e0 > 0 and e1 > 0 and coarse["h"] != fine["h"]:
+                rates.append(math.log(e0 / e1) / math.log(coarse["h"] / fine["h"]))
+            else:
+                rates.append(float("nan"))
+
+        return rates
+
+    def table(self):
+        """Text table of every series: errors, orders, DOFs and wall time."""
+        lines = []
+        for (benchmark, parameters), runs in self.series().items():
+            norms = sorted({norm for run in runs for norm in run["errors"]})
+            rates = {norm: self.rates(runs, norm) for norm in norms}
+
+            lines.append(f"{benchmark} {parameters}")
+            header = f"{'res':>6} {'h':>10} {'dofs':>10} {'time [s]':>10}"
+            for norm in norms:
+                header += f" {norm:>12} {'order':>6}"
+            lines.append(header)
+
+            for i, run in enumerate(runs):
+                line = f"{run['resolution']:>6} {run['h']:>10.3e} {run['dofs']:>10d} {run['wall_time']:>10.3f}"
+                for norm in norms:
+                    line += f" {run['errors'].get(norm, float('nan')):>12.4e} {rates[norm][i]:>6.2f}"
+                lines.append(line)
+
+            lines.append("")
+
+        return "\n".join(lines)
+
+    def cheapest(self, benchmark, norm, target, parameters=None):
+        """
+        The run of `benchmark` (and, if given, `parameters`) with the
+        smallest wall time whose `norm` error meets `target`, or None.
+        """
+        runs = [run for run in self.runs if run["benchmark"] == benchmark]
+        if parameters is not None:
+            key = json.dumps(parameters, sort_keys=True)
+            runs = [run for run in runs if json.dumps(run["parameters"], sort_keys=True) == key]
+        meeting = [run for run in runs if run["errors"].get(norm, float("inf")) <= target]
+
+        return min(meeting, key=lambda run: run["wall_time"]) if meeting else None
+
+    def plot(self, norm, filename):
+        """Error against wall time and against DOFs for every series (log-log)."""
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        fig, (ax_time, ax_dofs) = plt.subplots(1, 2, figsize=(12, 5))
+
+        for (benchmark, parameters), runs in self.series().items():
+            runs = [run for run in runs if norm in run["errors"]]
+            if not runs:
+                continue
+            label = f"{benchmark} {parameters}"
+            errors = [run["errors"][norm] for run in runs]
+            ax_time.loglog([run["wall_time"] for run in runs], errors, "o-", label=label)
+            ax_dofs.loglog([run["dofs"] for run in runs], errors, "o-", label=label)
+
+        ax_time.set_xlabel("wall time [s]")
+        ax_dofs.set_xlabel("DOFs")
+        for ax in (ax_time, ax_dofs):
+            ax.set_ylabel(norm)
+            ax.grid(True, which="both", alpha=0.3)
+        ax_time.legend(fontsize=7)
+
+        fig.savefig(filename, dpi=150, bbox_inches="tight")
+        plt.close(fig)
+
+
+def run_ladder(script, resolutions, filename="convergence.jsonl", options="", nprocs=1, mpiexec="mpiexec"):
+    """Run `script` once per resolution, each appending its errors to `filename`."""
+    filename = os.path.abspath(filename)
+
+    for res in resolutions:
+        command = [sys.executable, script, "-res", str(res), "-convergence_file", filename] + shlex.split(options)
+        if nprocs > 1:
+            command = [mpiexec, "-n", str(nprocs)] + command
+
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        print(f"res = {res}: {time.perf_counter() - start:.1f} s", flush=True)
+
+    return ConvergenceStudy(filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a benchmark over a resolution ladder and report convergence.")
+    parser.add_argument("script", nargs="?", help="benchmark script (run from its own directory)")
+    parser.add_argument("--res", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--options", default="", help="extra PETSc options passed to every run")
+    parser.add_argument("--np", type=int, default=1, dest="nprocs")
+    parser.add_argument("--file", default="convergence.jsonl")
+    parser.add_argument("--report", default=None, help="only report on an existing results file")
+    parser.add_argument("--target", action="append", default=[], help="NORM=VALUE, report the cheapest run meeting it")
+    parser.add_argument("--plot", default=None, help="NORM, plot error against time and DOFs to convergence_NORM.png")
+    args = parser.parse_args(argv)
+
+    if args.report is not None:
+        study = ConvergenceStudy(args.report)
+    elif args.script is not None:
+        study = run_ladder(args.script, args.res, args.file, args.options, args.nprocs)
+    else:
+        parser.error("give a script to run or --report FILE")
+
+    print(study.table())
+
+    ### norms of the same name are only compared within a benchmark
+    benchmarks = sorted({benchmark for benchmark, _ in study.series()})
+    for target in args.target:
+        norm, value = target.split("=")
+        for benchmark in benchmarks:
+            run = study.cheapest(benchmark, norm, float(value))
+            if run is None:
+                print(f"{benchmark}: no run reaches {norm} <= {value}")
+            else:
+                print(f"{benchmark}: cheapest run with {norm} <= {value}: {run['parameters']} "
+                      f"res = {run['resolution']}, {run['wall_time']:.3f} s, {run['dofs']} dofs")
+
+    if args.plot is not None:
+        study.plot(args.plot, f"convergence_{args.plot}.png")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Free slip on curved boundaries for the Stokes solver.
+
+The annulus scripts imposed free slip on "Upper" with a body force
+ptf (v . r) r f(r), ptf = 1e6, where f is a Gaussian of the distance to
+the surface. The penalty acts on a band of elements rather than on the
+boundary, uses the exact radial direction instead of the facet normals of
+the polygonal boundary, and its size has nothing to do with the viscosity
+or the mesh, so the operator is badly conditioned and the Krylov
+iterations climb. `add_free_slip_bc` puts the constraint on the boundary
+itself, as natural (surface) terms on the facet normals n (`mesh.Gamma`),
+
+    int_Gamma [gamma (v . n) - n . sigma . n] (w . n) dS,    gamma = penalty * viscosity / h
+
+the non-symmetric Nitsche method: the normal traction n . sigma . n is the
+consistency term, so the exact solution satisfies the discrete equations
+and the penalty (10 to 100) only has to make the constraint stable. None of
+it needs gradients of the test function, which the natural boundary
+condition cannot take (the symmetric variant would). With
+`consistent=False` only the penalty is added; its normal velocity is then
+of order h / penalty times the normal traction, a first order error that
+limits the accuracy of Q2/P2 elements. The conditioning stays close to that
+of a no-slip solve:
+
+    add_free_slip_bc(stokes, "Upper", viscosity=mu)
+    stokes.add_dirichlet_bc((0.0, 0.0), "Lower", (0, 1))
+
+`h` defaults to twice `mesh.get_min_radius()`. With the viscosity of a
+nonlinear rheology the term stays consistent with the Jacobian, as it is
+differentiated with the rest of the residual.
+
+With free slip on every boundary of an annulus (or sphere) the rigid
+rotations are close to the null space of the Stokes operator, but not in
+it: the rotation is not tangent to the polygonal facets, and the weak
+constraint lets the normal velocity through, so the constant pressure is
+not in the kernel either (its divergence term is int_Gamma w . n dS).
+`RotationNullSpace` gives GAMG on the velocity block the rigid body modes
+(translations and rotations) as its near null space, sets the rotations
+(and, with `pressure=True`, the constant pressure) as the null space of the
+Jacobian only if `MatNullSpace.test` confirms them, and removes the net
+rotation (the angular momentum) from the solution:
+
+    add_free_slip_bc(stokes, "Upper", viscosity=mu)
+    add_free_slip_bc(stokes, "Lower", viscosity=mu)
+    nullspace = RotationNullSpace(stokes)
+
+    nullspace.solve(zero_init_guess=False)    # in place of stokes.solve
+"""
+
+import numpy as np
+import sympy
+
+import underworld3 as uw
+
+
+def boundary_normal(mesh):
+    """The facet normal of the mesh (mesh.Gamma), or the radial unit vector on meshes without one."""
+    Gamma = getattr(mesh, "Gamma", None)
+    if Gamma is not None:
+        return sympy.Matrix(Gamma).reshape(mesh.dim, 1)
+
+    X = sympy.Matrix(mesh.X).reshape(mesh.dim, 1)
+    return X / sympy.sqrt(X.dot(X))
+
+
+def _stress(stokes, viscosity):
+    """The Cauchy stress of the Stokes system, 2 viscosity E - p I if the solver does not provide it."""
+    stress = getattr(stokes, "stress", None)
+    if stress is not None:
+        return sympy.Matrix(stress)
+
+    dim = stokes.mesh.dim
+    return 2 * viscosity * sympy.Matrix(stokes.strainrate) - stokes.p.sym[0] * sympy.eye(dim)
+
+
+def add_free_slip_bc(stokes, boundary, viscosity, penalty=20.0, cell_size=None, normal=None, consistent=True):
+    """
+    Impose v . n = 0 on `boundary` of the Stokes system `stokes` by
+    Nitsche's method: a penalty gamma = penalty * viscosity / cell_size
+    and, if `consistent`, minus the normal traction n . sigma . n.
+    Returns the boundary term that was added.
+    """
+    mesh = stokes.mesh
+    if cell_size is None:
+        cell_size = 2 * mesh.get_min_radius()
+    if normal is None:
+        normal = boundary_normal(mesh)
+    normal = sympy.Matrix(normal).reshape(mesh.dim, 1)
+
+    u = sympy.Matrix(stokes.u.sym).reshape(mesh.dim, 1)
+    gamma = penalty * viscosity / cell_size
+    term = gamma * u.dot(normal) * normal
+    if consistent:
+        term -= (normal.T * _stress(stokes, viscosity) * normal)[0, 0] * normal
+
+    stokes.add_natural_bc(term.T, boundary)
+
+    return term
+
+
+def _rotations(coords):
+    """Velocity of the rigid rotations about each axis (one in 2D, three in 3D) at (n, dim) points."""
+    if coords.shape[1] == 2:
+        return [np.column_stack([-coords[:, 1], coords[:, 0]])]
+
+    x, y, z = coords.T
+    zero = np.zeros_like(x)
+    return [np.column_stack([zero, -z, y]), np.column_stack([z, zero, -x]), np.column_stack([-y, x, zero])]
+
+
+def _orthonormalise(vectors):
+    for i, v in enumerate(vectors):
+        for w in vectors[:i]:
+            v.axpy(-v.dot(w), w)
+        v.normalize()
+    return vectors
+
+
+class RotationNullSpace:
+    """
+    The rigid-rotation null space of a Stokes system with free slip on all
+    of its (circular or spherical) boundaries.
+
+    `attach` sets the rigid body modes as the near null space of the
+    velocity block, and the rotations (and, with `pressure`, the constant
+    pressure) as the null space of the Jacobian if they pass
+    `MatNullSpace.test` on it (`exact` records the outcome);
+    `remove_rotation` subtracts the solid body rotation with the angular
+    momentum of the velocity. `solve` does both around `stokes.solve`. The
+    fields are "velocity" and "pressure", as in the solver's fieldsplit.
+    """
+
+    def __init__(self, stokes, pressure=False):
+        self.stokes = stokes
+        self.mesh = stokes.mesh
+        self.pressure = pressure
+        self.exact = None
+
+        self._jacobian = None
+        self._velocity_block = None
+
+        ### inertia tensor int (r^2 delta_ij - x_i x_j) dV, fixed with the mesh
+        X = self.mesh.X
+        dim = self.mesh.dim
+        r2 = sum(X[i] ** 2 for i in range(dim))
+        if dim == 2:
+            self._inertia = np.array([[uw.maths.Integral(self.mesh, r2).evaluate()]])
+        else:
+            self._inertia = np.array([
+                [uw.maths.Integral(self.mesh, (r2 if i == j else 0) - X[i] * X[j]).evaluate() for j in range(3)]
+                for i in range(3)
+            ])
+
+    def _field_vector(self, name, values=None, constant=None):
+        """Global solver vector that is `values` (nodal, of the field's variable) or `constant` on field `name` and zero elsewhere."""
+        stokes = self.stokes
+        variable = stokes.u if name == "velocity" else stokes.p
+        iset, subdm = stokes._subdict[name]
+
+        vector = stokes.dm.createGlobalVec()
+        vector.set(0.0)
+        block = vector.getSubVector(iset)
+        if constant is not None:
+            block.set(constant)
+        else:
+            with self.mesh.access(variable):
+                saved = np.array(variable.data)
+                variable.data[...] = values
+                subdm.localToGlobal(variable.vec, block)
+                variable.data[...] = saved
+        vector.restoreSubVector(iset, block)
+
+        return vector
+
+    def _velocity_modes(self):
+        """Rigid body modes of the velocity block: translations and rotations."""
+        stokes = self.stokes
+        coords = np.asarray(stokes.u.coords)
+        iset, _ = stokes._subdict["velocity"]
+
+        fields = [np.eye(self.mesh.dim)[i][None, :] * np.ones((coords.shape[0], 1)) for i in range(self.mesh.dim)]
+        fields += _rotations(coords)
+
+        modes = []
+        for values in fields:
+            vector = self._field_vector("velocity", values)
+            block = vector.getSubVector(iset)
+            modes.append(block.copy())
+            vector.restoreSubVector(iset, block)
+
+        return _orthonormalise(modes)
+
+    def attach(self):
+        """Set the null spaces on the current solver matrices (again only if the solver rebuilt them)."""
+        from petsc4py import PETSc
+
+        stokes = self.stokes
+        snes = stokes.snes
+        snes.setUp()
+
+        ### only a confirmed null space is projected out; the test needs the assembled Jacobian (after the first solve)
+        jacobian = snes.getJacobian()[0]
+        if jacobian is not None and jacobian != self._jacobian and jacobian.isAssembled():
+            vectors = [self._field_vector("velocity", values) for values in _rotations(np.asarray(stokes.u.coords))]
+            if self.pressure:
+                vectors.append(self._field_vector("pressure", constant=1.0))
+            nullspace = PETSc.NullSpace().create(vectors=_orthonormalise(vectors), comm=self.mesh.dm.comm)
+            self.exact = bool(nullspace.test(jacobian))
+            if self.exact:
+                jacobian.setNullSpace(nullspace)
+                jacobian.setTransposeNullSpace(nullspace)
+            self._jacobian = jacobian
+
+        ### the velocity block exists once the fieldsplit has been set up (after the first solve)
+        pc = snes.getKSP().getPC()
+        if pc.getType() == PETSc.PC.Type.FIELDSPLIT:
+            try:
+                block = pc.getFieldSplitSubKSP()[0].getOperators()[0]
+            except PETSc.Error:
+                return
+            if block != self._velocity_block:
+                block.setNearNullSpace(PETSc.NullSpace().create(vectors=self._velocity_modes(), comm=self.mesh.dm.comm))
+                self._velocity_block = block
+
+    def angular_velocity(self):
+        """Angular velocity of the solid body rotation with the angular momentum of the velocity. Collective."""
+        X = self.mesh.X
+        v = self.stokes.u.sym
+        if self.mesh.dim == 2:
+            momentum = np.array([uw.maths.Integral(self.mesh, X[0] * v[1] - X[1] * v[0]).evaluate()])
+        else:
+            momentum = np.array([
+                uw.maths.Integral(self.mesh, X[1] * v[2] - X[2] * v[1]).evaluate(),
+                uw.maths.Integral(self.mesh, X[2] * v[0] - X[0] * v[2]).evaluate(),
+                uw.maths.Integral(self.mesh, X[0] * v[1] - X[1] * v[0]).evaluate(),
+            ])
+
+        return np.linalg.solve(self._inertia, momentum)
+
+    def remove_rotation(self):
+        """Subtract the net rotation from the velocity; returns the angular velocity removed. Collective."""
+        omega = self.angular_velocity()
+        velocity = self.stokes.u
+        rotations = _rotations(np.asarray(velocity.coords))
+
+        with self.mesh.access(velocity):
+            for w, rotation in zip(omega, rotations):
+                velocity.data[...] -= w * rotation
+
+        return omega
+
+    def solve(self, **kwargs):
+        """stokes.solve(**kwargs) with the null spaces attached and the net rotation removed. Collective."""
+        stokes = self.stokes
+        if not stokes.is_setup:
+            stokes._setup_pointwise_functions()
+            stokes._setup_discretisation()
+            stokes._setup_solver()
+
+        self.attach()
+        stokes.solve(**kwargs)
+        ### picks up the velocity block built in the first solve, for the next ones
+        self.attach()
+
+        return self.remove_rotation()
@@ -0,0 +1,148 @@
+"""
+Material index swarm variables whose mask proxies are rebuilt lazily.
+
+`uw.swarm.IndexSwarmVariable` keeps a proxy MeshVariable (a mask) per
+index and rebuilds every one of them, each with its own neighbour search,
+whenever the swarm changes, i.e. after every advection and migration,
+whether or not anything reads the masks before the next change. The sinker
+and slab scripts only write the material index when they set it up, but
+advect the swarm every step. `LazyIndexSwarmVariable` is a drop-in
+replacement (`createMask`, `sym`, `data` in `swarm.access`) in which a
+change only marks the masks stale. They are rebuilt by `refresh()`, which
+the scripts call on every rank before the solves and projections that read
+the masks (it is collective, so it is not hidden in the mesh's own
+updates, which may run on only some of the ranks):
+
+- all the masks in one sweep: one neighbour query of the particles for
+  the proxy nodes, then an inverse-distance average of the index one-hot,
+- not at all if neither the particle positions nor the index values
+  changed since the last rebuild (a checksum of both, agreed over the
+  ranks).
+
+    material = LazyIndexSwarmVariable("M", swarm, indices=2)
+    ...
+    visc_fn = material.createMask([viscBG, viscSphere])
+    ...
+    material.refresh()
+    stokes.solve()
+    material.counters        # {"changes", "refreshes", "rebuilds", "unchanged", "rebuild_time"}
+
+`changes` counts the swarm's notifications, `rebuilds` the mask rebuilds,
+`unchanged` the refreshes skipped because the checksum matched.
+"""
+
+import time
+import zlib
+
+import numpy as np
+import sympy
+from mpi4py import MPI
+
+import underworld3 as uw
+
+
+def _checksum(*arrays):
+    """crc32 of the bytes of `arrays`."""
+    crc = 0
+    for array in arrays:
+        crc = zlib.crc32(np.ascontiguousarray(array).view(np.uint8), crc)
+    return crc
+
+
+class LazyIndexSwarmVariable(uw.swarm.SwarmVariable):
+    """
+    Integer material index on `swarm` with a mask proxy (degree
+    `proxy_degree`) per index in 0..`indices`-1, each the inverse-distance
+    average over the `npoints` nearest local particles of whether their
+    index is that one. The masks are rebuilt by `refresh` (see the module).
+    """
+
+    def __init__(self, name, swarm, indices=1, proxy_degree=1, proxy_continuous=True, npoints=5):
+        self.indices = indices
+        self.npoints = npoints
+        self.counters = {"changes": 0, "refreshes": 0, "rebuilds": 0, "unchanged": 0, "rebuild_time": 0.0}
+        self._stale = True
+        self._checksum = None
+
+        super().__init__(name, swarm, size=1, vtype=uw.VarType.SCALAR, dtype=int, _proxy=False)
+
+        self.masks = [
+            uw.discretisation.MeshVariable(
+                name + R"^{[" + str(i) + R"]}", swarm.mesh, 1, degree=proxy_degree, continuous=proxy_continuous
+            )
+            for i in range(indices)
+        ]
+        self._MaskArray = sympy.Matrix([[mask.sym[0, 0] for mask in self.masks]])
+
+    @property
+    def sym(self):
+        """The masks, a 1 x indices sympy Matrix."""
+        return self._MaskArray
+
+    def createMask(self, funcsList):
+        """sum_i funcsList[i] * mask_i, the property of each material blended by the masks."""
+        if len(funcsList) != self.indices:
+            raise ValueError(f"{self.indices} values needed, one per index, got {len(funcsList)}")
+
+        return sum((value * self._MaskArray[0, i] for i, value in enumerate(funcsList)), sympy.Integer(0))
+
+    def _update(self):
+        """Called by the swarm after its particles or this variable changed: only marks the masks stale."""
+        if hasattr(self, "counters"):
+            self.counters["changes"] += 1
+            self._stale = True
+
+    def refresh(self, force=False):
+        """Rebuild the masks if the positions or indices changed since the last rebuild. Collective."""
+        ### a swarm access on some of the ranks may mark only them stale, so agree before the collective part
+        if not uw.mpi.comm.allreduce(int(self._stale or force), op=MPI.MAX):
+            return False
+        self._stale = False
+        self.counters["refreshes"] += 1
+
+        with self.swarm.access():
+            coords = np.array(self.swarm.data)
+            values = np.array(self.data[:, 0]).astype(np.int64)
+
+        checksum = _checksum(coords, values)
+        changed = uw.mpi.comm.allreduce(int(force or checksum != self._checksum), op=MPI.MAX)
+        if not changed:
+            self.counters["unchanged"] += 1
+            return False
+
+        start = time.perf_counter()
+        fractions = self._fractions(coords, values)
+        with self.swarm.mesh.access(*self.masks):
+            for i, mask in enumerate(self.masks):
+                mask.data[:, 0] = fractions[:, i]
+
+        self._checksum = checksum
+        self.counters["rebuilds"] += 1
+        self.counters["rebuild_time"] += time.perf_counter() - start
+        return True
+
+    def _fractions(self, coords, values):
+        """(proxy nodes, indices) inverse-distance weighted fraction of each index among the nearest particles."""
+        from scipy.spatial import cKDTree
+
+        nodes = np.asarray(self.masks[0].coords)
+        fractions = np.zeros((nodes.shape[0], self.indices))
+        valid = (values >= 0) & (values < self.indices)
+        if not valid.any() or nodes.shape[0] == 0:
+            return fractions
+        coords, values = coords[valid], values[valid]
+
+        k = min(self.npoints, coords.shape[0])
+        distance, neighbour = cKDTree(coords).query(nodes, k=k)
+        distance = distance.reshape(nodes.shape[0], k)
+        neighbour = neighbour.reshape(nodes.shape[0], k)
+
+        weights = 1.0 / (distance + 1.0e-16)
+        rows = np.repeat(np.arange(nodes.shape[0]), k)
+        fractions = np.bincount(
+            rows * self.indices + values[neighbour].ravel(),
+            weights=weights.ravel(),
+            minlength=nodes.shape[0] * self.indices,
+        ).reshape(nodes.shape[0], self.indices)
+
+        return fractions / weights.sum(axis=1)[:, None]
@@ -0,0 +1,299 @@
+"""
+Lithostatic pressure by integrating the density along gravity.
+
+The pressure-dependent yield laws need a reference pressure
+
+    p_l(x) = p_0 + int_x^surface rho g ds
+
+along the direction of gravity. The thrust wedge got it from a full
+SteadyStateDarcy solve and the layered benchmarks from rho g depth, which
+is only right for a uniform density. `LithostaticPressure` integrates the
+density along vertical lines of a 2D box (gravity along -y) or along the
+rays of an annulus (gravity towards the centre): every rank integrates
+along the lines through its own cells into a table of (column, layer)
+integrals, one allreduce of the table completes the columns across the
+ranks, and the pressure at the nodes of the target variable is
+interpolated from the cumulative sums:
+
+    lithostatic = LithostaticPressure(lithoP, density_fn, nd_gravity, minimum=nd(1*u.atmosphere))
+
+    lithostatic.solve()                 # lithoP.data, after the material has moved
+
+The columns and layers default to the node positions of the target
+variable when they form a grid (StructuredQuadBox), so the pressure is the
+column integral at every node, and otherwise to a uniform grid of about the
+same resolution (simplex boxes, annuli). The geometry is computed once;
+call `setup()` again if the mesh moves. `density` is any sympy expression
+(material masks, proxy variables) and is evaluated at a line quadrature
+inside the cells, so nothing is projected or solved.
+"""
+
+import math
+
+import numpy as np
+from mpi4py import MPI
+
+import underworld3 as uw
+
+from .topology import _ghost_points, local_cells
+
+GEOMETRIES = ("box", "annulus")
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+class LithostaticPressure:
+    """
+    Lithostatic pressure `surface_pressure` + int rho g ds at the nodes of
+    the scalar MeshVariable `pressure`.
+
+    density  - sympy expression of the density
+    gravity  - magnitude of gravity, a number or a numpy function of y
+               (box) or of the radius (annulus)
+    geometry - "box" (gravity along -y) or "annulus" (gravity along -r)
+    columns  - positions across gravity (x, or the angle on an annulus) of
+               the integration lines: an array, a number of uniformly
+               spaced lines, or None for the default
+    levels   - heights (y, or the radius) that split the lines into layers,
+               likewise
+    minimum  - lower bound of the pressure, if any
+
+    2D meshes only. `solve` is collective.
+    """
+
+    def __init__(self, pressure, density, gravity, geometry="box", columns=None, levels=None,
+                 surface_pressure=0.0, minimum=None, quadrature_degree=3, inset=1.0e-6):
+        if geometry not in GEOMETRIES:
+            raise ValueError(f"Unknown geometry {geometry}, expected one of {', '.join(GEOMETRIES)}")
+        if pressure.mesh.dim != 2:
+            raise ValueError("LithostaticPressure only supports 2D meshes")
+
+        self.pressure = pressure
+        self.mesh = pressure.mesh
+        self.density = density
+        self.gravity = gravity
+        self.geometry = geometry
+        self.surface_pressure = surface_pressure
+        self.minimum = minimum
+        self.quadrature_degree = quadrature_degree
+        self.inset = inset
+
+        self._columns = columns
+        self._levels = levels
+
+        self.setup()
+
+    def _frame(self, coords):
+        """(across, along) gravity coordinates of (n, 2) points: (x, y) or (angle, radius)."""
+        if self.geometry == "box":
+            return coords[:, 0], coords[:, 1]
+        return np.arctan2(coords[:, 1], coords[:, 0]), np.hypot(coords[:, 0], coords[:, 1])
+
+    def _line(self, t):
+        """Origin and unit direction (up) of the integration line at `t`."""
+        if self.geometry == "box":
+            return np.array([t, 0.0]), np.array([0.0, 1.0])
+        return np.zeros(2), np.array([math.cos(t), math.sin(t)])
+
+    def _axis(self, spec, local, lower, upper, count, periodic=False):
+        """Sorted positions from an array, a count or (None) the node positions if they form a grid."""
+        if spec is None:
+            spec = local if local is not None else count
+        if np.ndim(spec) == 0:
+            n = max(int(spec), 2)
+            if periodic:
+                return -math.pi + 2 * math.pi * np.arange(n) / n
+            return np.linspace(lower, upper, n)
+        return np.unique(np.asarray(spec, dtype=float))
+
+    def setup(self):
+        """Integration points, weights and table indices of the local cells, and the node interpolation. Collective."""
+        comm = uw.mpi.comm
+        mesh = self.mesh
+        periodic = self.geometry == "annulus"
+
+        with mesh.access():
+            coords = np.asarray(mesh.data)[:, 0:2].copy()
+        nodes = np.asarray(self.pressure.coords)[:, 0:2]
+
+        t_nodes, s_nodes = self._frame(nodes)
+        t_all, s_all = self._frame(coords)
+
+        s_lower = comm.allreduce(s_all.min() if s_all.size else np.inf, op=MPI.MIN)
+        s_upper = comm.allreduce(s_all.max() if s_all.size else -np.inf, op=MPI.MAX)
+        if periodic:
+            t_lower, t_upper = -math.pi, math.pi
+            width = 2 * math.pi * 0.5 * (s_lower + s_upper)
+        else:
+            t_lower = comm.allreduce(t_all.min() if t_all.size else np.inf, op=MPI.MIN)
+            t_upper = comm.allreduce(t_all.max() if t_all.size else -np.inf, op=MPI.MAX)
+            width = t_upper - t_lower
+        height = s_upper - s_lower
+        self._tol = 1.0e-9 * max(width, height)
+
+        ### the nodes of a structured mesh line up: use their positions, otherwise a grid of similar resolution
+        n_nodes = comm.allreduce(nodes.shape[0])
+        spacing = math.sqrt(width * height / max(n_nodes, 1))
+        default_t = int(math.ceil(width / spacing)) + (0 if periodic else 1)
+        default_s = int(math.ceil(height / spacing)) + 1
+
+        grid_t = grid_s = None
+        if not periodic and (self._columns is None or self._levels is None):
+            local_t, local_s = _merge(t_nodes, self._tol), _merge(s_nodes, self._tol)
+            structured = local_t.size * local_s.size <= 2 * max(nodes.shape[0], 1)
+            if comm.allreduce(int(structured), op=MPI.MIN):
+                grid_t = _merge(np.concatenate(comm.allgather(local_t)), self._tol)
+                grid_s = _merge(np.concatenate(comm.allgather(local_s)), self._tol)
+
+        self.columns = self._axis(self._columns, grid_t, t_lower, t_upper, default_t, periodic)
+        self.levels = self._axis(self._levels, grid_s, s_lower, s_upper, default_s)
+
+        self._cell_geometry(coords)
+        self._interpolation(t_nodes, s_nodes)
+
+    def _cell_geometry(self, coords):
+        """Line quadrature through every owned cell, split at the levels."""
+        mesh = self.mesh
+        dm = mesh.dm
+        cStart, _ = dm.getHeightStratum(0)
+        ghosts = _ghost_points(dm)
+
+        cells = local_cells(mesh)
+        xi, w = np.polynomial.legendre.leggauss(max(1, (self.quadrature_degree + 2) // 2))
+        n_layers = self.levels.size - 1
+        periodic = self.geometry == "annulus"
+
+        points, weights, index = [], [], []
+        for c, cell in enumerate(cells):
+            if c + cStart in ghosts:
+                continue
+            polygon = coords[cell]
+            centroid = polygon.mean(axis=0)
+
+            t, _ = self._frame(polygon)
+            if periodic:
+                t = t[0] + np.angle(np.exp(1j * (t - t[0])))
+            t_min, t_max = t.min(), t.max()
+
+            ### each line belongs to the cells it enters from the left (and the last one to the rightmost cells)
+            for shift in ((-2 * math.pi, 0.0, 2 * math.pi) if periodic else (0.0,)):
+                candidates = self.columns + shift
+                inside = (candidates >= t_min - self._tol) & (candidates < t_max - self._tol)
+                if not periodic:
+                    inside[-1] |= abs(candidates[-1] - t_max) <= self._tol
+                for j in np.flatnonzero(inside):
+                    segment = self._intersect(polygon, candidates[j])
+                    if segment is None:
+                        continue
+                    s_lo, s_hi = segment
+
+                    cuts = self.levels[(self.levels > s_lo) & (self.levels < s_hi)]
+                    bounds = np.concatenate([[s_lo], cuts, [s_hi]])
+                    origin, direction = self._line(candidates[j])
+                    for a, b in zip(bounds[:-1], bounds[1:]):
+                        k = min(max(int(np.searchsorted(self.levels, 0.5 * (a + b))) - 1, 0), n_layers - 1)
+                        s = a + 0.5 * (b - a) * (1 + xi)
+                        p = origin[None, :] + s[:, None] * direction[None, :]
+                        points.append(p + self.inset * (centroid - p))
+                        weights.append(0.5 * (b - a) * w * self._gravity(s))
+                        index.append(np.full(s.size, j * n_layers + k, dtype=np.int64))
+
+        self._points = np.concatenate(points) if points else np.zeros((0, 2))
+        self._weights = np.concatenate(weights) if weights else np.zeros(0)
+        self._index = np.concatenate(index) if index else np.zeros(0, dtype=np.int64)
+
+    def _intersect(self, polygon, t):
+        """(lowest, highest) height at which the line at `t` crosses a convex cell, or None."""
+        origin, direction = self._line(t)
+        heights = []
+        for a, b in zip(polygon, np.roll(polygon, -1, axis=0)):
+            edge = b - a
+            denominator = _cross(direction, edge)
+            if abs(denominator) > self._tol * np.linalg.norm(edge):
+                u = _cross(a - origin, direction) / denominator
+                if -self._tol <= u <= 1 + self._tol:
+                    heights.append(_cross(a - origin, edge) / denominator)
+            elif abs(_cross(a - origin, direction)) <= self._tol:
+                ### edge along the line
+                heights.extend([np.dot(a - origin, direction), np.dot(b - origin, direction)])
+
+        if not heights or max(heights) - min(heights) <= self._tol:
+            return None
+        return min(heights), max(heights)
+
+    def _gravity(self, s):
+        if callable(self.gravity):
+            return np.asarray(self.gravity(s), dtype=float) * np.ones_like(s)
+        return float(self.gravity) * np.ones_like(s)
+
+    def _interpolation(self, t, s):
+        """Bilinear interpolation weights of the nodes in the (column, level) grid."""
+        columns, levels = self.columns, self.levels
+
+        if self.geometry == "annulus":
+            period = 2 * math.pi
+            i0 = np.searchsorted(columns, t, side="right") - 1
+            left = columns[i0 % columns.size] - period * (i0 < 0)
+            i1 = (i0 + 1) % columns.size
+            right = np.where(i0 + 1 < columns.size, columns[i1], columns[0] + period)
+            i0 = i0 % columns.size
+        else:
+            i0 = np.clip(np.searchsorted(columns, t, side="right") - 1, 0, max(columns.size - 2, 0))
+            i1 = np.minimum(i0 + 1, columns.size - 1)
+            left, right = columns[i0], columns[i1]
+        span = right - left
+        wt = np.clip((t - left) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+
+        k0 = np.clip(np.searchsorted(levels, s, side="right") - 1, 0, levels.size - 2)
+        k1 = k0 + 1
+        ws = np.clip((s - levels[k0]) / (levels[k1] - levels[k0]), 0.0, 1.0)
+
+        self._nodes = (i0, i1, wt, k0, k1, ws)
+
+    def column_pressure(self):
+        """(columns, levels) table of the lithostatic pressure at the levels of every column. Collective."""
+        n_layers = self.levels.size - 1
+
+        if self._points.shape[0]:
+            rho = np.asarray(uw.function.evaluate(self.density, self._points)).reshape(-1)
+            local = np.bincount(self._index, weights=self._weights * rho, minlength=self.columns.size * n_layers)
+        else:
+            local = np.zeros(self.columns.size * n_layers)
+
+        layers = np.zeros_like(local)
+        uw.mpi.comm.Allreduce(local, layers, op=MPI.SUM)
+        layers = layers.reshape(self.columns.size, n_layers)
+
+        ### the pressure at a level is the weight of the layers above it
+        table = np.zeros((self.columns.size, self.levels.size))
+        table[:, :-1] = np.cumsum(layers[:, ::-1], axis=1)[:, ::-1]
+
+        return self.surface_pressure + table
+
+    def solve(self):
+        """Integrate the current density and write the pressure to the target variable. Collective."""
+        table = self.column_pressure()
+        i0, i1, wt, k0, k1, ws = self._nodes
+
+        values = (
+            (1 - wt) * ((1 - ws) * table[i0, k0] + ws * table[i0, k1])
+            + wt * ((1 - ws) * table[i1, k0] + ws * table[i1, k1])
+        )
+        if self.minimum is not None:
+            values = np.maximum(values, self.minimum)
+
+        with self.mesh.access(self.pressure):
+            self.pressure.data[:, 0] = values
+
+        return table
+
+
+def _merge(values, tol):
+    """Sorted values with the ones closer than `tol` merged."""
+    values = np.sort(values)
+    if values.size == 0:
+        return values
+    keep = np.concatenate([[True], np.diff(values) > tol])
+    return values[keep]
@@ -0,0 +1,99 @@
+"""
+Material properties looked up by material index on the particles.
+
+`IndexSwarmVariable.createMask([...])` builds the sum over the materials of
+a mask proxy times the property, so with five materials every quadrature
+point interpolates five proxy fields, and every material law (the strain
+weakening Piecewise of each cohesion and friction) is compiled into every
+property it takes part in. `MaterialTable` keeps one array of values per
+property, indexed by material, and fills a swarm variable per property by
+array lookup of each particle's integer material index; laws that depend on
+particle data (strain weakening) are evaluated in numpy on the particles
+with the looked-up parameters. The assembly then sees one proxy per
+property, however many materials there are:
+
+    materials = MaterialTable(swarm, materialVariable, {
+        "density":  [air_density, rock_density, rock_density, rock_density, rock_density],
+        "C0": [...], "C1": [...],
+    }, laws={
+        "cohesion": lambda p: linear_weakening(strain.data[:, 0], p["C0"], p["C1"], 0.01, 0.06),
+    }, proxies=["density", "cohesion"])
+
+    stokes.bodyforce = sympy.Matrix([0, -g * materials["density"]])
+
+    materials.update()                  # after the index or the strain changed
+
+Tables that are not in `proxies` are only used by the laws. Like any swarm
+variable, the table is best made before the swarm is populated; the values
+travel with the particles when they are advected, so `update` is only
+needed when the index or the data of a law change.
+"""
+
+import numpy as np
+
+
+def linear_weakening(strain, value0, value1, epsilon0, epsilon1):
+    """value0 below strain epsilon0, value1 above epsilon1 and linear in between (numpy, per particle)."""
+    fraction = np.clip((strain - epsilon0) / (epsilon1 - epsilon0), 0.0, 1.0)
+    return value0 + fraction * (value1 - value0)
+
+
+class MaterialTable:
+    """
+    Per-material property tables over the integer `index` (a SwarmVariable
+    of `swarm`), with a proxied swarm variable for each of `proxies`.
+
+    tables  - {name: sequence of one value per material}
+    laws    - {name: function of the looked-up tables {name: per-particle
+              array, "index": material index} returning a per-particle
+              array}, evaluated inside `swarm.access`
+    proxies - the properties the mesh sees (default: all tables and laws)
+    """
+
+    def __init__(self, swarm, index, tables, laws=None, proxies=None, proxy_degree=1):
+        self.swarm = swarm
+        self.index = index
+        self.tables = {name: np.asarray(values, dtype=float) for name, values in tables.items()}
+        self.laws = dict(laws or {})
+
+        sizes = {values.size for values in self.tables.values()}
+        if len(sizes) > 1:
+            raise ValueError(f"Material tables of different lengths {sorted(sizes)}")
+        self.n_materials = sizes.pop() if sizes else 0
+
+        if proxies is None:
+            proxies = list(self.tables) + list(self.laws)
+        unknown = set(proxies) - set(self.tables) - set(self.laws)
+        if unknown:
+            raise ValueError(f"No table or law for {', '.join(sorted(unknown))}")
+
+        self.variables = {
+            name: swarm.add_variable(name=f"mat_{name}", size=1, dtype=float, proxy_degree=proxy_degree)
+            for name in proxies
+        }
+        self.updates = 0
+
+    def __getitem__(self, name):
+        """The property as a sympy expression (its proxy)."""
+        return self.variables[name].sym[0]
+
+    def lookup(self, index):
+        """{name: per-particle values} of every table, and "index", for the material indices `index`."""
+        index = np.asarray(index).reshape(-1).astype(np.int64)
+        if index.size and (index.min() < 0 or index.max() >= self.n_materials):
+            raise ValueError(f"Material index outside 0..{self.n_materials - 1}")
+
+        values = {name: np.take(table, index) for name, table in self.tables.items()}
+        values["index"] = index
+        return values
+
+    def update(self):
+        """Refill the property variables from the current material index (and particle data). Collective."""
+        with self.swarm.access(*self.variables.values()):
+            values = self.lookup(self.index.data[:, 0])
+            for name, law in self.laws.items():
+                values[name] = law(values)
+            for name, variable in self.variables.items():
+                variable.data[:, 0] = values[name]
+
+        self.updates += 1
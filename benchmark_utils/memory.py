@@ -0,0 +1,234 @@
+"""
+Memory use of the benchmark runs.
+
+`PhaseProfiler` (benchmark_utils/profiling.py) takes a snapshot at the end
+of every phase on every rank:
+
+    rss              - resident set size
+    peak_rss         - high-water mark of the resident set since the start
+    petsc_malloc     - memory currently allocated through PetscMalloc
+    petsc_malloc_peak
+
+The PETSc numbers are only tracked when PETSc logs its allocations (run
+with `-malloc_debug` or `-malloc_view`), otherwise they are zero.
+`memory_report` gathers the snapshots over the ranks (maximum and sum per
+phase) together with the footprint of every MeshVariable and SwarmVariable,
+and the scripts store it with their results (`check_results(...,
+memory=...)`). From runs at several resolutions the memory of a larger run
+can then be estimated:
+
+    python -m benchmark_utils.memory --benchmark Sinker             # memory of the recorded runs
+    python -m benchmark_utils.memory --benchmark Sinker --res 256 --np 16
+
+The estimate fits the memory above the per-rank baseline (interpreter,
+underworld3 and PETSc loaded) as a power of the resolution, and divides it
+evenly over the ranks; partitions are rarely that even, so leave some margin.
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+
+import numpy as np
+
+SNAPSHOT_KEYS = ("rss", "peak_rss", "petsc_malloc", "petsc_malloc_peak")
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """High-water mark of the resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ### kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_snapshot():
+    """{key: bytes} for every key in SNAPSHOT_KEYS, for this rank."""
+    snapshot = {"rss": rss_bytes(), "peak_rss": peak_rss_bytes(), "petsc_malloc": 0, "petsc_malloc_peak": 0}
+
+    try:
+        from petsc4py import PETSc
+
+        snapshot["petsc_malloc"] = int(PETSc.Memory.getMallocCurrentUsage())
+        snapshot["petsc_malloc_peak"] = int(PETSc.Memory.getMallocMaximumUsage())
+    except Exception:
+        pass
+
+    return snapshot
+
+
+def variable_footprints(mesh=None, swarms=()):
+    """
+    Bytes held by each MeshVariable and SwarmVariable, summed over the ranks
+    (local data including ghosts). Mesh coordinates are included as
+    `mesh_coordinates`, swarm proxies appear as mesh variables.
+    """
+    import underworld3 as uw
+
+    footprints = {}
+
+    if mesh is not None:
+        with mesh.access():
+            footprints["mesh_coordinates"] = mesh.data.nbytes
+            for var in mesh.vars.values():
+                footprints[f"mesh/{var.clean_name}"] = var.data.nbytes
+
+    for swarm in swarms:
+        with swarm.access():
+            for var in swarm.vars.values():
+                footprints[f"swarm/{var.clean_name}"] = var.data.nbytes
+
+    return {name: int(uw.mpi.comm.allreduce(nbytes)) for name, nbytes in footprints.items()}
+
+
+def memory_report(profiler, mesh=None, swarms=()):
+    """
+    The memory snapshots of `profiler`, reduced over the ranks, and the
+    variable footprints. Collective; returns the same dict on every rank.
+
+    {"nprocs", "baseline": {key: {"max", "sum"}},
+     "phases": {phase: {key: {"max", "sum"}}}, "variables": {name: bytes}}
+    """
+    import underworld3 as uw
+    from mpi4py import MPI
+
+    comm = uw.mpi.comm
+
+    def reduce(snapshot):
+        return {
+            key: {"max": int(comm.allreduce(value, op=MPI.MAX)), "sum": int(comm.allreduce(value))}
+            for key, value in snapshot.items()
+        }
+
+    ### the same phases on every rank, in case a phase only ran on some of them
+    phases = sorted(set().union(*comm.allgather(list(profiler.memory))))
+    empty = {key: 0 for key in SNAPSHOT_KEYS}
+
+    return {
+        "nprocs": uw.mpi.size,
+        "baseline": reduce(profiler.memory_baseline or empty),
+        "phases": {phase: reduce(profiler.memory.get(phase, empty)) for phase in phases},
+        "variables": variable_footprints(mesh, swarms),
+    }
+
+
+def _mb(nbytes):
+    return nbytes / 2.0**20
+
+
+def memory_table(report):
+    """Text table of a memory report, in MB."""
+    lines = [f"{'phase':>26} {'rss max':>10} {'rss sum':>10} {'peak max':>10} {'peak sum':>10} {'petsc max':>10}"]
+    rows = [("(baseline)", report["baseline"])] + list(report["phases"].items())
+    for phase, values in rows:
+        lines.append(
+            f"{phase:>26} {_mb(values['rss']['max']):>10.1f} {_mb(values['rss']['sum']):>10.1f} "
+            f"{_mb(values['peak_rss']['max']):>10.1f} {_mb(values['peak_rss']['sum']):>10.1f} "
+            f"{_mb(values['petsc_malloc_peak']['max']):>10.1f}"
+        )
+
+    if report["variables"]:
+        lines.append("")
+        lines.append(f"{'variable':>26} {'MB':>10}")
+        for name, nbytes in sorted(report["variables"].items(), key=lambda item: -item[1]):
+            lines.append(f"{name:>26} {_mb(nbytes):>10.2f}")
+
+    return "\n".join(lines)
+
+
+def peak_memory(report):
+    """(largest per-rank peak, sum of the per-rank peaks) over all phases, in bytes."""
+    peaks = [values["peak_rss"] for values in report["phases"].values()]
+    if not peaks:
+        return 0, 0
+
+    return max(peak["max"] for peak in peaks), max(peak["sum"] for peak in peaks)
+
+
+class MemoryModel:
+    """
+    Memory of a benchmark against resolution, fitted to the recorded runs:
+
+        peak per rank = baseline + c * res**p / nprocs
+    """
+
+    def __init__(self, runs):
+        samples = []
+        baselines = []
+        for run in runs:
+            report = run.get("memory")
+            if not report or "res" not in run["parameters"]:
+                continue
+            nprocs = report["nprocs"]
+            baseline = report["baseline"]["rss"]["sum"] / nprocs
+            _, peak_sum = peak_memory(report)
+            baselines.append(baseline)
+            samples.append((float(run["parameters"]["res"]), peak_sum - nprocs * baseline))
+
+        if not samples:
+            raise ValueError("No recorded runs with a memory report and a 'res' parameter")
+
+        self.baseline = float(np.median(baselines))
+        self.samples = samples
+
+        res = np.array([r for r, _ in samples])
+        extra = np.maximum(np.array([m for _, m in samples]), 1.0)
+
+        if np.unique(res).shape[0] > 1:
+            self.exponent, log_c = np.polyfit(np.log(res), np.log(extra), 1)
+            self.coefficient = math.exp(log_c)
+        else:
+            ### a single resolution: assume memory grows with the number of cells in 2D
+            self.exponent = 2.0
+            self.coefficient = float(np.mean(extra / res**2))
+
+    def predict(self, res, nprocs=1):
+        """Estimated peak memory (bytes) per rank and in total."""
+        extra = self.coefficient * float(res) ** self.exponent
+        per_rank = self.baseline + extra / nprocs
+
+        return per_rank, per_rank * nprocs
+
+
+def main(argv=None):
+    from .regression import RESULTS_FILE, RegressionDatabase
+
+    parser = argparse.ArgumentParser(description="Memory use of recorded benchmark runs, and estimates for larger runs.")
+    parser.add_argument("--file", default=RESULTS_FILE, help="results store of benchmark_utils.regression")
+    parser.add_argument("--benchmark", required=True)
+    parser.add_argument("--res", type=float, default=None, help="estimate the memory at this resolution")
+    parser.add_argument("--np", type=int, default=1, dest="nprocs")
+    args = parser.parse_args(argv)
+
+    runs = [run for run in RegressionDatabase(args.file).history(args.benchmark) if run.get("memory")]
+    if not runs:
+        raise SystemExit(f"No runs of {args.benchmark} with a memory report in {args.file}")
+
+    if args.res is None:
+        for run in runs:
+            print(f"{run['timestamp']} np {run['nprocs']} {json.dumps(run['parameters'], sort_keys=True)}")
+            print(memory_table(run["memory"]))
+            print("")
+        return
+
+    model = MemoryModel(runs)
+    per_rank, total = model.predict(args.res, args.nprocs)
+    print(f"Fitted to {len(model.samples)} runs: {_mb(model.baseline):.0f} MB per rank + "
+          f"{model.coefficient:.3g} * res^{model.exponent:.2f} bytes")
+    print(f"{args.benchmark} at res = {args.res:g} on {args.nprocs} ranks: "
+          f"~{_mb(per_rank):.0f} MB per rank, ~{_mb(total) / 1024:.2f} GB in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Statistical comparison of benchmark phase timings.
+
+Each run of a benchmark script records its phase timings with
+`benchmark_utils.regression.check_results`. This tool runs selected scripts
+several times into a separate results file per label, and compares two such
+files phase by phase:
+
+    cd Working/Cartesian
+    python -m benchmark_utils.perfcompare run Ex_Stokes_Sinker_benchmark.py Ex_AdvDiff-hot_pipe.py --repeat 5 --label main
+    python -m benchmark_utils.perfcompare run Ex_Stokes_Sinker_benchmark.py Ex_AdvDiff-hot_pipe.py --repeat 5 --label dev \\
+        --python ~/envs/uw3-dev/bin/python
+    python -m benchmark_utils.perfcompare compare perf_main.jsonl perf_dev.jsonl
+
+(with the repository root on PYTHONPATH). `--python` runs the scripts with
+another interpreter, so two installed underworld3 versions can be compared
+on the same checkout.
+
+The comparison works on log times: the ratio of the geometric mean times is
+reported with a Welch t confidence interval. A phase is a significant
+slowdown when the whole interval lies above 1 + threshold, so a single noisy
+run does not trip it and a small but consistent slowdown still does.
+"""
+
+import argparse
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def run_repeats(scripts, repeat, filename, options="", nprocs=1, python=None, mpiexec="mpiexec"):
+    """Run each script `repeat` times, appending its results to `filename`."""
+    filename = os.path.abspath(filename)
+    python = python or sys.executable
+
+    for script in scripts:
+        for i in range(repeat):
+            command = [python, script, "-regression_file", filename] + shlex.split(options)
+            if nprocs > 1:
+                command = [mpiexec, "-n", str(nprocs)] + command
+
+            start = time.perf_counter()
+            result = subprocess.run(command)
+            status = "" if result.returncode == 0 else f" (exit code {result.returncode})"
+            print(f"{script} run {i + 1}/{repeat}: {time.perf_counter() - start:.1f} s{status}", flush=True)
+
+    return filename
+
+
+def timing_samples(filename):
+    """{(benchmark, parameters as json, nprocs): {phase: [seconds, ...]}} from a results file."""
+    samples = {}
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            run = json.loads(line)
+            key = (run["benchmark"], json.dumps(run["parameters"], sort_keys=True, default=str), run["nprocs"])
+            for phase, seconds in run["timings"].items():
+                samples.setdefault(key, {}).setdefault(phase, []).append(seconds)
+
+    return samples
+
+
+def compare_samples(baseline, candidate, confidence=0.95):
+    """
+    Ratio candidate / baseline of the geometric mean times, with its
+    confidence interval (Welch t on log times). Returns (ratio, low, high);
+    the interval is nan with fewer than two samples on either side.
+    """
+    from scipy.stats import t
+
+    a = np.log(np.maximum(np.asarray(baseline, dtype=float), 1.0e-9))
+    b = np.log(np.maximum(np.asarray(candidate, dtype=float), 1.0e-9))
+
+    difference = b.mean() - a.mean()
+    if a.shape[0] < 2 or b.shape[0] < 2:
+        return math.exp(difference), float("nan"), float("nan")
+
+    va, vb = a.var(ddof=1) / a.shape[0], b.var(ddof=1) / b.shape[0]
+    se = math.sqrt(va + vb)
+    if se == 0:
+        return math.exp(difference), math.exp(difference), math.exp(difference)
+
+    dof = (va + vb) ** 2 / (va**2 / (a.shape[0] - 1) + vb**2 / (b.shape[0] - 1))
+    half_width = t.ppf(0.5 + confidence / 2, dof) * se
+
+    return math.exp(difference), math.exp(difference - half_width), math.exp(difference + half_width)
+
+
+def compare(baseline_file, candidate_file, confidence=0.95, threshold=0.05):
+    """
+    Text report of every phase present in both files, and the list of
+    significant slowdowns as (benchmark, phase, ratio, low, high).
+    """
+    baseline, candidate = timing_samples(baseline_file), timing_samples(candidate_file)
+
+    header = (
+        f"{'phase':>26} {'n':>5} {'baseline [s]':>13} {'candidate [s]':>14} "
+        f"{'ratio':>7} {f'{confidence:.0%} interval':>17}"
+    )
+    lines = []
+    slowdowns = []
+
+    for key in sorted(set(baseline) & set(candidate)):
+        benchmark, parameters, nprocs = key
+        lines += [f"{benchmark} {parameters} np {nprocs}", header]
+        for phase in sorted(set(baseline[key]) & set(candidate[key])):
+            a, b = baseline[key][phase], candidate[key][phase]
+            ratio, low, high = compare_samples(a, b, confidence)
+
+            mark = ""
+            if low > 1 + threshold:
+                mark = "  SLOWER"
+                slowdowns.append((benchmark, phase, ratio, low, high))
+            elif high < 1 / (1 + threshold):
+                mark = "  faster"
+
+            lines.append(
+                f"{phase:>26} {len(a):>2}/{len(b):<2} {np.median(a):>13.3f} "
+                f"{np.median(b):>14.3f} {ratio:>7.3f} [{low:>6.3f}, {high:>6.3f}]{mark}"
+            )
+        lines.append("")
+
+    for key in sorted(set(baseline) ^ set(candidate)):
+        lines.append(f"{key[0]} {key[1]} np {key[2]}: only in {'baseline' if key in baseline else 'candidate'}")
+
+    return "\n".join(lines), slowdowns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmarks repeatedly and compare their phase timings.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run scripts several times, recording their timings")
+    run.add_argument("scripts", nargs="+", help="benchmark scripts (run from their own directory)")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--label", default="baseline", help="results go to perf_LABEL.jsonl")
+    run.add_argument("--file", default=None, help="results file, instead of perf_LABEL.jsonl")
+    run.add_argument("--options", default="", help="extra PETSc options passed to every run")
+    run.add_argument("--np", type=int, default=1, dest="nprocs")
+    run.add_argument("--python", default=None, help="interpreter to run the scripts with (another underworld3 install)")
+
+    comparison = commands.add_parser("compare", help="compare the timings of two results files")
+    comparison.add_argument("baseline")
+    comparison.add_argument("candidate")
+    comparison.add_argument("--confidence", type=float, default=0.95)
+    comparison.add_argument("--threshold", type=float, default=0.05, help="smallest relative slowdown reported")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        filename = run_repeats(args.scripts, args.repeat, args.file or f"perf_{args.label}.jsonl",
+                               args.options, args.nprocs, args.python)
+        print(f"Timings recorded in {filename}")
+        return
+
+    report, slowdowns = compare(args.baseline, args.candidate, args.confidence, args.threshold)
+    print(report)
+
+    if slowdowns:
+        raise SystemExit(
+            "Significant slowdowns: "
+            + ", ".join(f"{benchmark} {phase} x{ratio:.2f}" for benchmark, phase, ratio, _, _ in slowdowns)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+PETSc log stages for the benchmark phases, and a parser for `-log_view`.
+
+With `PhaseProfiler(log_stages=True)` every phase is also a PETSc log stage
+(pushed on entry, popped on exit), so the assembly, solve and communication
+events are reported per phase rather than all under "Main Stage". At the
+end of a run `log_view_summary` writes the PETSc log to a file, parses it
+and returns the per-stage table (time, flop, messages, message lengths,
+reductions) and the events of each stage, which the scripts store with the
+run results (`check_results(..., petsc_log=...)`).
+
+The parser also reads the output of a run made with `-log_view :file.txt`:
+
+    python -m benchmark_utils.petsc_log file.txt
+    python -m benchmark_utils.petsc_log file.txt --events 10
+"""
+
+import argparse
+import json
+import os
+import re
+
+_NUMBER = r"([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)"
+_STAGE_LINE = re.compile(
+    r"^\s*(\d+):\s+(.+?):" + r"\s+".join([""] + [_NUMBER + r"\s+" + _NUMBER + "%"] * 5) + r"\s*$"
+)
+_EVENT_STAGE = re.compile(r"^--- Event Stage (\d+): (.+)$")
+_STAGE_FIELDS = ("time", "flop", "messages", "message_length", "reductions")
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+def parse_log_view(text):
+    """
+    The stage summary and the per-stage events of a PETSc `-log_view` report.
+
+    Returns {"stages": {stage: {"time", "time_pct", "flop", "flop_pct",
+    "messages", "messages_pct", "message_length", "message_length_pct",
+    "reductions", "reductions_pct"}}, "events": {stage: {event: {"count",
+    "time", "flop", "messages", "reductions", "mflops"}}}}. Times and flop
+    are the averages (stages) or maxima (events) over the ranks, as PETSc
+    reports them.
+    """
+    stages = {}
+    events = {}
+
+    in_summary = False
+    stage = None
+
+    for line in text.splitlines():
+        if line.startswith("Summary of Stages:"):
+            in_summary = True
+            continue
+
+        if in_summary:
+            match = _STAGE_LINE.match(line)
+            if match:
+                values = match.groups()[2:]
+                entry = {}
+                for i, field in enumerate(_STAGE_FIELDS):
+                    entry[field] = _float(values[2 * i])
+                    entry[f"{field}_pct"] = _float(values[2 * i + 1])
+                stages[match.group(2).strip()] = entry
+                continue
+            if stages and not line.strip():
+                in_summary = False
+            continue
+
+        ### the object counts that follow are listed per stage too
+        if line.startswith("Object Type"):
+            break
+
+        match = _EVENT_STAGE.match(line.strip())
+        if match:
+            stage = match.group(2).strip()
+            events[stage] = {}
+            continue
+
+        if stage is None:
+            continue
+
+        if line.startswith("---") or line.startswith("===") or not line.strip():
+            if line.startswith("==="):
+                stage = None
+            continue
+
+        ### Event Count Ratio Time Ratio Flop Ratio Mess AvgLen Reduct %T %F %M %L %R %T %F %M %L %R Mflop/s
+        tokens = line.split()
+        if len(tokens) < 10 or not tokens[1].isdigit():
+            continue
+
+        events[stage][tokens[0]] = {
+            "count": int(tokens[1]),
+            "time": _float(tokens[3]),
+            "flop": _float(tokens[5]),
+            "messages": _float(tokens[7]),
+            "reductions": _float(tokens[9]),
+            "mflops": _float(tokens[-1]),
+        }
+
+    return {"stages": stages, "events": events}
+
+
+def log_view_summary(filename="petsc_log_view.txt"):
+    """
+    Write the PETSc log of the run so far to `filename` and return it
+    parsed (see `parse_log_view`). Collective; every rank gets the result.
+    Logging has to be on, which `PhaseProfiler(log_stages=True)` or the
+    `-log_view` option ensure.
+    """
+    import underworld3 as uw
+    from petsc4py import PETSc
+
+    if uw.mpi.rank == 0:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    uw.mpi.comm.barrier()
+
+    viewer = PETSc.Viewer().createASCII(filename, comm=PETSc.COMM_WORLD)
+    PETSc.Log.view(viewer)
+    viewer.destroy()
+
+    summary = None
+    if uw.mpi.rank == 0:
+        with open(filename) as f:
+            summary = parse_log_view(f.read())
+
+    return uw.mpi.comm.bcast(summary, root=0)
+
+
+def stage_table(summary, events=0):
+    """Text table of the stages, optionally with the `events` most expensive events of each."""
+    lines = [
+        f"{'stage':>26} {'time [s]':>10} {'%T':>5} {'flop':>10} {'%F':>5} {'Mflop/s':>9} "
+        f"{'messages':>10} {'%M':>5} {'reductions':>10}"
+    ]
+    for name, stage in summary["stages"].items():
+        mflops = stage["flop"] / stage["time"] / 1.0e6 if stage["time"] > 0 else 0.0
+        lines.append(
+            f"{name:>26} {stage['time']:>10.3e} {stage['time_pct']:>5.1f} {stage['flop']:>10.3e} "
+            f"{stage['flop_pct']:>5.1f} {mflops:>9.1f} {stage['messages']:>10.3e} "
+            f"{stage['messages_pct']:>5.1f} {stage['reductions']:>10.3e}"
+        )
+
+        if events:
+            top = sorted(summary["events"].get(name, {}).items(), key=lambda item: -item[1]["time"])[:events]
+            for event, values in top:
+                lines.append(
+                    f"{'':>8}{event:>18} {values['time']:>10.3e} {'':>5} {values['flop']:>10.3e} {'':>5} "
+                    f"{values['mflops']:>9.1f} {values['messages']:>10.3e} {'':>5} {values['reductions']:>10.3e}"
+                )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage table of a PETSc -log_view report.")
+    parser.add_argument("file", help="output of a run with -log_view :FILE")
+    parser.add_argument("--events", type=int, default=0, help="also list the N most expensive events of each stage")
+    parser.add_argument("--json", action="store_true", help="print the parsed report as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.file) as f:
+        summary = parse_log_view(f.read())
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(stage_table(summary, args.events))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Particle population control: keep the number of particles per cell in a band.
+
+Advected over many steps, particles crowd into cells of converging flow and
+drain out of diverging ones, so some cells end up with no particle to give
+their proxies a value while others hold many times the initial count, and
+the proxy projections and the advection cost per rank drift apart.
+`recycle_rate` of the swarm re-seeds particles on a schedule but does not
+look at the counts. `PopulationControl` counts the particles in each owned
+cell (the swarm's cell index) and
+
+- adds particles at random points of the cells with fewer than
+  `min_per_cell`, each taking the values of all the swarm variables
+  (material index, strain, ...) from the nearest existing particle,
+- removes the excess from the cells with more than `max_per_cell`,
+  starting with the particles closest to a neighbour in the same cell with
+  the same values of `preserve` (so the material interfaces keep their
+  particles), i.e. the most redundant ones merge into that neighbour:
+
+    population = PopulationControl(swarm, min_per_cell=4, max_per_cell=16, preserve=[material])
+
+    swarm.advection(stokes.u.sym, dt)
+    population.apply()                      # {"added", "removed"} over all ranks
+    population.cell_counts()                # (min, mean, max) particles per cell
+
+It only changes the local particles of each rank. The removed particles go
+in one pass (the kept ones are moved to the front of every swarm field and
+the swarm is shrunk). `apply` is collective, as the new particles are added
+and the swarm migrated (which also refreshes the proxies) on every rank,
+also on those with nothing to add.
+"""
+
+import numpy as np
+from mpi4py import MPI
+
+import underworld3 as uw
+
+from .restart import add_particles
+from .topology import _ghost_points, local_cells
+
+### the fields PETSc registers on a PIC swarm, besides those of the swarm variables
+_PIC_FIELDS = ("DMSwarmPIC_coor", "DMSwarm_cellid", "DMSwarm_rank", "DMSwarm_pid")
+
+
+class PopulationControl:
+    """
+    Add particles to the owned cells of `swarm` with fewer than
+    `min_per_cell` and remove them from those with more than
+    `max_per_cell`. `preserve` are the swarm variables (material index)
+    a removed particle must share with the neighbour it merges into; a
+    cell gives up at most one particle of each nearest pair per pass, so
+    the removal is repeated up to `passes` times.
+    """
+
+    def __init__(self, swarm, min_per_cell, max_per_cell, preserve=(), seed=0, passes=4):
+        if min_per_cell > max_per_cell:
+            raise ValueError(f"min_per_cell ({min_per_cell}) is larger than max_per_cell ({max_per_cell})")
+
+        self.swarm = swarm
+        self.mesh = swarm.mesh
+        self.min_per_cell = min_per_cell
+        self.max_per_cell = max_per_cell
+        self.preserve = list(preserve)
+        self.passes = passes
+
+        self._rng = np.random.default_rng([seed, uw.mpi.rank])
+        self.counters = {"calls": 0, "added": 0, "removed": 0}
+
+        dm = self.mesh.dm
+        cStart, _ = dm.getHeightStratum(0)
+        ghosts = _ghost_points(dm)
+        cells = local_cells(self.mesh)
+        self._owned = np.array([c + cStart not in ghosts for c in range(cells.shape[0])], dtype=bool)
+
+    def _particle_cells(self):
+        """Local cell of each local particle (-1 if unknown)."""
+        dm = self.swarm.dm
+        cellid = np.array(dm.getField("DMSwarm_cellid")).reshape(-1).astype(np.int64)
+        dm.restoreField("DMSwarm_cellid")
+
+        cellid[(cellid < 0) | (cellid >= self._owned.size)] = -1
+        return cellid
+
+    def _counts(self, cellid):
+        return np.bincount(cellid[cellid >= 0], minlength=self._owned.size)
+
+    def cell_counts(self):
+        """(min, mean, max) of the particles per owned cell over all ranks. Collective."""
+        counts = self._counts(self._particle_cells())[self._owned]
+        comm = uw.mpi.comm
+
+        low = comm.allreduce(int(counts.min()) if counts.size else np.iinfo(np.int64).max, op=MPI.MIN)
+        high = comm.allreduce(int(counts.max()) if counts.size else 0, op=MPI.MAX)
+        total = comm.allreduce(int(counts.sum()))
+        n_cells = comm.allreduce(int(counts.size))
+
+        return low, total / max(n_cells, 1), high
+
+    def _removals(self, coords, cellid, counts, preserved):
+        """Indices of the particles to remove from the over-populated cells (sorted), one pass."""
+        from scipy.spatial import cKDTree
+
+        excess = np.where(self._owned, counts - self.max_per_cell, 0)
+        crowded = (cellid >= 0) & (excess[np.maximum(cellid, 0)] > 0)
+        if not crowded.any():
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = np.flatnonzero(crowded)
+        distance, neighbour = cKDTree(coords).query(coords[candidates], k=2)
+        nearest, distance = neighbour[:, 1], distance[:, 1]
+
+        ### merge only into a neighbour in the same cell with the same material
+        same = cellid[nearest] == cellid[candidates]
+        same &= np.all(preserved[nearest] == preserved[candidates], axis=1)
+
+        ### of two particles that are each other's nearest, only the lower index may go
+        paired = np.full(coords.shape[0], -1, dtype=np.int64)
+        paired[candidates] = nearest
+        same &= ~((paired[nearest] == candidates) & (candidates > nearest))
+        candidates, distance = candidates[same], distance[same]
+
+        ### the closest pairs first, up to the excess of each cell
+        order = np.lexsort((distance, cellid[candidates]))
+        candidates = candidates[order]
+        cells = cellid[candidates]
+        first = np.searchsorted(cells, cells, side="left")
+        rank_in_cell = np.arange(cells.size) - first
+
+        return np.sort(candidates[rank_in_cell < excess[cells]])
+
+    def _compact(self, keep):
+        """Remove the local particles that are not in `keep`: move the kept ones to the front of every field and shrink the swarm."""
+        n_keep = int(keep.sum())
+        if n_keep == keep.size:
+            return
+
+        dm = self.swarm.dm
+        for name in list(_PIC_FIELDS) + [var.clean_name for var in self.swarm.vars.values()]:
+            field = dm.getField(name)
+            data = field.reshape(keep.size, -1)
+            data[:n_keep] = data[keep]
+            dm.restoreField(name)
+
+        dm.setLocalSizes(n_keep, -1)
+
+    def _additions(self, coords, counts):
+        """(coordinates, nearest existing particle) of the particles to add to the under-populated cells."""
+        from scipy.spatial import cKDTree
+
+        deficit = np.where(self._owned, self.min_per_cell - counts, 0)
+        deficit = np.maximum(deficit, 0)
+        if deficit.sum() == 0 or coords.shape[0] == 0:
+            return np.zeros((0, self.mesh.dim)), np.zeros(0, dtype=np.int64)
+
+        cells = local_cells(self.mesh)
+        with self.mesh.access():
+            vertices = np.asarray(self.mesh.data)[:, 0 : self.mesh.dim]
+
+        ### random convex combinations of the corners lie inside the (convex) cells
+        parent_cells = np.repeat(np.arange(cells.shape[0]), deficit)
+        weights = self._rng.dirichlet(np.ones(cells.shape[1]), size=parent_cells.size)
+        new_coords = np.einsum("pc,pcd->pd", weights, vertices[cells[parent_cells]])
+
+        _, nearest = cKDTree(coords).query(new_coords, k=1)
+        return new_coords, np.asarray(nearest).reshape(-1)
+
+    def apply(self):
+        """Add and remove particles to bring every owned cell into the band. Collective; returns the global counts."""
+        swarm = self.swarm
+        cellid = self._particle_cells()
+        counts = self._counts(cellid)
+
+        with swarm.access():
+            coords = np.array(swarm.data[:, 0 : self.mesh.dim])
+            preserved = np.column_stack(
+                [np.zeros(coords.shape[0])] + [var.data.reshape(coords.shape[0], -1) for var in self.preserve]
+            )
+
+        keep = np.ones(coords.shape[0], dtype=bool)
+        for _ in range(self.passes):
+            alive = np.flatnonzero(keep)
+            if alive.size < 2:
+                break
+            removed = alive[self._removals(coords[alive], cellid[alive], counts, preserved[alive])]
+            if removed.size == 0:
+                break
+            keep[removed] = False
+            counts = counts - np.bincount(cellid[removed], minlength=counts.size)
+        remove = np.flatnonzero(~keep)
+
+        new_coords, parents = self._additions(coords[keep], counts)
+        parents = np.flatnonzero(keep)[parents]
+
+        ### values of the new particles, copied before the removals renumber the particles
+        swarm_vars = list(swarm.vars.values())
+        with swarm.access():
+            values = {var: np.array(var.data[parents]) for var in swarm_vars}
+
+        self._compact(keep)
+
+        ### collective, also with no particles to add on this rank
+        accepted = add_particles(swarm, new_coords, values)
+
+        ### migrate, and let the variables know the particles changed
+        with swarm.access(swarm.particle_coordinates):
+            pass
+
+        comm = uw.mpi.comm
+        added = comm.allreduce(int(accepted.sum()))
+        removed = comm.allreduce(int(remove.size))
+
+        self.counters["calls"] += 1
+        self.counters["added"] += added
+        self.counters["removed"] += removed
+
+        return {"added": added, "removed": removed}
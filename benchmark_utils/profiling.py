@@ -0,0 +1,113 @@
+"""
+Phase timing for the benchmark scripts.
+
+A `PhaseProfiler` accumulates the wall time of named phases of a run,
+
+    profiler = PhaseProfiler()
+
+    with profiler.phase('solve'):
+        stokes.solve()
+
+and `profiler.timings` ({phase: seconds}) is what the scripts pass to
+`benchmark_utils.regression.check_results`, so every run leaves a record of
+its phase timings in the results store, and `benchmark_utils.perfcompare`
+compares their distributions between two sets of runs. The phase names used
+across the scripts are
+
+    solve       - solves (named per solver, e.g. stokes, advection_diffusion,
+                  when a script has more than one)
+    first_solve - the first solve of a solver, kept apart as it includes the
+                  solver setup (JIT compilation of the pointwise functions)
+    advection   - swarm advection
+    diagnostics - v_rms, Nusselt number, tracer positions, reference checks
+    io          - checkpoints and saved fields
+
+and, where a script profiles its construction, mesh, variables, swarm
+(populate) and projections. With `memory=True` each phase also records the
+memory use of the rank at its end (see benchmark_utils/memory.py), and with
+`log_stages=True` each phase is a PETSc log stage, so `-log_view` (or
+`benchmark_utils.petsc_log.log_view_summary`) breaks the PETSc events down
+by phase. Phases can be nested; the time of an inner phase is then
+counted in the outer one too.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+
+from .memory import memory_snapshot
+
+
+class PhaseProfiler:
+    """
+    Accumulated wall time and call count of named phases, and with
+    `memory=True` the largest memory snapshot taken at the end of each
+    phase (`self.memory`), plus one taken on construction
+    (`self.memory_baseline`). With `log_stages=True` each phase is pushed
+    as a PETSc log stage of the same name.
+    """
+
+    def __init__(self, memory=False, log_stages=False):
+        self.timings = {}
+        self.counts = {}
+        self.last = {}
+
+        self.track_memory = memory
+        self.memory = {}
+        self.memory_baseline = memory_snapshot() if memory else None
+
+        self.log_stages = log_stages
+        self._stages = {}
+        if log_stages:
+            from petsc4py import PETSc
+
+            ### make sure PETSc collects the events even without -log_view
+            PETSc.Log.begin()
+
+    def _stage(self, name):
+        if name not in self._stages:
+            from petsc4py import PETSc
+
+            self._stages[name] = PETSc.Log.Stage(name)
+        return self._stages[name]
+
+    @contextmanager
+    def phase(self, name):
+        stage = self._stage(name) if self.log_stages else None
+        if stage is not None:
+            stage.push()
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+            if stage is not None:
+                stage.pop()
+            if self.track_memory:
+                self._record_memory(name)
+
+    def _record_memory(self, name):
+        snapshot = memory_snapshot()
+        previous = self.memory.get(name)
+        if previous is not None:
+            snapshot = {key: max(value, previous[key]) for key, value in snapshot.items()}
+        self.memory[name] = snapshot
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.last[name] = seconds
+
+    def total(self, *names):
+        """Summed time of the given phases (of all phases if none are given)."""
+        names = names or tuple(self.timings)
+        return sum(self.timings.get(name, 0.0) for name in names)
+
+    def table(self):
+        total = sum(self.timings.values())
+        lines = [f"{'phase':>20} {'calls':>7} {'time [s]':>10} {'fraction':>9}"]
+        for name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            fraction = seconds / total if total > 0 else 0.0
+            lines.append(f"{name:>20} {self.counts[name]:>7d} {seconds:>10.3f} {fraction:>9.1%}")
+
+        return "\n".join(lines)
@@ -0,0 +1,303 @@
+"""
+Regression database of benchmark outputs, with tolerance bands.
+
+At the end of a run each benchmark script calls `check_results` with its
+key scalar outputs (sinking velocity, pressure error, Nusselt number, neck
+width, ...) and the timings of its main phases. The run is appended as one
+JSON line to the results store and compared against
+
+- golden values, `regression/golden.json`, with a tolerance per metric
+  (`|value - golden| <= atol + rtol * |golden|`, as `np.isclose`). A metric
+  outside its band is an accuracy regression and raises a RuntimeError,
+  replacing the hand-written `np.isclose`/`np.allclose` checks.
+- earlier runs of the same benchmark with the same parameters, number of
+  ranks and host. A phase slower than `max_slowdown` times the median of
+  the recent runs is reported as a performance regression (a warning, as
+  timings are noisy).
+
+Metrics without a golden value are only recorded. A golden entry may give
+only the tolerance (no "value"), for a metric whose reference has to come
+from a trusted run; it is checked once promoted. Once a run is trusted its
+values can be promoted (keeping tolerances already in the golden file):
+
+    python -m benchmark_utils.regression                      # latest run of each benchmark
+    python -m benchmark_utils.regression --benchmark Sinker --history
+    python -m benchmark_utils.regression --update-golden TALA --rtol 1e-3
+
+(from the repository root). In the scripts the store, golden file and
+slowdown factor can be changed with the `-regression_file`,
+`-regression_golden` and `-regression_max_slowdown` options.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import socket
+import subprocess
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(REPO_ROOT, "regression", "results.jsonl")
+GOLDEN_FILE = os.path.join(REPO_ROOT, "regression", "golden.json")
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    return out.stdout.strip() or None
+
+
+def _parameters_key(parameters):
+    return json.dumps(parameters, sort_keys=True, default=str)
+
+
+def within_tolerance(value, golden):
+    """Whether `value` is within the band {"value", "rtol", "atol"} of a golden metric."""
+    reference = golden["value"]
+    if value is None or not math.isfinite(value):
+        return False
+
+    return abs(value - reference) <= golden.get("atol", 0.0) + golden.get("rtol", 0.0) * abs(reference)
+
+
+class RegressionDatabase:
+    """The results store (one JSON line per run) and the golden values."""
+
+    def __init__(self, results_file=RESULTS_FILE, golden_file=GOLDEN_FILE):
+        self.results_file = results_file
+        self.golden_file = golden_file
+
+        self.runs = []
+        if os.path.exists(results_file):
+            with open(results_file) as f:
+                self.runs = [json.loads(line) for line in f if line.strip()]
+
+        self.golden = {}
+        if os.path.exists(golden_file):
+            with open(golden_file) as f:
+                self.golden = json.load(f)
+
+    def history(self, benchmark, parameters=None, nprocs=None, host=None):
+        """Earlier runs of `benchmark`, oldest first, optionally of the same configuration."""
+        runs = [run for run in self.runs if run["benchmark"] == benchmark]
+        if parameters is not None:
+            key = _parameters_key(parameters)
+            runs = [run for run in runs if _parameters_key(run["parameters"]) == key]
+        if nprocs is not None:
+            runs = [run for run in runs if run["nprocs"] == nprocs]
+        if host is not None:
+            runs = [run for run in runs if run["host"] == host]
+
+        return runs
+
+    def latest(self, benchmark):
+        runs = self.history(benchmark)
+        return runs[-1] if runs else None
+
+    def compare_accuracy(self, benchmark, metrics):
+        """{metric: (value, golden)} for every metric outside its golden band."""
+        golden = self.golden.get(benchmark, {}).get("metrics", {})
+
+        return {
+            name: (metrics.get(name), band)
+            for name, band in golden.items()
+            if "value" in band and not within_tolerance(metrics.get(name), band)
+        }
+
+    def compare_timings(self, benchmark, timings, parameters, nprocs, host, max_slowdown=None, window=5, min_seconds=0.5):
+        """
+        {phase: (time, baseline)} for every phase slower than `max_slowdown`
+        times the median of the last `window` passing runs of the same
+        configuration (and slower by at least `min_seconds`).
+        """
+        if max_slowdown is None:
+            max_slowdown = self.golden.get(benchmark, {}).get("max_slowdown", 1.5)
+
+        previous = [
+            run for run in self.history(benchmark, parameters, nprocs, host) if not run["regressions"]["accuracy"]
+        ][-window:]
+
+        slow = {}
+        for phase, seconds in timings.items():
+            times = [run["timings"][phase] for run in previous if phase in run["timings"]]
+            if not times:
+                continue
+            baseline = float(np.median(times))
+            if seconds > max_slowdown * baseline and seconds - baseline > min_seconds:
+                slow[phase] = (seconds, baseline)
+
+        return slow
+
+    def record(self, run):
+        os.makedirs(os.path.dirname(os.path.abspath(self.results_file)), exist_ok=True)
+        with open(self.results_file, "a") as f:
+            f.write(json.dumps(run, default=float) + "\n")
+        self.runs.append(run)
+
+    def update_golden(self, benchmark, rtol=1.0e-6, atol=0.0, metrics=None):
+        """
+        Promote the metrics of the latest run of `benchmark` to golden values.
+        Metrics already in the golden file keep their tolerances.
+        """
+        run = self.latest(benchmark)
+        if run is None:
+            raise ValueError(f"No recorded runs of {benchmark}")
+
+        entry = self.golden.setdefault(benchmark, {})
+        golden = entry.setdefault("metrics", {})
+        for name, value in run["metrics"].items():
+            if metrics is not None and name not in metrics:
+                continue
+            band = golden.get(name, {"rtol": rtol, "atol": atol})
+            band["value"] = value
+            golden[name] = band
+        entry["source"] = f"run of {run['timestamp']} (commit {run['commit']})"
+
+        with open(self.golden_file, "w") as f:
+            json.dump(self.golden, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+        return golden
+
+    def table(self, benchmarks=None, history=False):
+        """Text summary of the latest (or every) run of each benchmark against the golden values."""
+        if benchmarks is None:
+            benchmarks = sorted({run["benchmark"] for run in self.runs} | set(self.golden))
+
+        lines = []
+        for benchmark in benchmarks:
+            runs = self.history(benchmark)
+            if not history:
+                runs = runs[-1:]
+            golden = self.golden.get(benchmark, {}).get("metrics", {})
+
+            lines.append(benchmark)
+            if not runs:
+                lines.append("  no recorded runs")
+            for run in runs:
+                status = "FAIL" if run["regressions"]["accuracy"] else "ok"
+                if run["regressions"]["performance"]:
+                    status += ", slower"
+                lines.append(
+                    f"  {run['timestamp']} commit {run['commit']} np {run['nprocs']} "
+                    f"{_parameters_key(run['parameters'])} [{status}]"
+                )
+                for name, value in run["metrics"].items():
+                    line = f"    {name:>30} {value:>14.6g}"
+                    if "value" in golden.get(name, {}):
+                        band = golden[name]
+                        mark = "ok" if within_tolerance(value, band) else "OUTSIDE"
+                        line += f"   golden {band['value']:.6g} (rtol {band.get('rtol', 0):g}, atol {band.get('atol', 0):g}) {mark}"
+                    lines.append(line)
+                for phase, seconds in run["timings"].items():
+                    lines.append(f"    {phase + ' [s]':>30} {seconds:>14.3f}")
+            lines.append("")
+
+        return "\n".join(lines)
+
+
+def check_results(benchmark, metrics, timings=None, memory=None, petsc_log=None, raise_on_failure=True, **parameters):
+    """
+    Record a run of `benchmark` and compare it with the golden values and
+    with earlier runs.
+
+    metrics    - {name: value}, the key scalar outputs of the run
+    timings    - {phase: seconds}, e.g. {"solve": ..., "advection": ...}
+    memory     - memory report of the run (benchmark_utils.memory.memory_report)
+    petsc_log  - per-stage PETSc log (benchmark_utils.petsc_log.log_view_summary)
+    parameters - the configuration of the run (resolution, degrees, ...);
+                 timings are only compared between runs with the same
+                 parameters
+
+    Called on every rank with the same values; only rank 0 writes. Raises a
+    RuntimeError if a metric is outside its golden band (unless
+    `raise_on_failure` is False) and returns the recorded run.
+    """
+    import underworld3 as uw
+
+    metrics = {name: float(value) for name, value in metrics.items()}
+    timings = {phase: float(seconds) for phase, seconds in (timings or {}).items()}
+
+    database = RegressionDatabase(
+        uw.options.getString("regression_file", default=RESULTS_FILE),
+        uw.options.getString("regression_golden", default=GOLDEN_FILE),
+    )
+    max_slowdown = uw.options.getReal("regression_max_slowdown", default=-1.0)
+    host = socket.gethostname()
+
+    failed = database.compare_accuracy(benchmark, metrics)
+    slow = database.compare_timings(
+        benchmark, timings, parameters, uw.mpi.size, host, max_slowdown=max_slowdown if max_slowdown > 0 else None
+    )
+
+    run = {
+        "benchmark": benchmark,
+        "parameters": parameters,
+        "metrics": metrics,
+        "timings": timings,
+        "memory": memory,
+        "petsc_log": petsc_log,
+        "regressions": {"accuracy": sorted(failed), "performance": sorted(slow)},
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit() if uw.mpi.rank == 0 else None,
+        "underworld3": getattr(uw, "__version__", None),
+        "host": host,
+        "nprocs": uw.mpi.size,
+    }
+
+    if uw.mpi.rank == 0:
+        database.record(run)
+
+        for name, (value, band) in failed.items():
+            print(f"{benchmark}: accuracy regression, {name} = {value} (golden {band['value']}, "
+                  f"rtol {band.get('rtol', 0)}, atol {band.get('atol', 0)})", flush=True)
+        for phase, (seconds, baseline) in slow.items():
+            print(f"{benchmark}: performance regression, {phase} took {seconds:.3f} s "
+                  f"(median of previous runs {baseline:.3f} s)", flush=True)
+
+    if failed and raise_on_failure:
+        raise RuntimeError(f"{benchmark}: {', '.join(sorted(failed))} outside the golden tolerance")
+
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise the benchmark regression database.")
+    parser.add_argument("--file", default=RESULTS_FILE)
+    parser.add_argument("--golden", default=GOLDEN_FILE)
+    parser.add_argument("--benchmark", action="append", default=None, help="only these benchmarks")
+    parser.add_argument("--history", action="store_true", help="every run, not just the latest")
+    parser.add_argument("--update-golden", default=None, metavar="BENCHMARK",
+                        help="promote the latest run of BENCHMARK to golden values")
+    parser.add_argument("--metric", action="append", default=None, help="with --update-golden, only these metrics")
+    parser.add_argument("--rtol", type=float, default=1.0e-6, help="tolerance for newly promoted metrics")
+    parser.add_argument("--atol", type=float, default=0.0, help="tolerance for newly promoted metrics")
+    args = parser.parse_args(argv)
+
+    database = RegressionDatabase(args.file, args.golden)
+
+    if args.update_golden is not None:
+        golden = database.update_golden(args.update_golden, args.rtol, args.atol, args.metric)
+        print(f"Golden values of {args.update_golden}: {json.dumps(golden, indent=2, sort_keys=True)}")
+        return
+
+    print(database.table(args.benchmark, args.history))
+
+    failing = [
+        benchmark for benchmark in {run["benchmark"] for run in database.runs}
+        if database.latest(benchmark)["regressions"]["accuracy"]
+    ]
+    if failing:
+        raise SystemExit(f"Latest run outside the golden tolerance: {', '.join(sorted(failing))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Offscreen rendering of the benchmark checkpoints.
+
+The plotting functions in the scripts only run in serial and show the
+figures interactively, so parallel runs produce no figures. This module
+renders PNGs from the per-rank files written by
+`benchmark_utils.checkpoint.AsyncCheckpointWriter` with pyvista in
+off_screen mode, one step per worker process. It does not import
+underworld, so it can run after the simulation:
+
+    python -m benchmark_utils.rendering ./output/ --views views.json
+
+or alongside it, started from rank 0 with `BackgroundRenderer`, in which
+case it polls the output directory and renders each checkpoint once every
+rank has written it.
+
+A view is a dict:
+
+    {"name": "temperature", "field": "T"}                       mesh variable
+    {"name": "viscosity", "field": "viscosity", "log": True}     log10 of a mesh variable
+    {"name": "velocity", "arrows": "U", "field": "T"}            arrows (over an optional field)
+    {"name": "material", "swarm": "swarm", "variable": "M"}      swarm variable at the particles
+
+with optional "cmap", "clim", "mag" (arrow scale), "max_arrows", "point_size"
+and "show_edges". Figures are written to `{figurePath}/{name}_{step:05d}.png`;
+existing figures are not rendered again.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+import h5py
+
+
+def checkpoint_steps(outputPath, prefix="checkpoint"):
+    """{step: [files]} of the checkpoints that are complete on every rank."""
+    pattern = re.compile(re.escape(prefix) + r"_(\d{5})\.(\d{4})\.h5$")
+
+    files = {}
+    for filename in glob.glob(os.path.join(outputPath, f"{prefix}_*.h5")):
+        match = pattern.search(os.path.basename(filename))
+        if match is not None:
+            files.setdefault(int(match.group(1)), {})[int(match.group(2))] = filename
+
+    steps = {}
+    for step, ranks in sorted(files.items()):
+        with h5py.File(ranks[min(ranks)], "r") as h5:
+            nprocs = int(h5.attrs["nprocs"])
+        if len(ranks) == nprocs:
+            steps[step] = [ranks[rank] for rank in range(nprocs)]
+
+    return steps
+
+
+def _field_at_vertices(h5, name):
+    """Mesh variable `name` at the vertices of this rank's file."""
+    from scipy.spatial import cKDTree
+
+    vertices = h5["geometry/vertices"][...]
+    coords = h5[f"mesh/{name}/coords"][...]
+    data = h5[f"mesh/{name}/data"][...]
+
+    ### the vertices are a subset of the variable's nodes, so the nearest node is an exact match
+    _, index = cKDTree(coords).query(vertices[:, 0 : coords.shape[1]])
+
+    return data[index]
+
+
+def read_checkpoint(files, fields=(), arrows=(), swarms=()):
+    """
+    Merge the per-rank files of one checkpoint.
+
+    fields - mesh variables to add to the grid as point data
+    arrows - vector mesh variables, returned at their own nodes
+    swarms - (swarm, variable) pairs, returned as point clouds
+
+    Returns (grid, time, {arrows name: PolyData}, {(swarm, variable): PolyData}).
+    """
+    import pyvista as pv
+
+    grids = []
+    arrow_points = {name: [] for name in arrows}
+    swarm_points = {key: [] for key in swarms}
+
+    for filename in files:
+        with h5py.File(filename, "r") as h5:
+            model_time = float(h5.attrs["time"])
+
+            grid = pv.UnstructuredGrid({int(h5.attrs["vtk_cell_type"]): h5["topology/cells"][...]}, h5["geometry/vertices"][...])
+            for name in fields:
+                values = _field_at_vertices(h5, name)
+                grid.point_data[name] = values[:, 0] if values.shape[1] == 1 else values
+            grids.append(grid)
+
+            for name in arrows:
+                coords = h5[f"mesh/{name}/coords"][...]
+                data = h5[f"mesh/{name}/data"][...]
+                arrow_points[name].append((coords, data))
+
+            for swarm, variable in swarms:
+                group = h5[f"swarms/{swarm}"]
+                swarm_points[(swarm, variable)].append((group["coords"][...], group[variable][...]))
+
+    grid = grids[0].merge(grids[1:]) if len(grids) > 1 else grids[0]
+
+    def _points(blocks, name):
+        coords = np.concatenate([c for c, _ in blocks])
+        data = np.concatenate([d for _, d in blocks])
+
+        points = np.zeros((coords.shape[0], 3))
+        points[:, 0 : coords.shape[1]] = coords
+
+        cloud = pv.PolyData(points)
+        if data.ndim > 1 and data.shape[1] > 1:
+            vectors = np.zeros((data.shape[0], 3))
+            vectors[:, 0 : data.shape[1]] = data
+            cloud.point_data[name] = vectors
+        else:
+            cloud.point_data[name] = data.ravel()
+
+        return cloud
+
+    arrow_clouds = {name: _points(blocks, name) for name, blocks in arrow_points.items()}
+    swarm_clouds = {key: _points(blocks, key[1]) for key, blocks in swarm_points.items()}
+
+    return grid, model_time, arrow_clouds, swarm_clouds
+
+
+def _view_contents(views):
+    fields, arrows, swarms = set(), set(), set()
+    for view in views:
+        if "field" in view:
+            fields.add(view["field"])
+        if "arrows" in view:
+            arrows.add(view["arrows"])
+        if "swarm" in view:
+            swarms.add((view["swarm"], view["variable"]))
+
+    return sorted(fields), sorted(arrows), sorted(swarms)
+
+
+def figure_filename(figurePath, view, step):
+    return os.path.join(figurePath, f"{view['name']}_{step:05d}.png")
+
+
+def render_step(step, files, views, figurePath, window_size=(1000, 1000)):
+    """Render every view of one checkpoint to PNG."""
+    import pyvista as pv
+
+    pv.OFF_SCREEN = True
+
+    views = [view for view in views if not os.path.exists(figure_filename(figurePath, view, step))]
+    if not views:
+        return []
+
+    grid, model_time, arrow_clouds, swarm_clouds = read_checkpoint(files, *_view_contents(views))
+
+    written = []
+    for view in views:
+        pl = pv.Plotter(off_screen=True, window_size=list(window_size))
+        pl.set_background("white")
+
+        cmap = view.get("cmap", "coolwarm")
+
+        if "field" in view:
+            scalars = grid.point_data[view["field"]]
+            if view.get("log", False):
+                scalars = np.log10(np.maximum(scalars, np.finfo(float).tiny))
+            pl.add_mesh(
+                grid,
+                scalars=scalars,
+                cmap=cmap,
+                clim=view.get("clim"),
+                show_edges=view.get("show_edges", False),
+                scalar_bar_args={"title": ("log10 " if view.get("log", False) else "") + view["field"]},
+            )
+        else:
+            pl.add_mesh(grid, color="Black", style="wireframe", opacity=0.25)
+
+        if "swarm" in view:
+            cloud = swarm_clouds[(view["swarm"], view["variable"])]
+            pl.add_points(
+                cloud,
+                scalars=view["variable"],
+                cmap=cmap,
+                clim=view.get("clim"),
+                point_size=view.get("point_size", 2),
+                render_points_as_spheres=False,
+            )
+
+        if "arrows" in view:
+            cloud = arrow_clouds[view["arrows"]]
+            stride = cloud.n_points // view.get("max_arrows", 2000) + 1
+
+            points = cloud.points[::stride]
+            vectors = cloud.point_data[view["arrows"]][::stride]
+
+            ### default arrow scale: the longest arrow spans ~5% of the domain
+            speed = np.linalg.norm(vectors, axis=1).max()
+            mag = view.get("mag", 0.05 * grid.length / speed if speed > 0 else 1.0)
+            pl.add_arrows(points, vectors, mag=mag, color="Black")
+
+        pl.add_text(f"{view['name']}  step {step}  t = {model_time:.4g}", font_size=10, color="Black")
+        pl.camera_position = "xy"
+
+        filename = figure_filename(figurePath, view, step)
+        pl.screenshot(filename + ".tmp.png")
+        pl.close()
+        os.replace(filename + ".tmp.png", filename)
+
+        written.append(filename)
+
+    return written
+
+
+def _render_job(job):
+    return render_step(*job)
+
+
+def render_checkpoints(outputPath, views, figurePath=None, prefix="checkpoint", steps=None, processes=None, window_size=(1000, 1000)):
+    """
+    Render the views of every complete checkpoint in `outputPath` that does
+    not have its figures yet, one step per worker process.
+
+    steps     - only these steps (default all)
+    processes - size of the worker pool (default the number of cores)
+
+    Returns the list of figures written.
+    """
+    from multiprocessing import get_context
+
+    figurePath = figurePath or os.path.join(outputPath, "figures")
+    os.makedirs(figurePath, exist_ok=True)
+
+    jobs = [
+        (step, files, views, figurePath, window_size)
+        for step, files in checkpoint_steps(outputPath, prefix).items()
+        if steps is None or step in steps
+    ]
+    jobs = [job for job in jobs if not all(os.path.exists(figure_filename(figurePath, view, job[0])) for view in views)]
+
+    if not jobs:
+        return []
+
+    if processes == 1 or len(jobs) == 1:
+        written = [_render_job(job) for job in jobs]
+    else:
+        ### spawn rather than fork, the workers each start their own offscreen render context
+        with get_context("spawn").Pool(processes) as pool:
+            written = pool.map(_render_job, jobs)
+
+    return [filename for filenames in written for filename in filenames]
+
+
+def watch(outputPath, views, figurePath=None, prefix="checkpoint", processes=None, interval=10.0, stop_file=None, window_size=(1000, 1000)):
+    """
+    Render new checkpoints as they appear until `stop_file` exists, then
+    render whatever is left and return.
+    """
+    while True:
+        stopping = stop_file is not None and os.path.exists(stop_file)
+
+        render_checkpoints(outputPath, views, figurePath, prefix, processes=processes, window_size=window_size)
+
+        if stopping:
+            return
+
+        time.sleep(interval)
+
+
+class BackgroundRenderer:
+    """
+    Render the checkpoints in a separate process while the model runs.
+
+    Only rank 0 starts the renderer; on the other ranks this does nothing,
+    so it can be created and finished unconditionally in the scripts. The
+    renderer is a new python process (not a fork of the MPI rank) that runs
+    `watch` at low priority on the node of rank 0.
+    """
+
+    def __init__(self, outputPath, views, figurePath=None, prefix="checkpoint", processes=1, interval=10.0, rank=0):
+        self.process = None
+        self.stop_file = os.path.join(outputPath, f"{prefix}_render.stop")
+
+        if rank != 0:
+            return
+
+        if os.path.exists(self.stop_file):
+            os.remove(self.stop_file)
+
+        views_file = os.path.join(outputPath, f"{prefix}_views.json")
+        with open(views_file, "w") as f:
+            json.dump(views, f, indent=1)
+
+        command = [sys.executable, "-m", "benchmark_utils.rendering", outputPath, "--views", views_file,
+                   "--prefix", prefix, "--processes", str(processes), "--watch", "--interval", str(interval),
+                   "--stop-file", self.stop_file]
+        if figurePath is not None:
+            command += ["--figures", figurePath]
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+
+        self.process = subprocess.Popen(command, env=env, preexec_fn=lambda: os.nice(10))
+
+    def finish(self, wait=True):
+        """Ask the renderer to render the remaining checkpoints and stop."""
+        if self.process is None:
+            return
+
+        open(self.stop_file, "w").close()
+
+        if wait:
+            self.process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render benchmark checkpoints to PNG offscreen.")
+    parser.add_argument("outputPath")
+    parser.add_argument("--views", required=True, help="JSON file with the list of views")
+    parser.add_argument("--figures", default=None, help="directory for the PNGs (default outputPath/figures)")
+    parser.add_argument("--prefix", default="checkpoint")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--watch", action="store_true", help="keep rendering new checkpoints until --stop-file exists")
+    parser.add_argument("--interval", type=float, default=10.0)
+    parser.add_argument("--stop-file", default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.views) as f:
+        views = json.load(f)
+
+    if args.watch:
+        watch(args.outputPath, views, args.figures, args.prefix, args.processes, args.interval, args.stop_file)
+    else:
+        for filename in render_checkpoints(args.outputPath, views, args.figures, args.prefix, processes=args.processes):
+            print(filename)
+
+
+if __name__ == "__main__":
+    main()
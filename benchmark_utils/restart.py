@@ -0,0 +1,398 @@
+"""
+Restart discovery and restore for the benchmark scripts.
+
+A small JSON manifest in the output directory records the newest checkpoint
+written by `benchmark_utils.checkpoint.AsyncCheckpointWriter` that is complete
+on every rank (step, time, number of ranks, files and their checksums). It
+is replaced atomically, so a run killed mid-write restarts from the previous
+complete checkpoint rather than whatever file happens to be newest.
+
+Restores read the HDF5 checkpoints directly on every rank: when the run is
+restarted on the same number of ranks each rank reads only its own file.
+Swarms are read as one contiguous slab of particles per rank; particles
+that fall outside the local partition are offered only to the ranks whose
+bounding box contains them, one rank at a time so that none is restored
+twice, so restart time follows the local, not the global, particle count.
+"""
+
+import json
+import os
+
+import numpy as np
+import h5py
+from mpi4py import MPI
+
+import underworld3 as uw
+
+from .checkpoint import file_checksum
+
+
+def _row_view(a):
+    """View each row of a 2D array as a single opaque item (for exact matching)."""
+    a = np.ascontiguousarray(a)
+    return a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1]))).ravel()
+
+
+def _match_rows(sources, targets):
+    """
+    For each row of `targets`, the index of an identical row of `sources`
+    (each source row matched at most once, whatever the order), or -1 if
+    there is none left.
+    """
+    source_rows = _row_view(sources)
+    target_rows = _row_view(targets)
+
+    s_order = np.argsort(source_rows, kind="stable")
+    s_sorted = source_rows[s_order]
+    t_order = np.argsort(target_rows, kind="stable")
+    t_sorted = target_rows[t_order]
+
+    ### the k-th copy of a row among the targets takes the k-th copy among the sources
+    t_first = np.searchsorted(t_sorted, t_sorted, side="left")
+    occurrence = np.arange(t_sorted.size) - t_first
+
+    first = np.searchsorted(s_sorted, t_sorted, side="left")
+    last = np.searchsorted(s_sorted, t_sorted, side="right")
+    position = first + occurrence
+    found = position < last
+
+    match = np.full(target_rows.size, -1, dtype=np.int64)
+    match[t_order[found]] = s_order[position[found]]
+
+    return match
+
+
+def add_particles(swarm, coords, values):
+    """
+    Add particles at `coords` and set their variables from `values`
+    ({SwarmVariable: array}). Particles outside the local domain are
+    rejected by the swarm; returns a boolean mask of the accepted ones.
+
+    Collective (the swarm migrates), so every rank must call it, with an
+    empty `coords` if it has nothing to add. The added particles are found
+    by their coordinates among all the local particles afterwards, as the
+    migration may reorder them: the local rows that are not one of the
+    particles already there are matched to a row of `coords`. A new
+    particle at exactly the position of an existing one is not told apart
+    from it.
+    """
+    dim = swarm.mesh.dim
+    coords = np.ascontiguousarray(np.asarray(coords, dtype=float).reshape(-1, dim))
+
+    with swarm.access():
+        before = np.array(swarm.data[:, 0:dim])
+
+    swarm.add_particles_with_coordinates(coords)
+
+    with swarm.access():
+        after = np.array(swarm.data[:, 0:dim])
+
+    ### sources: the particles that were already here, then the candidates
+    match = _match_rows(np.concatenate([before, coords]), after)
+    rows = np.flatnonzero(match >= before.shape[0])
+    index = match[rows] - before.shape[0]
+
+    accepted = np.zeros(coords.shape[0], dtype=bool)
+    accepted[index] = True
+
+    ### writing the variables updates their proxies (collective), so on every rank
+    if values:
+        with swarm.access(*values.keys()):
+            for var, data in values.items():
+                var.data[rows] = np.asarray(data)[index].reshape(-1, var.data.shape[1])
+
+    return accepted
+
+
+def _balanced_range(total, rank, size):
+    """Contiguous [start, stop) block of `total` items for `rank` of `size`."""
+    counts = np.full(size, total // size)
+    counts[: total % size] += 1
+    start = counts[:rank].sum()
+
+    return start, start + counts[rank]
+
+
+def redistribute_particles(swarm, coords, values):
+    """
+    Add particles that are not local to this rank to their owning ranks.
+
+    Candidate owners are the ranks whose mesh bounding box contains the
+    particle. A particle on a face shared by two partitions may be accepted
+    by both, so each one is offered to a single candidate at a time, the
+    lowest rank first, and only the ones it rejects go on to the next
+    candidate in another round. Only the particles passed in are
+    communicated.
+    """
+    comm = uw.mpi.comm
+    dim = swarm.mesh.dim
+
+    ### every rank's bounding box, padded slightly so particles on the edge are not missed
+    lower = swarm.mesh.data.min(axis=0)
+    upper = swarm.mesh.data.max(axis=0)
+    pad = 1.0e-8 * np.abs(upper - lower).max()
+    boxes = comm.allgather((lower - pad, upper + pad))
+
+    swarmVars = list(values.keys())
+
+    candidates = np.zeros((coords.shape[0], len(boxes)), dtype=bool)
+    for rank, (lo, hi) in enumerate(boxes):
+        candidates[:, rank] = np.all((coords[:, 0:dim] >= lo) & (coords[:, 0:dim] <= hi), axis=1)
+
+    placed = np.zeros(coords.shape[0], dtype=bool)
+    n_added = 0
+    while comm.allreduce(int((~placed & candidates.any(axis=1)).any()), op=MPI.MAX):
+        pending = ~placed & candidates.any(axis=1)
+        target = np.argmax(candidates, axis=1)
+
+        offered = [np.flatnonzero(pending & (target == rank)) for rank in range(len(boxes))]
+        send = [(coords[rows], [values[var][rows] for var in swarmVars]) for rows in offered]
+        received = comm.alltoall(send)
+
+        recv_coords = np.concatenate([c for c, _ in received])
+        recv_values = {var: np.concatenate([v[i] for _, v in received]) for i, var in enumerate(swarmVars)}
+
+        accepted = add_particles(swarm, recv_coords, recv_values)
+        n_added += int(accepted.sum())
+
+        ### tell each sender which of its particles were taken; the rest try their next candidate
+        sizes = [c.shape[0] for c, _ in received]
+        replies = comm.alltoall(np.split(accepted, np.cumsum(sizes)[:-1]))
+        for rank, rows in enumerate(offered):
+            placed[rows[replies[rank]]] = True
+            candidates[rows, rank] = False
+
+    n_lost = comm.allreduce(coords.shape[0]) - comm.allreduce(n_added)
+    if n_lost > 0 and uw.mpi.rank == 0:
+        print(f"Warning: {n_lost} particles could not be placed on any rank")
+
+
+class RestartManager:
+    """
+    Keep and read the restart manifest in `outputPath`.
+
+    `latest` is None for a fresh run, otherwise a dict with the step, time,
+    nprocs, files and checksums of the newest complete checkpoint. The
+    manifest lists the newest `keep` checkpoints; with `keep_checkpoints`
+    it lists at most that many, and the checkpoint files older than those
+    are deleted when the manifest is updated (leave it None while a
+    renderer still reads the older files).
+    """
+
+    def __init__(self, outputPath, name="manifest.json", keep=5, keep_checkpoints=None):
+        self.outputPath = outputPath
+        self.filename = os.path.join(outputPath, name)
+        self.keep = keep
+        self.keep_checkpoints = keep_checkpoints
+        self.comm = uw.mpi.comm
+        self._verified = set()
+
+        manifest = None
+        if uw.mpi.rank == 0 and os.path.exists(self.filename):
+            with open(self.filename) as f:
+                manifest = json.load(f)
+
+        self.manifest = self.comm.bcast(manifest, root=0)
+
+    @property
+    def latest(self):
+        if self.manifest is None:
+            return None
+
+        return self.manifest["latest"]
+
+    def update(self, writer):
+        """
+        Record the newest checkpoint of `writer` that every rank has finished
+        writing. Collective, but never waits on the background writes.
+        """
+        local_latest = max(list(writer.completed), default=-1)
+        step = self.comm.allreduce(local_latest, op=MPI.MIN)
+
+        if step < 0 or (self.latest is not None and step <= self.latest["step"]):
+            return
+
+        time, filename, checksum = writer.completed[step]
+        entries = self.comm.gather((os.path.basename(filename), checksum), root=0)
+
+        manifest = None
+        dropped = []
+        if uw.mpi.rank == 0:
+            entry = {
+                "step": int(step),
+                "time": float(time),
+                "nprocs": uw.mpi.size,
+                "files": [name for name, _ in entries],
+                "checksums": [checksum for _, checksum in entries],
+            }
+
+            history = ([] if self.manifest is None else self.manifest["history"]) + [entry]
+            n_keep = min(self.keep, self.keep_checkpoints or self.keep)
+            manifest = {"latest": entry, "history": history[-n_keep:]}
+            dropped = history[:-n_keep]
+
+            tmp_filename = self.filename + ".tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(tmp_filename, self.filename)
+
+        self.manifest = self.comm.bcast(manifest, root=0)
+
+        if self.keep_checkpoints is not None:
+            self._prune(writer, dropped)
+
+    def _prune(self, writer, dropped):
+        """
+        Delete the checkpoints older than the oldest one in the manifest:
+        each rank its own files written by `writer`, rank 0 all the files
+        of the entries that left the manifest (`dropped`, also from earlier
+        runs).
+        """
+        oldest = self.manifest["history"][0]["step"]
+
+        ### a snapshot of the steps, as the writer thread may be adding one
+        old = [step for step in list(writer.completed) if step < oldest]
+        filenames = [writer.completed.pop(step)[1] for step in old]
+        for entry in dropped:
+            filenames += [os.path.join(self.outputPath, name) for name in entry["files"]]
+
+        for filename in filenames:
+            ### another rank may have just removed it
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    def _files(self):
+        return [os.path.join(self.outputPath, name) for name in self.latest["files"]]
+
+    def _verify(self, i):
+        """Check the checksum of saved file `i` (once per file and rank); returns its name."""
+        filename = self._files()[i]
+        if filename not in self._verified:
+            if file_checksum(filename) != self.latest["checksums"][i]:
+                raise RuntimeError(f"Checksum mismatch for restart file {filename}")
+            self._verified.add(filename)
+
+        return filename
+
+    def _own_file(self, verify=True):
+        """This rank's checkpoint file, if the run has the same decomposition."""
+        if self.latest["nprocs"] != uw.mpi.size:
+            return None
+
+        return self._verify(uw.mpi.rank) if verify else self._files()[uw.mpi.rank]
+
+    def restore_mesh_variables(self, meshVars, verify=True):
+        """
+        Set `meshVars` from the latest checkpoint. Each rank copies its own
+        data straight back when the partition is unchanged, otherwise values
+        are matched to the nearest saved node.
+        """
+        filename = self._own_file(verify)
+
+        for var in meshVars:
+            name = var.clean_name
+
+            data = None
+            if filename is not None:
+                with h5py.File(filename, "r") as h5:
+                    coords = h5[f"mesh/{name}/coords"][...]
+                    if coords.shape == var.coords.shape and np.allclose(coords, var.coords):
+                        data = h5[f"mesh/{name}/data"][...]
+
+            if data is None:
+                data = self._mesh_data_by_coordinates(name, var.coords, verify)
+
+            with var.mesh.access(var):
+                var.data[...] = data
+
+    def _mesh_data_by_coordinates(self, name, coords, verify=True):
+        from scipy.spatial import cKDTree
+
+        saved_coords, saved_data = [], []
+        for i, filename in enumerate(self._files()):
+            if verify:
+                self._verify(i)
+            with h5py.File(filename, "r") as h5:
+                saved_coords.append(h5[f"mesh/{name}/coords"][...])
+                saved_data.append(h5[f"mesh/{name}/data"][...])
+
+        _, index = cKDTree(np.concatenate(saved_coords)).query(coords)
+
+        return np.concatenate(saved_data)[index]
+
+    def _swarm_slab(self, swarm, name, swarmVars, verify):
+        """
+        This rank's share of the saved particles of swarm `name`: its own
+        file if the decomposition is unchanged, otherwise a balanced,
+        contiguous range of the particles across all the saved files. Each
+        file read is opened once, and its checksum verified first.
+        """
+        filename = self._own_file(verify)
+        if filename is not None:
+            with h5py.File(filename, "r") as h5:
+                group = h5[f"swarms/{name}"]
+                coords = group["coords"][...]
+                values = {var: group[var.clean_name][...] for var in swarmVars}
+
+            return coords, values
+
+        files = self._files()
+
+        ### particle counts per file, from the metadata only, read on rank 0
+        counts = None
+        if uw.mpi.rank == 0:
+            counts = []
+            for filename in files:
+                with h5py.File(filename, "r") as h5:
+                    counts.append(h5[f"swarms/{name}/coords"].shape[0])
+        counts = self.comm.bcast(counts, root=0)
+        file_start = np.concatenate([[0], np.cumsum(counts)])
+
+        start, stop = _balanced_range(file_start[-1], uw.mpi.rank, uw.mpi.size)
+
+        coords, values = [], {var: [] for var in swarmVars}
+        for i, filename in enumerate(files):
+            lo, hi = max(start, file_start[i]), min(stop, file_start[i + 1])
+            if lo >= hi:
+                continue
+
+            if verify:
+                self._verify(i)
+            with h5py.File(filename, "r") as h5:
+                group = h5[f"swarms/{name}"]
+                lo, hi = lo - file_start[i], hi - file_start[i]
+                coords.append(group["coords"][lo:hi])
+                for var in swarmVars:
+                    values[var].append(group[var.clean_name][lo:hi])
+
+        coords = np.concatenate(coords) if coords else np.zeros((0, swarm.mesh.dim))
+        values = {
+            var: np.concatenate(data) if data else np.zeros((0, var.num_components)) for var, data in values.items()
+        }
+
+        return coords, values
+
+    def restore_swarm(self, swarm, swarmVars, name, verify=True):
+        """
+        Add the particles of swarm `name` and set `swarmVars` from the latest
+        checkpoint. Each rank reads one slab of particles, keeps the ones in
+        its partition and sends on only the rest.
+        """
+        coords, values = self._swarm_slab(swarm, name, swarmVars, verify)
+
+        accepted = add_particles(swarm, coords, values)
+
+        outside = ~accepted
+        if self.comm.allreduce(int(outside.sum())) > 0:
+            redistribute_particles(swarm, coords[outside], {var: data[outside] for var, data in values.items()})
+
+    def restore_arrays(self):
+        """Small arrays saved with the checkpoint (written by rank 0)."""
+        arrays = None
+        if uw.mpi.rank == 0:
+            with h5py.File(self._files()[0], "r") as h5:
+                arrays = {name: dset[...] for name, dset in h5.get("arrays", {}).items()}
+
+        return self.comm.bcast(arrays, root=0)
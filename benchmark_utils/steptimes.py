@@ -0,0 +1,239 @@
+"""
+Cost of every time step of a long run.
+
+`PhaseProfiler` (benchmark_utils/profiling.py) accumulates the time of each
+phase over the whole run, which hides whether the solve time drifts as the
+viscosity structure evolves or a few steps are much slower than the rest.
+A `StepRecorder` takes the profiler's accumulated timings at the end of
+every step and keeps the difference to the previous step, so the time
+loops only need one extra call:
+
+    steps = StepRecorder(profiler, f'{outputPath}step_times.npz')
+
+    while step < nsteps:
+        with profiler.phase('solve'):
+            stokes.solve()
+        ...
+        steps.end_step(step, time)
+        step += 1
+
+    steps.save()
+
+The file holds `step`, `time`, the phase names and two (steps x phases)
+arrays of seconds: the slowest rank (`seconds`) and the mean over the
+ranks (`seconds_mean`), whose ratio is the load imbalance of a phase. It
+is rewritten every `save_every` steps, so a run that dies still leaves its
+step times behind. The summary reports the trend and the outlier steps of
+each phase, and plots the cost per step:
+
+    python -m benchmark_utils.steptimes output/step_times.npz
+    python -m benchmark_utils.steptimes output/step_times.npz --plot step_times.png --threshold 4
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+
+class StepRecorder:
+    """
+    Per-step wall time of the phases of `profiler`, written to `filename`
+    (.npz) by `save`. `end_step` and `save` are collective.
+    """
+
+    def __init__(self, profiler, filename, save_every=10):
+        self.profiler = profiler
+        self.filename = filename
+        self.save_every = save_every
+
+        self.steps = []
+        self.times = []
+        self.rows = []
+        self._previous = dict(profiler.timings)
+
+    def end_step(self, step, time=np.nan):
+        """Record the time spent in each phase since the previous call (or since construction)."""
+        timings = self.profiler.timings
+        self.rows.append({name: seconds - self._previous.get(name, 0.0) for name, seconds in timings.items()})
+        self._previous = dict(timings)
+
+        self.steps.append(step)
+        self.times.append(time)
+
+        if self.save_every and len(self.rows) % self.save_every == 0:
+            self.save()
+
+    def arrays(self):
+        """(phases, seconds on the slowest rank, mean seconds over the ranks). Collective."""
+        import underworld3 as uw
+        from mpi4py import MPI
+
+        comm = uw.mpi.comm
+
+        ### the same columns on every rank, in case a phase only ran on some of them
+        phases = sorted(set().union(*comm.allgather(sorted(set().union(*self.rows)))))
+
+        local = np.zeros((len(self.rows), len(phases)))
+        for i, row in enumerate(self.rows):
+            for j, phase in enumerate(phases):
+                local[i, j] = row.get(phase, 0.0)
+
+        slowest = np.zeros_like(local)
+        total = np.zeros_like(local)
+        comm.Allreduce(local, slowest, op=MPI.MAX)
+        comm.Allreduce(local, total, op=MPI.SUM)
+
+        return phases, slowest, total / uw.mpi.size
+
+    def save(self):
+        import underworld3 as uw
+
+        phases, slowest, mean = self.arrays()
+
+        if uw.mpi.rank == 0:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            np.savez_compressed(
+                self.filename,
+                step=np.array(self.steps, dtype=np.int64),
+                time=np.array(self.times, dtype=float),
+                phases=np.array(phases),
+                seconds=slowest.astype(np.float32),
+                seconds_mean=mean.astype(np.float32),
+                nprocs=uw.mpi.size,
+            )
+
+
+def load(filename):
+    """{"step", "time", "phases", "seconds", "seconds_mean", "nprocs"} from a step times file."""
+    with np.load(filename) as data:
+        return {
+            "step": data["step"],
+            "time": data["time"],
+            "phases": [str(phase) for phase in data["phases"]],
+            "seconds": data["seconds"].astype(float),
+            "seconds_mean": data["seconds_mean"].astype(float),
+            "nprocs": int(data["nprocs"]),
+        }
+
+
+def outliers(seconds, threshold=5.0):
+    """
+    Indices of the steps whose time is more than `threshold` robust standard
+    deviations (1.4826 times the median absolute deviation) above the median.
+    Steps in which the phase did not run (io every few steps, the first
+    solve) are left out of the statistics.
+    """
+    seconds = np.asarray(seconds, dtype=float)
+    active = np.flatnonzero(seconds > 0)
+    if active.size < 3:
+        return np.array([], dtype=int)
+
+    median = np.median(seconds[active])
+    spread = 1.4826 * np.median(np.abs(seconds[active] - median))
+    ### phases of near-constant cost: don't flag jitter of a few percent
+    spread = max(spread, 0.01 * median)
+
+    return active[seconds[active] - median > threshold * spread]
+
+
+def trend(steps, seconds, exclude=()):
+    """
+    Relative change of the cost per step over the run: the least-squares
+    slope (outlier steps and steps without the phase excluded) times the
+    number of steps, divided by the median cost. 0.2 means the last steps
+    take about 20% longer than the first.
+    """
+    keep = np.asarray(seconds, dtype=float) > 0
+    keep[list(exclude)] = False
+    steps = np.asarray(steps, dtype=float)[keep]
+    seconds = np.asarray(seconds, dtype=float)[keep]
+
+    median = np.median(seconds) if seconds.size else 0.0
+    if seconds.size < 3 or median <= 0 or np.ptp(steps) == 0:
+        return 0.0
+
+    slope = np.polyfit(steps, seconds, 1)[0]
+
+    return slope * np.ptp(steps) / median
+
+
+def summary(data, threshold=5.0):
+    """
+    Text table of the cost per step of each phase (median over the steps in
+    which it ran), its trend, load imbalance (slowest rank / mean) and
+    outlier steps.
+    """
+    steps = data["step"]
+    columns = list(data["phases"]) + ["total"]
+    seconds = np.column_stack([data["seconds"], data["seconds"].sum(axis=1)])
+    mean = np.column_stack([data["seconds_mean"], data["seconds_mean"].sum(axis=1)])
+
+    lines = [
+        f"{len(steps)} steps ({steps[0]} to {steps[-1]}) on {data['nprocs']} ranks" if len(steps) else "no steps",
+        f"{'phase':>26} {'median [s]':>11} {'max [s]':>9} {'sum [s]':>9} {'trend':>7} {'imbalance':>10}  outlier steps",
+    ]
+    for j, phase in enumerate(columns):
+        values = seconds[:, j]
+        flagged = outliers(values, threshold)
+        imbalance = values.sum() / mean[:, j].sum() if mean[:, j].sum() > 0 else 1.0
+        active = values[values > 0]
+        lines.append(
+            f"{phase:>26} {np.median(active) if active.size else 0.0:>11.3f} {values.max():>9.3f} {values.sum():>9.2f} "
+            f"{trend(steps, values, flagged):>+7.0%} {imbalance:>10.2f}  "
+            + " ".join(f"{steps[i]} ({values[i]:.2f} s)" for i in flagged)
+        )
+
+    return "\n".join(lines)
+
+
+def plot(data, filename, threshold=5.0):
+    """Cost per step of each phase, with the outlier steps marked."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    steps = data["step"]
+
+    fig, ax = plt.subplots(figsize=(9, 5))
+    for j, phase in enumerate(data["phases"]):
+        values = data["seconds"][:, j]
+        if not values.any():
+            continue
+        ### gaps where the phase did not run
+        line, = ax.plot(steps, np.where(values > 0, values, np.nan), ".-", label=phase)
+        flagged = outliers(values, threshold)
+        ax.plot(steps[flagged], values[flagged], "o", color=line.get_color(), markerfacecolor="none")
+
+    total = data["seconds"].sum(axis=1)
+    ax.plot(steps, total, "k--", label="total")
+
+    ax.set_xlabel("step")
+    ax.set_ylabel("wall time per step [s] (slowest rank)")
+    ax.set_yscale("log")
+    ax.legend(fontsize="small", ncol=2)
+    ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(filename, dpi=150)
+    plt.close(fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost per time step of a benchmark run.")
+    parser.add_argument("file", help="step times file written by StepRecorder")
+    parser.add_argument("--threshold", type=float, default=5.0,
+                        help="flag steps this many robust standard deviations above the median")
+    parser.add_argument("--plot", default=None, metavar="PNG", help="plot the cost per step to this file")
+    args = parser.parse_args(argv)
+
+    data = load(args.file)
+    print(summary(data, args.threshold))
+
+    if args.plot is not None:
+        plot(data, args.plot, args.threshold)
+        print(f"Plot written to {args.plot}")
+
+
+if __name__ == "__main__":
+    main()
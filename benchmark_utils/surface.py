@@ -0,0 +1,234 @@
+"""
+Distributed evolution of a 2D model surface, h(x) on a line of nodes.
+
+The thrust wedge tracked its surface with a passive swarm whose
+coordinates and velocities were gathered to every rank each step, advected
+and re-interpolated in serial. `SurfaceEvolution` keeps the surface as the
+heights of a fixed row of nodes x_i, held by a swarm, so each node lives on
+the rank that owns the part of the mesh it is in and moves with the
+partition. A step
+
+- evaluates the velocity at the local nodes (no gather),
+- advects the heights with the kinematic surface equation
+  dh/dt = v_y - v_x dh/dx (upwind, sub-stepped to the node spacing),
+- diffuses them, (1 - dt kappa d2/dx2) h = h*, with a tridiagonal solve of
+  each rank's nodes, repeated `sweeps` times with the neighbours' values
+  updated in between (block Jacobi; the sides are zero flux),
+
+and only exchanges the end values of each rank's stretch of nodes with the
+ranks next to it:
+
+    surface = SurfaceEvolution(mesh, n_nodes=500, height=0.0, diffusivity=nd(1e-6*u.meter**2/u.second))
+
+    surface.advance(v.sym, dt)
+    x, h = surface.gather()              # the whole surface, on rank 0
+
+The swarm (`surface.swarm`) can be checkpointed like any other.
+"""
+
+import math
+
+import numpy as np
+from mpi4py import MPI
+
+import underworld3 as uw
+
+
+def _runs(indices):
+    """[(first, last), ...] of the contiguous runs in sorted `indices`."""
+    if indices.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > 1)
+    starts = np.concatenate([[indices[0]], indices[breaks + 1]])
+    ends = np.concatenate([indices[breaks], [indices[-1]]])
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+class SurfaceEvolution:
+    """
+    Heights of the surface at `n_nodes` equally spaced x between the sides
+    of the 2D box `mesh`, advected by a velocity field and smoothed by
+    linear (hillslope) diffusion with `diffusivity`. `height` is the
+    initial height, a number or a numpy function of x. `advance` and
+    `gather` are collective.
+    """
+
+    def __init__(self, mesh, n_nodes=500, height=0.0, diffusivity=0.0, sweeps=2, courant=0.5):
+        self.mesh = mesh
+        self.n_nodes = n_nodes
+        self.diffusivity = diffusivity
+        self.sweeps = sweeps
+        self.courant = courant
+
+        comm = uw.mpi.comm
+        with mesh.access():
+            x_min = comm.allreduce(mesh.data[:, 0].min(), op=MPI.MIN)
+            x_max = comm.allreduce(mesh.data[:, 0].max(), op=MPI.MAX)
+        self.x = np.linspace(x_min, x_max, n_nodes)
+        self.dx = self.x[1] - self.x[0]
+
+        h0 = height(self.x) if callable(height) else np.full(n_nodes, float(height))
+
+        ### the end nodes a hair inside the sides, so the point location finds them
+        x_nodes = self.x.copy()
+        x_nodes[0] += 1.0e-9 * self.dx
+        x_nodes[-1] -= 1.0e-9 * self.dx
+
+        self.swarm = uw.swarm.Swarm(mesh)
+        self.swarm.add_particles_with_coordinates(np.ascontiguousarray(np.column_stack([x_nodes, h0])))
+
+    def _local(self):
+        """(node index, coordinates) of the local swarm points."""
+        with self.swarm.access():
+            coords = np.array(self.swarm.data[:, 0:2])
+        index = np.clip(np.rint((coords[:, 0] - self.x[0]) / self.dx).astype(np.int64), 0, self.n_nodes - 1)
+        return index, coords
+
+    def _plan(self, local):
+        """
+        Which nodes this rank owns and which it receives from or sends to
+        whom. A node held by several ranks (on a partition boundary) is owned
+        by the lowest; the others receive its value like a halo node.
+        """
+        comm = uw.mpi.comm
+        rank = uw.mpi.rank
+
+        runs = comm.allgather(_runs(local))
+
+        owner = np.full(self.n_nodes, -1, dtype=np.int64)
+        held = []
+        for q in reversed(range(len(runs))):
+            mask = np.zeros(self.n_nodes, dtype=bool)
+            for first, last in runs[q]:
+                mask[first : last + 1] = True
+            owner[mask] = q
+            held.append(mask)
+        held = held[::-1]
+
+        def needs(q):
+            """Nodes rank q reads but does not own: the neighbours of its nodes and its duplicates."""
+            owned = held[q] & (owner == q)
+            reads = held[q].copy()
+            reads[1:] |= owned[:-1]
+            reads[:-1] |= owned[1:]
+            return np.flatnonzero(reads & (owner != q) & (owner >= 0))
+
+        receive = {}
+        for i in needs(rank):
+            receive.setdefault(int(owner[i]), []).append(i)
+
+        send = {}
+        for q in range(len(runs)):
+            if q == rank:
+                continue
+            wanted = needs(q)
+            wanted = wanted[owner[wanted] == rank]
+            if wanted.size:
+                send[q] = wanted
+
+        owned = np.flatnonzero(held[rank] & (owner == rank))
+        return owned, {q: np.array(i) for q, i in receive.items()}, send
+
+    def _exchange(self, values, plan):
+        """Fill in `values` (length n_nodes) at the nodes received from other ranks."""
+        comm = uw.mpi.comm
+        _, receive, send = plan
+
+        requests = [comm.isend(values[indices], dest=q, tag=77) for q, indices in send.items()]
+        for q, indices in receive.items():
+            values[indices] = comm.recv(source=q, tag=77)
+        for request in requests:
+            request.wait()
+
+        return values
+
+    def _advect(self, h, u, w, owned, plan, dt):
+        """Upwind kinematic update of the owned nodes, sub-stepped to `courant` of the node spacing."""
+        speed = float(np.abs(u[owned]).max()) if owned.size else 0.0
+        n_sub = max(1, int(math.ceil(uw.mpi.comm.allreduce(speed, op=MPI.MAX) * dt / (self.courant * self.dx))))
+        tau = dt / n_sub
+
+        left = np.maximum(owned - 1, 0)
+        right = np.minimum(owned + 1, self.n_nodes - 1)
+        for _ in range(n_sub):
+            self._exchange(h, plan)
+            backward = (h[owned] - h[left]) / self.dx
+            forward = (h[right] - h[owned]) / self.dx
+            backward[owned == 0] = forward[owned == 0]
+            forward[owned == self.n_nodes - 1] = backward[owned == self.n_nodes - 1]
+            slope = np.where(u[owned] > 0, backward, forward)
+            h[owned] = h[owned] + tau * (w[owned] - u[owned] * slope)
+
+        return h
+
+    def _diffuse(self, h, owned, plan, dt):
+        """Implicit diffusion of the owned nodes, the other ranks' values lagged by one sweep."""
+        from scipy.linalg import solve_banded
+
+        r = self.diffusivity * dt / self.dx**2
+        source = h[owned].copy()
+        last = self.n_nodes - 1
+
+        ### (1 + 2r) h_i - r (h_i-1 + h_i+1) = h*_i; zero flux at the sides (mirror node)
+        diagonal = np.full(owned.size, 1 + 2 * r)
+        upper = np.where(owned + 1 <= last, -r, 0.0)
+        lower = np.where(owned - 1 >= 0, -r, 0.0)
+        upper[owned == 0] = -2 * r
+        lower[owned == last] = -2 * r
+
+        ### couple only neighbours owned here, the rest goes to the right hand side
+        next_owned = np.concatenate([np.diff(owned) == 1, [False]])
+        previous_owned = np.concatenate([[False], np.diff(owned) == 1])
+
+        ab = np.zeros((3, owned.size))
+        ab[0, 1:] = np.where(next_owned[:-1], upper[:-1], 0.0)
+        ab[1] = diagonal
+        ab[2, :-1] = np.where(previous_owned[1:], lower[1:], 0.0)
+
+        for _ in range(self.sweeps):
+            self._exchange(h, plan)
+            rhs = source.copy()
+            outside_right = ~next_owned & (owned < last)
+            outside_left = ~previous_owned & (owned > 0)
+            rhs[outside_right] -= upper[outside_right] * h[owned[outside_right] + 1]
+            rhs[outside_left] -= lower[outside_left] * h[owned[outside_left] - 1]
+            if owned.size:
+                h[owned] = solve_banded((1, 1), ab, rhs)
+
+        return h
+
+    def advance(self, velocity, dt):
+        """Move the surface over `dt` in the velocity field `velocity` (sympy vector, e.g. v.sym). Collective."""
+        index, coords = self._local()
+        local = np.unique(index)
+        plan = self._plan(local)
+        owned = plan[0]
+
+        h = np.full(self.n_nodes, np.nan)
+        u = np.zeros(self.n_nodes)
+        w = np.zeros(self.n_nodes)
+        h[index] = coords[:, 1]
+        if index.size:
+            u[index] = np.asarray(uw.function.evalf(velocity[0], coords)).reshape(-1)
+            w[index] = np.asarray(uw.function.evalf(velocity[1], coords)).reshape(-1)
+
+        h = self._advect(h, u, w, owned, plan, dt)
+        if self.diffusivity > 0:
+            h = self._diffuse(h, owned, plan, dt)
+
+        ### duplicates on other ranks take the owner's value
+        self._exchange(h, plan)
+        with self.swarm.access(self.swarm.particle_coordinates):
+            self.swarm.particle_coordinates.data[:, 1] = h[index]
+
+    def gather(self, root=0):
+        """(x, h) of the whole surface on rank `root` (None elsewhere). Collective."""
+        index, coords = self._local()
+        blocks = uw.mpi.comm.gather((index, coords[:, 1]), root=root)
+        if uw.mpi.rank != root:
+            return None, None
+
+        h = np.full(self.n_nodes, np.nan)
+        for i, values in blocks:
+            h[i] = values
+        return self.x.copy(), h
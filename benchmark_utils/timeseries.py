@@ -0,0 +1,202 @@
+"""
+Single-file time-series output for mesh variables.
+
+`mesh.petsc_save_checkpoint(index=step, ...)` writes a new .h5/.xmf set per
+step and per variable. `TimeSeriesWriter` instead writes the mesh geometry
+and topology once and appends each step's variables to chunked, extendible
+datasets in one HDF5 container, with a single XDMF temporal collection
+pointing at hyperslabs of those datasets. Post-processing is then a single
+open of `<name>.xdmf`.
+
+Variables are stored at the mesh vertices (as the pyvista plots use them).
+Each rank writes its local vertices and cells; vertices on partition
+boundaries are stored once per rank that holds them, which is harmless for
+visualisation.
+
+When h5py is built against parallel HDF5 every rank writes its own slab
+collectively, otherwise the data are gathered to rank 0.
+"""
+
+import os
+
+import numpy as np
+import h5py
+
+import underworld3 as uw
+
+from .topology import local_cells, local_vertices, xdmf_cell_type
+
+
+class TimeSeriesWriter:
+    """
+    Append mesh variables to `{outputPath}{name}.h5` each call to `write`.
+
+    mesh     - mesh the variables live on
+    meshVars - list of MeshVariables to write
+    name     - base name of the .h5 and .xdmf files
+    """
+
+    def __init__(self, outputPath, mesh, meshVars, name="timeseries"):
+        self.mesh = mesh
+        self.meshVars = list(meshVars)
+        self.h5_filename = os.path.join(outputPath, f"{name}.h5")
+        self.xdmf_filename = os.path.join(outputPath, f"{name}.xdmf")
+
+        self.comm = uw.mpi.comm
+        self.parallel_io = h5py.get_config().mpi and uw.mpi.size > 1
+
+        self.times = []
+        self.steps = []
+
+        self._setup()
+
+    def _slab(self, n):
+        """Offset of this rank's block of `n` rows and the global row count."""
+        ### exscan is collective; rank 0 gets None back
+        offset = self.comm.exscan(n) or 0
+        total = self.comm.allreduce(n)
+
+        return offset, total
+
+    def _open(self, mode):
+        if self.parallel_io:
+            return h5py.File(self.h5_filename, mode, driver="mpio", comm=self.comm)
+
+        return h5py.File(self.h5_filename, mode)
+
+    def _write_rows(self, h5, path, local, offset, total, time_index=None):
+        """Write (or gather and write) each rank's rows into dataset `path`."""
+        if self.parallel_io:
+            dset = h5[path]
+            if time_index is None:
+                dset[offset : offset + local.shape[0]] = local
+            else:
+                dset[time_index, offset : offset + local.shape[0]] = local
+            return
+
+        blocks = self.comm.gather(local, root=0)
+        if uw.mpi.rank == 0:
+            dset = h5[path]
+            if time_index is None:
+                dset[...] = np.concatenate(blocks)
+            else:
+                dset[time_index] = np.concatenate(blocks)
+
+    def _setup(self):
+        vertices = local_vertices(self.mesh)
+        cells = local_cells(self.mesh)
+
+        self.n_vertices = vertices.shape[0]
+        self.vertex_offset, self.total_vertices = self._slab(self.n_vertices)
+        cell_offset, total_cells = self._slab(cells.shape[0])
+
+        self.n_components = {}
+        for var in self.meshVars:
+            ### 2D vectors are padded to 3 components so they read as XDMF vectors
+            n = var.num_components
+            self.n_components[var.clean_name] = 3 if n == 2 else n
+
+        ### geometry and topology are only written once
+        h5 = self._open("w") if (self.parallel_io or uw.mpi.rank == 0) else None
+
+        if h5 is not None:
+            h5.create_dataset("geometry/vertices", shape=(self.total_vertices, 3), dtype="f8")
+            h5.create_dataset("topology/cells", shape=(total_cells, cells.shape[1]), dtype="i8")
+            h5.create_dataset("time", shape=(0,), maxshape=(None,), dtype="f8")
+            for name, n in self.n_components.items():
+                h5.create_dataset(
+                    f"fields/{name}",
+                    shape=(0, self.total_vertices, n),
+                    maxshape=(None, self.total_vertices, n),
+                    chunks=(1, min(self.total_vertices, 65536), n),
+                    dtype="f8",
+                )
+
+        self._write_rows(h5, "geometry/vertices", vertices, self.vertex_offset, self.total_vertices)
+        self._write_rows(h5, "topology/cells", cells + self.vertex_offset, cell_offset, total_cells)
+
+        if h5 is not None:
+            h5.close()
+
+        self.total_cells = total_cells
+        self.nodes_per_cell = cells.shape[1]
+        self.cell_type = xdmf_cell_type(self.mesh)
+
+    def _vertex_values(self, var):
+        values = np.zeros((self.n_vertices, self.n_components[var.clean_name]))
+        evaluated = uw.function.evalf(var.sym, self.mesh.data).reshape(self.n_vertices, -1)
+        values[:, 0 : evaluated.shape[1]] = evaluated
+
+        return values
+
+    def write(self, step, time):
+        """Append the current values of the variables as a new time level."""
+        time_index = len(self.times)
+        ### numpy scalars repr as np.float64(...) under numpy 2, which is not valid XDMF
+        time = float(time)
+
+        values = {var.clean_name: self._vertex_values(var) for var in self.meshVars}
+
+        h5 = self._open("a") if (self.parallel_io or uw.mpi.rank == 0) else None
+
+        if h5 is not None:
+            h5["time"].resize((time_index + 1,))
+            h5["time"][time_index] = time
+            for name in values:
+                h5[f"fields/{name}"].resize(time_index + 1, axis=0)
+
+        for name, local in values.items():
+            self._write_rows(h5, f"fields/{name}", local, self.vertex_offset, self.total_vertices, time_index)
+
+        if h5 is not None:
+            h5.close()
+
+        self.times.append(time)
+        self.steps.append(step)
+
+        if uw.mpi.rank == 0:
+            self._write_xdmf()
+
+    def _write_xdmf(self):
+        h5_name = os.path.basename(self.h5_filename)
+        nt = len(self.times)
+        nv = self.total_vertices
+
+        lines = [
+            '<?xml version="1.0" ?>',
+            '<Xdmf Version="3.0">',
+            "  <Domain>",
+            '    <Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">',
+        ]
+
+        for i, (step, time) in enumerate(zip(self.steps, self.times)):
+            lines += [
+                f'      <Grid Name="step_{step:05d}" GridType="Uniform">',
+                f'        <Time Value="{float(time)!r}"/>',
+                f'        <Topology TopologyType="{self.cell_type}" NumberOfElements="{self.total_cells}">',
+                f'          <DataItem Dimensions="{self.total_cells} {self.nodes_per_cell}" NumberType="Int" Precision="8" Format="HDF">{h5_name}:/topology/cells</DataItem>',
+                "        </Topology>",
+                '        <Geometry GeometryType="XYZ">',
+                f'          <DataItem Dimensions="{nv} 3" Format="HDF">{h5_name}:/geometry/vertices</DataItem>',
+                "        </Geometry>",
+            ]
+
+            for name, n in self.n_components.items():
+                attribute_type = "Scalar" if n == 1 else ("Vector" if n == 3 else "Matrix")
+                lines += [
+                    f'        <Attribute Name="{name}" AttributeType="{attribute_type}" Center="Node">',
+                    f'          <DataItem ItemType="HyperSlab" Dimensions="{nv} {n}">',
+                    f'            <DataItem Dimensions="3 3" Format="XML">{i} 0 0 1 1 1 1 {nv} {n}</DataItem>',
+                    f'            <DataItem Dimensions="{nt} {nv} {n}" Format="HDF">{h5_name}:/fields/{name}</DataItem>',
+                    "          </DataItem>",
+                    "        </Attribute>",
+                ]
+
+            lines.append("      </Grid>")
+
+        lines += ["    </Grid>", "  </Domain>", "</Xdmf>", ""]
+
+        tmp_filename = self.xdmf_filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            f.write("\n".join(lines))
+        os.replace(tmp_filename, self.xdmf_filename)
@@ -0,0 +1,281 @@
+"""
+Local vertex coordinates, cell connectivity and boundary facets of a UW3 mesh.
+
+The connectivity is read from the DMPlex once and cached on the mesh, so
+output writers and visualisation do not have to round-trip through
+`mesh.vtk()` to get at it. `boundary_facets` does the same for the facets
+carrying a boundary label, so surface diagnostics can sample and integrate
+over "Top" or "Upper" without scanning the coordinates:
+
+    top = boundary_facets(meshbox, "Top")
+    values = top.evaluate(sigma_zz.sym[0], at="vertices")
+    coords, values = top.gather(values)             # the whole surface, on every rank
+    mean = top.integrate(sigma_zz.sym[0]) / top.length()
+"""
+
+import numpy as np
+
+
+### VTK / XDMF cell types keyed on (dim, vertices per cell)
+VTK_CELL_TYPES = {(2, 3): 5, (2, 4): 9, (3, 4): 10, (3, 8): 12}
+XDMF_CELL_TYPES = {(2, 3): "Triangle", (2, 4): "Quadrilateral", (3, 4): "Tetrahedron", (3, 8): "Hexahedron"}
+
+
+def local_cells(mesh):
+    """
+    Cell to vertex connectivity of the local part of the mesh, as indices
+    into `mesh.data`. Cached on the mesh as the topology does not change.
+    """
+    cells = getattr(mesh, "_benchmark_cells", None)
+    if cells is not None:
+        return cells
+
+    dm = mesh.dm
+    cStart, cEnd = dm.getHeightStratum(0)
+    vStart, vEnd = dm.getDepthStratum(0)
+
+    cell_list = []
+    for c in range(cStart, cEnd):
+        closure, _ = dm.getTransitiveClosure(c)
+        ### vertices come out of the closure in the (counter-clockwise) order VTK expects for simplices and quads
+        cell_list.append([pt - vStart for pt in closure if vStart <= pt < vEnd])
+
+    cells = np.array(cell_list, dtype=np.int64).reshape(cEnd - cStart, -1)
+
+    ### hexahedra are the one case where the plex closure and VTK orderings differ
+    if mesh.dim == 3 and cells.shape[1] == 8:
+        cells = cells[:, [0, 3, 2, 1, 4, 5, 6, 7]]
+
+    mesh._benchmark_cells = cells
+
+    return cells
+
+
+def local_vertices(mesh):
+    """Local vertex coordinates padded to 3D (what VTK and XDMF want)."""
+    vertices = np.zeros((mesh.data.shape[0], 3))
+    vertices[:, 0 : mesh.dim] = mesh.data[:, 0 : mesh.dim]
+
+    return vertices
+
+
+def vtk_cell_type(mesh):
+    return VTK_CELL_TYPES[(mesh.dim, local_cells(mesh).shape[1])]
+
+
+def xdmf_cell_type(mesh):
+    return XDMF_CELL_TYPES[(mesh.dim, local_cells(mesh).shape[1])]
+
+
+def _label_points(mesh, label):
+    """DMPlex points carrying boundary `label` (its own label, or its value in "Face Sets")."""
+    dm = mesh.dm
+
+    if dm.hasLabel(label):
+        values = dm.getLabelIdIS(label).getIndices()
+        strata = [dm.getStratumIS(label, value).getIndices() for value in values]
+    else:
+        value = mesh.boundaries[label].value
+        strata = [dm.getStratumIS("Face Sets", value).getIndices()]
+
+    return np.unique(np.concatenate(strata)) if strata else np.zeros(0, dtype=np.int64)
+
+
+def _ghost_points(dm):
+    """Local points owned by another rank."""
+    _, leaves, _ = dm.getPointSF().getGraph()
+    return set() if leaves is None else set(np.asarray(leaves).tolist())
+
+
+def _facet_quadrature(n_corners, degree):
+    """Shape function values at the points (rows) and weights of a facet quadrature rule, weights summing to 1."""
+    if n_corners == 2:
+        xi, w = np.polynomial.legendre.leggauss(max(1, (degree + 2) // 2))
+        shape = np.column_stack([(1 - xi) / 2, (1 + xi) / 2])
+        return shape, w / 2
+
+    if n_corners == 3:
+        if degree <= 1:
+            return np.array([[1 / 3, 1 / 3, 1 / 3]]), np.array([1.0])
+        shape = np.array([[2 / 3, 1 / 6, 1 / 6], [1 / 6, 2 / 3, 1 / 6], [1 / 6, 1 / 6, 2 / 3]])
+        return shape, np.full(3, 1 / 3)
+
+    ### quadrilateral, corners in cyclic order
+    xi, w = np.polynomial.legendre.leggauss(max(1, (degree + 2) // 2))
+    s, t = np.meshgrid((1 + xi) / 2, (1 + xi) / 2, indexing="ij")
+    s, t = s.ravel(), t.ravel()
+    shape = np.column_stack([(1 - s) * (1 - t), s * (1 - t), s * t, (1 - s) * t])
+    return shape, np.outer(w, w).ravel() / 4
+
+
+class BoundaryFacets:
+    """
+    The facets of the local part of `mesh` on one boundary label, from the
+    DMPlex labels (no coordinate tests), with everything needed to sample
+    or integrate over the boundary:
+
+        vertices         - indices into mesh.data of the boundary vertices
+        owned            - which of them this rank owns (count each vertex once)
+        vertex_coords    - their coordinates
+        facets           - (n, corners) vertex indices of each facet
+        cells            - the cell each facet belongs to
+        normals, areas   - outward unit normal and measure of each facet
+        quad_points      - quadrature points on the facets, quad_weights and
+                           quad_cells (owning cell of each point)
+
+    Evaluating a function exactly on the boundary can miss the cells in the
+    point location, so `evaluate` moves each point a fraction `inset` of the
+    way towards the centroid of the cell it belongs to. Facets use straight
+    edges between the vertices. Get them with `boundary_facets`, which
+    caches them on the mesh.
+    """
+
+    def __init__(self, mesh, label, quadrature_degree=2, inset=1.0e-6):
+        self.mesh = mesh
+        self.label = label
+        self.inset = inset
+
+        dm = mesh.dm
+        cStart, cEnd = dm.getHeightStratum(0)
+        fStart, fEnd = dm.getHeightStratum(1)
+        vStart, vEnd = dm.getDepthStratum(0)
+
+        points = _label_points(mesh, label)
+        ghosts = _ghost_points(dm)
+        coords = np.asarray(mesh.data)[:, 0 : mesh.dim]
+        centroids = coords[local_cells(mesh)].mean(axis=1)
+
+        def closure_vertices(point):
+            closure, _ = dm.getTransitiveClosure(point)
+            return [pt - vStart for pt in closure if vStart <= pt < vEnd]
+
+        facet_points = [pt for pt in points if fStart <= pt < fEnd]
+        if not facet_points:
+            ### only vertices are labelled: the boundary facets are those with all their vertices labelled
+            labelled = {pt - vStart for pt in points if vStart <= pt < vEnd}
+            facet_points = [
+                f for f in range(fStart, fEnd)
+                if dm.getSupportSize(f) == 1 and set(closure_vertices(f)) <= labelled
+            ]
+
+        ### owned facets are integrated over; ghost facets only contribute their vertices
+        facets, cells, ghost_facets, ghost_cells = [], [], [], []
+        for f in facet_points:
+            support = [c for c in dm.getSupport(f) if cStart <= c < cEnd]
+            if not support:
+                continue
+            if f in ghosts:
+                ghost_facets.append(closure_vertices(f))
+                ghost_cells.append(support[0] - cStart)
+            else:
+                facets.append(closure_vertices(f))
+                cells.append(support[0] - cStart)
+
+        corners = len((facets or ghost_facets)[0]) if facets or ghost_facets else mesh.dim
+        self.facets = np.array(facets, dtype=np.int64).reshape(-1, corners)
+        self.cells = np.array(cells, dtype=np.int64)
+        self._centroids = centroids
+
+        ### every boundary vertex in the local closure, owned by this rank if the vertex point is
+        all_facets = np.concatenate([self.facets, np.array(ghost_facets, dtype=np.int64).reshape(-1, corners)])
+        self.vertices = np.unique(all_facets)
+        self.owned = np.array([v + vStart not in ghosts for v in self.vertices], dtype=bool)
+        self.vertex_coords = coords[self.vertices]
+
+        ### a cell next to each boundary vertex, to evaluate at it from the inside (an owned facet's if there is one)
+        vertex_cell = {}
+        for facet, cell in zip(all_facets, np.concatenate([self.cells, np.array(ghost_cells, dtype=np.int64)])):
+            for v in facet:
+                vertex_cell.setdefault(v, cell)
+        self.vertex_cells = np.array([vertex_cell[v] for v in self.vertices], dtype=np.int64)
+
+        self._facet_geometry(coords, quadrature_degree)
+
+    def _facet_geometry(self, coords, degree):
+        dim = self.mesh.dim
+        corners = coords[self.facets]
+        n_facets, n_corners = self.facets.shape
+
+        if dim == 2:
+            tangent = corners[:, 1] - corners[:, 0]
+            self.areas = np.linalg.norm(tangent, axis=1)
+            normals = np.column_stack([tangent[:, 1], -tangent[:, 0]])
+        elif n_corners == 3:
+            normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            self.areas = np.linalg.norm(normals, axis=1) / 2
+        else:
+            normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1])
+            self.areas = np.linalg.norm(normals, axis=1) / 2
+
+        normals /= np.maximum(np.linalg.norm(normals, axis=1), 1.0e-300)[:, None]
+        outward = np.einsum("ij,ij->i", normals, corners.mean(axis=1) - self._centroids[self.cells])
+        normals[outward < 0] *= -1
+        self.normals = normals
+
+        shape, weights = _facet_quadrature(n_corners, degree)
+        self.quad_points = np.einsum("qc,fcd->fqd", shape, corners).reshape(-1, dim)
+        self.quad_weights = (self.areas[:, None] * weights[None, :]).ravel()
+        self.quad_cells = np.repeat(self.cells, shape.shape[0])
+
+    def inside(self, at="quadrature"):
+        """The quadrature points (or vertices) moved a fraction `inset` into their cells."""
+        if at == "vertices":
+            points, cells = self.vertex_coords, self.vertex_cells
+        else:
+            points, cells = self.quad_points, self.quad_cells
+
+        return points + self.inset * (self._centroids[cells] - points)
+
+    def evaluate(self, fn, at="quadrature"):
+        """Values of the sympy expression `fn` at the quadrature points (or vertices), one row per point."""
+        import underworld3 as uw
+
+        points = self.inside(at)
+        if points.shape[0] == 0:
+            return np.zeros((0,))
+
+        values = np.asarray(uw.function.evaluate(fn, points)).reshape(points.shape[0], -1)
+        return values[:, 0] if values.shape[1] == 1 else values
+
+    def integrate(self, fn):
+        """Integral of `fn` over the boundary (all ranks). Collective."""
+        import underworld3 as uw
+
+        values = self.evaluate(fn) if self.quad_points.shape[0] else np.zeros(0)
+        local = float(np.dot(self.quad_weights, values)) if values.size else 0.0
+
+        return uw.mpi.comm.allreduce(local)
+
+    def length(self):
+        """Measure of the boundary (all ranks). Collective."""
+        import underworld3 as uw
+
+        return uw.mpi.comm.allreduce(float(self.areas.sum()))
+
+    def gather(self, values, at="vertices"):
+        """
+        (coordinates, values) at the owned vertices (or quadrature points) of
+        every rank, on every rank. Collective.
+        """
+        import underworld3 as uw
+
+        if at == "vertices":
+            coords, values = self.vertex_coords[self.owned], np.asarray(values)[self.owned]
+        else:
+            coords, values = self.quad_points, np.asarray(values)
+
+        blocks = uw.mpi.comm.allgather((coords, values))
+        return np.concatenate([c for c, _ in blocks]), np.concatenate([v for _, v in blocks])
+
+
+def boundary_facets(mesh, label, quadrature_degree=2, inset=1.0e-6):
+    """The BoundaryFacets of `label` ("Top", "Upper", ...) on `mesh`, cached on the mesh."""
+    cache = getattr(mesh, "_benchmark_boundaries", None)
+    if cache is None:
+        cache = mesh._benchmark_boundaries = {}
+
+    key = (label, quadrature_degree, inset)
+    if key not in cache:
+        cache[key] = BoundaryFacets(mesh, label, quadrature_degree, inset)
+
+    return cache[key]
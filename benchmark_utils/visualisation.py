@@ -0,0 +1,165 @@
+"""
+Visualisation helpers for the benchmark scripts.
+
+`mesh_to_pyvista` builds a pyvista UnstructuredGrid straight from the DMPlex
+instead of writing the mesh with `mesh.vtk()` and reading it back with
+`pv.read()`. The grid is cached on the mesh and only rebuilt when the mesh
+coordinates change (e.g. a deforming mesh).
+
+`swarm_to_pyvista` plots a spatially stratified subsample of a swarm with a
+fixed point budget instead of every particle, and `rasterize_swarm` bins a
+swarm variable onto an image grid, so material plots stay interactive at
+production particle counts.
+"""
+
+import numpy as np
+
+import underworld3 as uw
+
+from .topology import local_cells, local_vertices, vtk_cell_type
+
+
+def mesh_to_pyvista(mesh, meshVars=None):
+    """
+    pyvista UnstructuredGrid of the local mesh.
+
+    meshVars - optional list of MeshVariables evaluated at the vertices and
+               added as point data under their names
+
+    A shallow copy of the cached grid is returned, so point data added by the
+    caller does not leak into later plots.
+    """
+    import pyvista as pv
+
+    cached = getattr(mesh, "_benchmark_pvmesh", None)
+
+    if cached is None or not np.array_equal(cached[0], mesh.data):
+        grid = pv.UnstructuredGrid({vtk_cell_type(mesh): local_cells(mesh)}, local_vertices(mesh))
+        cached = (np.array(mesh.data, copy=True), grid)
+        mesh._benchmark_pvmesh = cached
+
+    pvmesh = cached[1].copy(deep=False)
+
+    for var in meshVars or []:
+        values = uw.function.evalf(var.sym, mesh.data).reshape(mesh.data.shape[0], -1)
+        pvmesh.point_data[var.clean_name] = values[:, 0] if values.shape[1] == 1 else values
+
+    return pvmesh
+
+
+def write_vtk(mesh, filename, meshVars=None):
+    """Export the mesh (and optionally variables at the vertices) to a VTK file."""
+    mesh_to_pyvista(mesh, meshVars).save(filename)
+
+
+def stratified_subsample(coords, max_points, bins_per_axis=None, seed=0):
+    """
+    Indices of at most `max_points` of `coords`, spread evenly over space.
+
+    The bounding box is split into regular bins and the same number of
+    randomly chosen particles is kept from every bin, so sparse regions are
+    not thinned out the way a plain random subsample thins them.
+    """
+    n, dim = coords.shape
+    if n <= max_points:
+        return np.arange(n)
+
+    if bins_per_axis is None:
+        ### about 4 particles per bin
+        bins_per_axis = max(1, int((max_points / 4) ** (1.0 / dim)))
+
+    lower = coords.min(axis=0)
+    width = np.maximum(coords.max(axis=0) - lower, np.finfo(float).tiny)
+    ijk = np.minimum((bins_per_axis * (coords - lower) / width).astype(np.int64), bins_per_axis - 1)
+    bins = np.ravel_multi_index(ijk.T, (bins_per_axis,) * dim)
+
+    ### random order, then the position of each particle within its bin
+    order = np.random.default_rng(seed).permutation(n)
+    by_bin = order[np.argsort(bins[order], kind="stable")]
+    sorted_bins = bins[by_bin]
+    rank_in_bin = np.arange(n) - np.searchsorted(sorted_bins, sorted_bins, side="left")
+
+    ### largest per-bin quota that keeps the total within budget
+    occupancy = np.bincount(rank_in_bin)
+    quota = np.searchsorted(np.cumsum(occupancy), max_points, side="right")
+
+    return np.sort(by_bin[rank_in_bin < max(quota, 1)])
+
+
+def swarm_to_pyvista(swarm, swarmVars=None, max_points=200000, refresh=False):
+    """
+    pyvista PolyData of (a subsample of) the local particles.
+
+    swarmVars  - optional list of SwarmVariables added as point data under
+                 their names
+    max_points - point budget; above it a stratified subsample is plotted
+    refresh    - choose a new subsample even if the particle count is unchanged
+
+    The subsample is cached on the swarm and reused while the local particle
+    count stays the same, so repeated plots only copy `max_points` particles.
+    """
+    import pyvista as pv
+
+    cached = getattr(swarm, "_benchmark_subsample", None)
+
+    with swarm.access():
+        n = swarm.data.shape[0]
+
+        if refresh or cached is None or cached[0] != (n, max_points):
+            cached = ((n, max_points), stratified_subsample(swarm.data, max_points))
+            swarm._benchmark_subsample = cached
+
+        index = cached[1]
+
+        points = np.zeros((index.shape[0], 3))
+        points[:, 0 : swarm.data.shape[1]] = swarm.data[index]
+
+        cloud = pv.PolyData(points)
+
+        for var in swarmVars or []:
+            values = var.data[index]
+            cloud.point_data[var.clean_name] = values[:, 0] if values.shape[1] == 1 else values
+
+    return cloud
+
+
+def rasterize_swarm(swarm, var, resolution=512, index_variable=True):
+    """
+    pyvista ImageData of a swarm variable binned onto a regular 2D grid of
+    `resolution` pixels along the longer side.
+
+    index_variable - True for material indices (each pixel takes the most
+                     common index), False to average the values
+    Empty pixels are NaN.
+    """
+    import pyvista as pv
+
+    with swarm.access():
+        coords = swarm.data[:, 0:2].copy()
+        values = var.data[:, 0].copy()
+
+    lower = coords.min(axis=0)
+    extent = np.maximum(coords.max(axis=0) - lower, np.finfo(float).tiny)
+    spacing = extent.max() / resolution
+    shape = np.maximum(np.ceil(extent / spacing).astype(np.int64), 1)
+
+    ij = np.minimum(((coords - lower) / spacing).astype(np.int64), shape - 1)
+    pixel = ij[:, 0] + shape[0] * ij[:, 1]
+    n_pixels = shape[0] * shape[1]
+
+    count = np.bincount(pixel, minlength=n_pixels)
+
+    if index_variable:
+        indices = np.rint(values).astype(np.int64)
+        n_indices = indices.max() + 1
+        votes = np.bincount(pixel * n_indices + indices, minlength=n_pixels * n_indices)
+        image = votes.reshape(n_pixels, n_indices).argmax(axis=1).astype(float)
+    else:
+        image = np.bincount(pixel, weights=values, minlength=n_pixels) / np.maximum(count, 1)
+
+    image[count == 0] = np.nan
+
+    grid = pv.ImageData(dimensions=(shape[0] + 1, shape[1] + 1, 1), spacing=(spacing, spacing, 1.0), origin=(lower[0], lower[1], 0.0))
+    grid.cell_data[var.clean_name] = image
+
+    return grid